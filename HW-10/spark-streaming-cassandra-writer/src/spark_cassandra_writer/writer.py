@@ -5,7 +5,8 @@ import logging
 import os
 import time
 
-from cassandra.cluster import Cluster, Session
+from cassandra.cluster import EXEC_PROFILE_DEFAULT, Cluster, ExecutionProfile, Session
+from cassandra.policies import DCAwareRoundRobinPolicy, TokenAwarePolicy
 from dotenv import load_dotenv
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import col, from_json
@@ -33,6 +34,8 @@ SPARK_MASTER_URL = os.getenv("SPARK_MASTER_URL", "spark://spark-master:7077")
 CASSANDRA_HOST = os.getenv("CASSANDRA_HOST", "cassandra")
 CASSANDRA_KEYSPACE = os.getenv("CASSANDRA_KEYSPACE", "wikipedia")
 CASSANDRA_TABLE = os.getenv("CASSANDRA_TABLE", "page_creations")
+CASSANDRA_LOCAL_DC = os.getenv("CASSANDRA_LOCAL_DC")
+CASSANDRA_CONNECTIONS_PER_EXECUTOR = os.getenv("CASSANDRA_CONNECTIONS_PER_EXECUTOR", "2")
 
 
 def create_spark_session() -> SparkSession:
@@ -48,10 +51,13 @@ def create_spark_session() -> SparkSession:
                     "org.apache.spark:spark-sql-kafka-0-10_2.12:3.5.6,com.datastax.spark:spark-cassandra-connector_2.12:3.5.1")
             .config("spark.cassandra.connection.host", CASSANDRA_HOST)
             .config("spark.cassandra.connection.port", "9042")
+            .config("spark.cassandra.connection.compression", "LZ4")
+            .config("spark.cassandra.connection.localConnectionsPerExecutor", CASSANDRA_CONNECTIONS_PER_EXECUTOR)
             .config("spark.cores.max", "1")
             .config("spark.executor.memory", "1g")
             .config("spark.driver.memory", "1g")
             .config("spark.sql.streaming.checkpointLocation", CHECKPOINT_LOCATION)
+            .config("spark.cassandra.connection.localDC", CASSANDRA_LOCAL_DC or "datacenter1")
             # .master(SPARK_MASTER_URL)
             .getOrCreate())
 
@@ -84,8 +90,17 @@ def initialize_cassandra() -> Session:
 
     for i in range(max_retries):
         try:
-            # Connect to Cassandra
-            cluster = Cluster([CASSANDRA_HOST])
+            # Connect to Cassandra: token-aware routing to a replica in the local DC,
+            # protocol compression when lz4/snappy is installed
+            cluster = Cluster(
+                [CASSANDRA_HOST],
+                compression=True,
+                execution_profiles={
+                    EXEC_PROFILE_DEFAULT: ExecutionProfile(
+                        load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC))
+                    )
+                },
+            )
             session = cluster.connect()
             logger.info(f"Connected to Cassandra at {CASSANDRA_HOST}")
 
@@ -5,11 +5,13 @@
 
 import os
 from datetime import timedelta
+from functools import partial
 from pathlib import Path
 from typing import List, Dict
 
-import pandas as pd
-from analyze_ads_nosql.utils import gdrive_download, build_mongo_uri
+from analyze_ads_nosql.import_data.pipeline import (chunk_size_from_env, parse_chunk, read_line_chunks,
+                                                    resolve_csv, run_pipeline, writers_from_env)
+from analyze_ads_nosql.utils import build_mongo_uri
 from dotenv import load_dotenv
 from pymongo import MongoClient, InsertOne, ASCENDING, DESCENDING
 from pymongo.errors import BulkWriteError
@@ -81,49 +83,58 @@ def create_indexes(collection):
     collection.create_index([("impressions.campaign.targetingInterest", ASCENDING)])
 
 
+DTYPE_MAP = {
+    "EventID": "string", "AdvertiserName": "string",
+    "CampaignName": "string", "AdSlotSize": "string",
+    "Device": "string", "Location": "string", "WasClicked": "bool"
+}
+DATE_COLS = ["Timestamp", "ClickTimestamp", "CampaignStartDate", "CampaignEndDate"]
+
+
+def build_sessions(text: str, csv_sep: str, session_timeout: timedelta) -> List[Dict]:
+    """Стадія transform: парсинг CSV-блоку та збирання сесій (виконується в окремому процесі)."""
+    chunk = parse_chunk(text, dtype=DTYPE_MAP, parse_dates=DATE_COLS, sep=csv_sep)
+    chunk[["SlotW", "SlotH"]] = chunk["AdSlotSize"].str.split("x", expand=True).astype(int)
+
+    sessions_bulk: List[Dict] = []
+    for user_id, grp in chunk.sort_values(["UserID", "Timestamp"]).groupby("UserID"):
+        bag, start_ts, last_ts = [], None, None
+        for r in grp.itertuples(index=False):
+            if last_ts is None or r.Timestamp - last_ts > session_timeout:
+                flush_session(bag, user_id, start_ts, last_ts, sessions_bulk)
+                bag, start_ts = [], r.Timestamp
+            bag.append(build_impression(r))
+            last_ts = r.Timestamp
+        flush_session(bag, user_id, start_ts, last_ts, sessions_bulk)
+    return sessions_bulk
+
+
 def import_sessions() -> None:
     session_timeout = timedelta(minutes=int(os.getenv("SESSION_TIMEOUT_MINUTES", "30")))
-    gdrive_id = os.environ["GDRIVE_EVENTS_FILE_ID"]
     db_name = os.getenv("MONGO_DB", "AdTech")
     coll_name = "sessions"
     csv_sep = os.getenv("CSV_SEPARATOR", ",")
 
     project_root = Path(__file__).resolve().parent
     data_dir = project_root / "data"
-    csv_file = data_dir / "sessions.csv"
-    print(f"⬇️  Downloading CSV to {csv_file} …")
-    gdrive_download(gdrive_id, csv_file)
 
-    dtype_map = {
-        "EventID": "string", "AdvertiserName": "string",
-        "CampaignName": "string", "AdSlotSize": "string",
-        "Device": "string", "Location": "string", "WasClicked": "bool"
-    }
-    date_cols = ["Timestamp", "ClickTimestamp", "CampaignStartDate", "CampaignEndDate"]
+    # Reader-потік: локальний файл можна передати через EVENTS_CSV_PATH
+    def chunks():
+        csv_file = resolve_csv("EVENTS_CSV_PATH", "GDRIVE_EVENTS_FILE_ID", data_dir / "sessions.csv")
+        yield from read_line_chunks(csv_file, chunk_size_from_env(100_000))
 
     print("📖  Processing CSV in chunks …")
-    chunk_size = 100_000
     uri = build_mongo_uri(use_docker=True)
     client = MongoClient(uri)
     db = client[db_name]
     collection = db[coll_name]
 
-    for chunk in pd.read_csv(csv_file, dtype=dtype_map, parse_dates=date_cols, sep=csv_sep, chunksize=chunk_size):
-        chunk[["SlotW", "SlotH"]] = chunk["AdSlotSize"].str.split("x", expand=True).astype(int)
-
-        sessions_bulk: List[Dict] = []
-        for user_id, grp in chunk.sort_values(["UserID", "Timestamp"]).groupby("UserID"):
-            bag, start_ts, last_ts = [], None, None
-            for r in grp.itertuples(index=False):
-                if last_ts is None or r.Timestamp - last_ts > session_timeout:
-                    flush_session(bag, user_id, start_ts, last_ts, sessions_bulk)
-                    bag, start_ts = [], r.Timestamp
-                bag.append(build_impression(r))
-                last_ts = r.Timestamp
-            flush_session(bag, user_id, start_ts, last_ts, sessions_bulk)
-
-        if sessions_bulk:
-            insert_batches(collection, sessions_bulk, batch_size=1000)
+    def write(sessions_bulk: List[Dict]) -> int:
+        insert_batches(collection, sessions_bulk, batch_size=1000)
+        return len(sessions_bulk)
+
+    run_pipeline(chunks(), partial(build_sessions, csv_sep=csv_sep, session_timeout=session_timeout), write,
+                 n_writers=writers_from_env())
 
     create_indexes(collection)
     client.close()
@@ -3,13 +3,17 @@
 """
 
 import os
+from functools import partial
 from pathlib import Path
+from typing import Dict, List
 
-import pandas as pd
-from analyze_ads_nosql.utils import build_mongo_uri, gdrive_download, get_db_connection
+from analyze_ads_nosql.import_data.pipeline import (chunk_size_from_env, parse_chunk, read_line_chunks,
+                                                    resolve_csv, run_pipeline, writers_from_env)
+from analyze_ads_nosql.user_cache import bump_users_generation
+from analyze_ads_nosql.utils import build_mongo_uri, get_db_connection
 from dateutil import parser
 from dotenv import load_dotenv
-from pymongo import MongoClient, ASCENDING
+from pymongo import ASCENDING
 
 
 def row_to_document(row):
@@ -27,43 +31,52 @@ def row_to_document(row):
     }
 
 
+def transform_chunk(text: str, csv_sep: str) -> List[Dict]:
+    """Стадія transform: парсинг CSV-блоку та побудова документів (виконується в окремому процесі)."""
+    df = parse_chunk(text, sep=csv_sep)
+    return [row_to_document(r) for _, r in df.iterrows()]
+
+
 def import_users() -> None:
-    gdrive_id = os.environ["GDRIVE_USERS_FILE_ID"]
     db_name = os.getenv("MONGO_DB", "AdTech")
     coll_name = "users"
     csv_sep = os.getenv("CSV_SEPARATOR", ",")
 
-    # 1. Download
     project_root = Path(__file__).resolve().parent
     data_dir = project_root / "data"
-    csv_file = data_dir / "users.csv"
-    print(f"⬇️  Downloading CSV to {csv_file} …")
-    gdrive_download(gdrive_id, csv_file)
-
-    # 2. Read
-    print("📖  Reading file …")
-    df = pd.read_csv(csv_file, sep=csv_sep)
 
-    # 3. Transform
-    documents = [row_to_document(r) for _, r in df.iterrows()]
+    # 1. Download + Read (reader-потік): локальний файл можна передати через USERS_CSV_PATH
+    def chunks():
+        csv_file = resolve_csv("USERS_CSV_PATH", "GDRIVE_USERS_FILE_ID", data_dir / "users.csv")
+        yield from read_line_chunks(csv_file, chunk_size_from_env(50_000))
 
-    # 4. Insert
     uri = build_mongo_uri(use_docker=True)
     safe_uri_for_log = uri.replace(f":{os.getenv('MONGO_PASSWORD', '')}@", ":***@")
     print(f"Connecting to {safe_uri_for_log} …")
 
-    # Connect and insert
+    # Connect
     client, db = get_db_connection(uri, db_name)
     collection = db[coll_name]
-    result = client[db_name][coll_name].insert_many(documents)
 
-    print(f"Inserted {len(result.inserted_ids)} documents into '{coll_name}'.")
+    # 2. Transform (процес) + 3. Insert (потоки)
+    def write(documents: List[Dict]) -> int:
+        result = collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+
+    inserted = run_pipeline(chunks(), partial(transform_chunk, csv_sep=csv_sep), write,
+                            n_writers=writers_from_env())
+
+    print(f"Inserted {inserted} documents into '{coll_name}'.")
 
     # Create unique index
     collection.create_index(
         [("userId", ASCENDING)],
         unique=True)
 
+    # Інвалідуємо кеші профілів користувачів у запущених застосунках
+    bump_users_generation(db)
+    client.close()
+
 
 def main() -> None:
     load_dotenv()
@@ -0,0 +1,169 @@
+"""
+Конвеєр імпорту з трьох стадій, з'єднаних обмеженими чергами:
+   • reader  (потік)   – завантажує файл (або бере локальний) і нарізає його на блоки рядків
+   • transform (процес) – парсить CSV-блок і будує документи MongoDB
+   • writers (потоки)  – вставляють готові документи
+
+Поки writer вставляє блок N, transform уже парсить блок N+1, тож час імпорту
+визначається найповільнішою стадією, а не сумою всіх.
+"""
+
+import io
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+import pandas as pd
+from analyze_ads_nosql.utils import gdrive_download
+
+_DONE = "__done__"
+_ERROR = "__error__"
+
+
+def resolve_csv(local_path_env: str, gdrive_id_env: str, dst: Path) -> Path:
+    """Повертає шлях до CSV: локальний файл із `local_path_env` або завантажений з Google Drive."""
+    if local_path := os.getenv(local_path_env):
+        print(f"📄  Using local CSV {local_path} (download skipped)")
+        return Path(local_path)
+    print(f"⬇️  Downloading CSV to {dst} …")
+    gdrive_download(os.environ[gdrive_id_env], dst)
+    return dst
+
+
+def read_line_chunks(csv_file: Path, lines_per_chunk: int) -> Iterator[str]:
+    """Нарізає CSV на текстові блоки; кожен блок починається із заголовка."""
+    with open(csv_file, encoding="utf-8", newline="") as fh:
+        header = fh.readline()
+        lines: List[str] = []
+        for line in fh:
+            lines.append(line)
+            if len(lines) >= lines_per_chunk:
+                yield header + "".join(lines)
+                lines = []
+        if lines:
+            yield header + "".join(lines)
+
+
+def parse_chunk(text: str, **read_csv_kwargs) -> pd.DataFrame:
+    return pd.read_csv(io.StringIO(text), **read_csv_kwargs)
+
+
+def _transform_worker(transform: Callable, in_q, out_q, n_writers: int, cancel) -> None:
+    try:
+        while True:
+            try:
+                chunk = in_q.get(timeout=1)
+            except queue.Empty:
+                # Після збою writer-а reader може не встигнути передати сигнал кінця
+                if cancel.is_set():
+                    break
+                continue
+            if chunk is None or cancel.is_set():
+                break
+            docs = transform(chunk)
+            if docs:
+                out_q.put(docs)
+    except Exception:
+        out_q.put((_ERROR, traceback.format_exc()))
+    finally:
+        for _ in range(n_writers):
+            out_q.put(_DONE)
+
+
+def run_pipeline(chunks: Iterator[str],
+                 transform: Callable[[str], List[dict]],
+                 write: Callable[[List[dict]], int],
+                 n_writers: int = 2,
+                 queue_size: int = 4) -> int:
+    """
+    Запускає конвеєр reader → transform → writers.
+
+    `transform` має бути функцією рівня модуля (або `functools.partial` від неї),
+    оскільки виконується в окремому процесі. Повертає кількість вставлених документів.
+    """
+    raw_q = mp.Queue(maxsize=queue_size)
+    docs_q = mp.Queue(maxsize=queue_size)
+    errors: List[str] = []
+    inserted = [0] * n_writers
+    stop = threading.Event()
+    cancel = mp.Event()  # той самий сигнал зупинки для процесу transform
+
+    def fail(message: str):
+        errors.append(message)
+        stop.set()
+        cancel.set()
+
+    transformer = mp.Process(target=_transform_worker, args=(transform, raw_q, docs_q, n_writers, cancel),
+                             daemon=True)
+    transformer.start()
+
+    def reader():
+        try:
+            for n, chunk in enumerate(chunks, start=1):
+                while not stop.is_set():
+                    try:
+                        raw_q.put(chunk, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    break
+                print(f"📖  Read chunk {n}")
+        except Exception:
+            fail(traceback.format_exc())
+        finally:
+            # Сигнал кінця не можна втратити: інакше transform чекає на нього вічно й не надсилає _DONE
+            while transformer.is_alive():
+                try:
+                    raw_q.put(None, timeout=1)
+                    break
+                except queue.Full:
+                    if cancel.is_set():
+                        break  # transform завершиться сам, побачивши cancel
+
+    def writer(idx: int):
+        while True:
+            item = docs_q.get()
+            if item == _DONE:
+                return
+            if isinstance(item, tuple) and item[0] == _ERROR:
+                fail(item[1])
+                continue
+            if stop.is_set():
+                continue
+            try:
+                inserted[idx] += write(item)
+            except Exception:
+                fail(traceback.format_exc())
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=reader, name="reader", daemon=True)]
+    threads += [threading.Thread(target=writer, args=(i,), name=f"writer-{i}", daemon=True)
+                for i in range(n_writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    transformer.join()
+
+    if errors:
+        raw_q.cancel_join_thread()
+        raise RuntimeError("Import pipeline failed:\n" + "\n".join(errors))
+
+    total = sum(inserted)
+    elapsed = time.perf_counter() - started
+    print(f"⏱️  Pipeline finished: {total} documents in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} docs/s)")
+    return total
+
+
+def chunk_size_from_env(default: int) -> int:
+    return int(os.getenv("IMPORT_CHUNK_ROWS", str(default)))
+
+
+def writers_from_env(default: int = 2) -> int:
+    return int(os.getenv("IMPORT_WRITERS", str(default)))
@@ -3,7 +3,7 @@ import os
 
 import pymongo
 from analyze_ads_nosql.mongo_queries.ad_fatigue import get_query_4
-from analyze_ads_nosql.mongo_queries.ad_interactions import get_query_1
+from analyze_ads_nosql.mongo_queries.ad_interactions import execute_query_1
 from analyze_ads_nosql.mongo_queries.clicks_per_hour import execute_query_3
 from analyze_ads_nosql.mongo_queries.last_sessions import get_query_2
 from analyze_ads_nosql.mongo_queries.top_categories import get_query_5
@@ -29,7 +29,7 @@ def main():
     sessions_collection = db.sessions
 
     query_map = {
-        "1": ("Отримати всі рекламні взаємодії для конкретного користувача", get_query_1, True),
+        "1": ("Отримати всі рекламні взаємодії для конкретного користувача", execute_query_1, True),
         "2": ("Отримати останні 5 рекламних сесій користувача", get_query_2, True),
         "3": ("Кількість кліків за годину для кампаній (Advertiser_82)", execute_query_3, False),
         "4": ("Виявлення 'втоми від реклами'", get_query_4, False),
@@ -58,6 +58,10 @@ def main():
             if choice == "3":  # Особливий випадок
                 advertiser_name = Prompt.ask("Введіть ім'я рекламодавця", default="Advertiser_82")
                 results = query_func(sessions_collection, advertiser_name)
+            elif choice == "1":  # Join з користувачем виконується на клієнті
+                user_id = IntPrompt.ask("Введіть ID користувача (напр., 10)")
+                console.print("...Виконується запит...")
+                results = query_func(db, user_id)
             else:
                 if requires_uid:
                     user_id = IntPrompt.ask("Введіть ID користувача (напр., 10)")
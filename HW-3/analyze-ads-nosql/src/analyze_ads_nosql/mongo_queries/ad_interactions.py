@@ -4,6 +4,20 @@ ad_interactions.py
 Пайплайн: Всі ad-інтеракції для користувача.
 """
 
+from typing import Dict, Iterator
+
+from analyze_ads_nosql.user_cache import get_user_cache
+
+SESSION_PROJECTION = {
+    "_id": 0,
+    "userId": 1,
+    "sessionStart": 1,
+    "sessionEnd": 1,
+    "impressionsCount": 1,
+    "clicksCount": 1,
+    "impressions": 1,
+}
+
 
 def get_query_1(user_id: int):
     """1. Отримати всі рекламні взаємодії для конкретного користувача."""
@@ -37,3 +51,24 @@ def get_query_1(user_id: int):
             }
         }
     ]
+
+
+def iter_query_1(db, user_id: int) -> Iterator[Dict]:
+    """
+    Те саме, що й `get_query_1`, але без `$lookup`: профіль береться один раз
+    із кешу користувачів, а сесії читаються курсором і доповнюються на клієнті.
+    """
+    user = get_user_cache(db).get(user_id)
+    if user is None:
+        # Поведінка як у `$unwind`: без користувача немає результатів
+        return
+
+    profile = {k: user[k] for k in ("age", "gender", "location", "interests", "signUpDate") if k in user}
+    for session in db.sessions.find({"userId": user_id}, SESSION_PROJECTION):
+        session["user"] = profile
+        yield session
+
+
+def execute_query_1(db, user_id: int):
+    """1. Отримати всі рекламні взаємодії для конкретного користувача (клієнтський join)."""
+    return list(iter_query_1(db, user_id))
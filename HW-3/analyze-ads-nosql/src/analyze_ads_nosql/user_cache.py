@@ -0,0 +1,107 @@
+"""
+user_cache.py
+
+In-process LRU-кеш документів користувачів.
+
+Документ користувача не змінюється між імпортами, тому його достатньо прочитати один раз,
+а не приєднувати `$lookup`-ом до кожної сесії. Кеш інвалідовується, коли `import_users`
+піднімає номер покоління в колекції `import_meta`.
+"""
+
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, Optional
+
+META_COLLECTION = "import_meta"
+USERS_META_ID = "users"
+
+USER_PROJECTION = {
+    "_id": 0,
+    "userId": 1,
+    "age": 1,
+    "gender": 1,
+    "location": 1,
+    "interests": 1,
+    "signUpDate": 1,
+}
+
+
+def bump_users_generation(db) -> None:
+    """Позначає, що колекцію `users` перезавантажено (викликається імпортером)."""
+    db[META_COLLECTION].update_one(
+        {"_id": USERS_META_ID},
+        {"$inc": {"generation": 1}, "$set": {"importedAt": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+class UserCache:
+    """LRU-кеш документів `users`, прив'язаний до покоління імпорту."""
+
+    def __init__(self, db, max_size: int = 10_000, check_interval: float = 30.0):
+        self._db = db
+        self._max_size = max_size
+        self._check_interval = check_interval
+        self._items: "OrderedDict[int, Optional[Dict]]" = OrderedDict()
+        self._lock = Lock()
+        self._generation = None
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _current_generation(self):
+        meta = self._db[META_COLLECTION].find_one({"_id": USERS_META_ID}, {"generation": 1})
+        return meta.get("generation") if meta else None
+
+    def _validate(self) -> None:
+        """Не частіше ніж раз на `check_interval` секунд звіряє покоління імпорту."""
+        now = time.monotonic()
+        if now - self._checked_at < self._check_interval:
+            return
+        generation = self._current_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._items.clear()
+                self._generation = generation
+            self._checked_at = now
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._checked_at = 0.0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Повертає профіль користувача (без `_id`) або None, якщо його не існує."""
+        self._validate()
+        with self._lock:
+            if user_id in self._items:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+                return self._items[user_id]
+
+        self.misses += 1
+        user = self._db.users.find_one({"userId": user_id}, USER_PROJECTION)
+        with self._lock:
+            self._items[user_id] = user
+            self._items.move_to_end(user_id)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+        return user
+
+
+_user_cache: Optional[UserCache] = None
+
+
+def get_user_cache(db) -> UserCache:
+    """Повертає спільний для процесу екземпляр кешу."""
+    global _user_cache
+    if _user_cache is None or _user_cache._db != db:
+        _user_cache = UserCache(
+            db,
+            max_size=int(os.getenv("USER_CACHE_SIZE", "10000")),
+            check_interval=float(os.getenv("USER_CACHE_CHECK_SECONDS", "30")),
+        )
+    return _user_cache
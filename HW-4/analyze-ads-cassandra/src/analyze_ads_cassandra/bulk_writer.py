@@ -0,0 +1,198 @@
+"""
+bulk_writer.py
+~~~~~~~~~~~~~~
+Спільний механізм масового запису в Cassandra.
+
+Замість `session.execute` на кожен рядок або logged `BatchStatement`, що охоплює
+десятки різних партицій, запити виконуються асинхронно (prepared statements)
+з обмеженою кількістю одночасних запитів. Пакети (`UNLOGGED`) формуються лише
+з рядків, які належать до однієї партиції. Для кожного записувача ведеться
+статистика пропускної здатності та затримок запитів; вона ж публікується в
+реєстр метрик процесу з міткою `writer` (див. metrics.py). Мітка — стала назва
+таблиці (`metric_label`); шард, бакет чи версія таблиці потрапляють лише в журнал
+через `label`, щоб кількість часових рядів метрик не зростала з кожним запуском.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Hashable, Iterable, List, NamedTuple, Optional, Sequence
+
+from cassandra.query import BatchStatement, BatchType
+
+from analyze_ads_cassandra.metrics import REGISTRY, Histogram
+
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("CASSANDRA_MAX_IN_FLIGHT", "128"))
+DEFAULT_MAX_RETRIES = int(os.getenv("CASSANDRA_WRITE_RETRIES", "5"))
+
+
+class FailedWrite(NamedTuple):
+    statement: object
+    params: object
+    rows: int
+    error: Exception
+
+
+class BulkWriter:
+    """
+    Асинхронний записувач з вікном одночасних запитів.
+
+    `submit` блокує потік-виробник, коли у вікні вже `max_in_flight` запитів, тож
+    швидкість читання вхідних даних автоматично підлаштовується під кластер.
+    Невдалі запити повторюються з експоненційною затримкою; остаточні помилки
+    накопичуються в `failures` і можуть бути повторно відправлені через `retry_failures`.
+    """
+
+    def __init__(self, session, label: str = "rows", metric_label: Optional[str] = None,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = 0.1,
+                 report_every: float = 5.0):
+        self.session = session
+        self.label = label
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.report_every = report_every
+
+        self.submitted = 0
+        self.completed = 0
+        self.retried = 0
+        self.failures: List[FailedWrite] = []
+
+        # Власна гістограма — для підсумку цього записувача; у реєстрі метрики
+        # накопичуються для всіх записувачів з тією самою міткою
+        writer = metric_label or label
+        self.latency = Histogram()
+        self._metric_latency = REGISTRY.histogram("etl_write_latency_ms", "Write request latency, ms", writer=writer)
+        self._metric_rows = REGISTRY.counter("etl_rows_written_total", "Rows written", writer=writer)
+        self._metric_retries = REGISTRY.counter("etl_write_retries_total", "Retried write requests", writer=writer)
+        self._metric_failures = REGISTRY.counter("etl_write_failures_total", "Failed write requests", writer=writer)
+        self._metric_in_flight = REGISTRY.gauge("etl_writes_in_flight", "Write requests in flight", writer=writer)
+
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._started = time.perf_counter()
+        self._last_report = self._started
+        self._last_completed = 0
+
+    # --- публічний API ---
+    def submit(self, statement, params=None, rows: int = 1) -> None:
+        """Ставить запит у вікно; `rows` — скільки рядків він містить (для статистики)."""
+        with self._cond:
+            while self._in_flight >= self.max_in_flight:
+                self._cond.wait()
+            self._in_flight += 1
+            self.submitted += rows
+        self._metric_in_flight.inc()
+        self._execute(statement, params, rows, attempt=0)
+
+    def retry_failures(self) -> int:
+        """Повторно відправляє остаточно невдалі запити; повертає їх кількість."""
+        self.flush()
+        with self._cond:
+            failures, self.failures = self.failures, []
+        for failed in failures:
+            self.submit(failed.statement, failed.params, failed.rows)
+        self.flush()
+        return len(failures)
+
+    def latency_percentile(self, q: float) -> float:
+        """Наближений перцентиль затримки (мс) — верхня межа відповідного кошика гістограми."""
+        return self.latency.percentile(q * 100)
+
+    def submit_partition(self, statement, params_list: Sequence, rows_per_batch: int = 100) -> None:
+        """Записує рядки однієї партиції пакетами `UNLOGGED` (один вузол-координатор на пакет)."""
+        if len(params_list) == 1:
+            self.submit(statement, params_list[0])
+            return
+        for i in range(0, len(params_list), rows_per_batch):
+            chunk = params_list[i:i + rows_per_batch]
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for params in chunk:
+                batch.add(statement, params)
+            self.submit(batch, None, rows=len(chunk))
+
+    def submit_grouped(self, statement, params_iter: Iterable,
+                       partition_key: Callable[[Sequence], Hashable],
+                       rows_per_batch: int = 100) -> None:
+        """Групує рядки за ключем партиції; поодинокі рядки йдуть окремими запитами."""
+        groups = defaultdict(list)
+        for params in params_iter:
+            groups[partition_key(params)].append(params)
+        for params_list in groups.values():
+            self.submit_partition(statement, params_list, rows_per_batch)
+
+    def flush(self) -> None:
+        """Чекає завершення всіх запитів у вікні."""
+        with self._cond:
+            while self._in_flight > 0:
+                self._cond.wait()
+
+    def close(self) -> None:
+        self.flush()
+        elapsed = time.perf_counter() - self._started
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        avg = self.latency.total / self.latency.count if self.latency.count else 0.0
+        print(f"✅ [{self.label}] written {self.completed} rows in {elapsed:.1f}s "
+              f"({rate:,.0f} rows/s, retries: {self.retried}, failed: {len(self.failures)}; "
+              f"latency avg {avg:.1f} ms, p95 ≤{self.latency_percentile(0.95):.0f} ms, max {self.latency.max:.1f} ms)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    # --- внутрішня логіка ---
+    def _execute(self, statement, params, rows: int, attempt: int) -> None:
+        started = time.perf_counter()
+        try:
+            future = self.session.execute_async(statement, params)
+        except Exception as e:  # напр., NoHostAvailable під час постановки в чергу
+            self._on_error(e, statement, params, rows, attempt)
+            return
+        future.add_callbacks(
+            callback=self._on_success, callback_args=(rows, started),
+            errback=self._on_error, errback_args=(statement, params, rows, attempt),
+        )
+
+    def _on_success(self, _result, rows: int, started: float) -> None:
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.latency.observe(latency_ms)
+        self._metric_latency.observe(latency_ms)
+        self._metric_rows.inc(rows)
+        self._release(rows)
+
+    def _on_error(self, exc: Exception, statement, params, rows: int, attempt: int) -> None:
+        if attempt < self.max_retries:
+            delay = self.backoff_base * (2 ** attempt)
+            with self._cond:
+                self.retried += 1
+            self._metric_retries.inc()
+            # Не блокуємо потік подій драйвера: повтор запускається таймером
+            timer = threading.Timer(delay, self._execute, args=(statement, params, rows, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._cond:
+            self.failures.append(FailedWrite(statement, params, rows, exc))
+        self._metric_failures.inc()
+        print(f"❌ [{self.label}] write failed after {attempt + 1} attempts: {exc}")
+        self._release(0)
+
+    def _release(self, rows: int) -> None:
+        self._metric_in_flight.dec()
+        with self._cond:
+            self._in_flight -= 1
+            self.completed += rows
+            self._cond.notify_all()
+            now = time.perf_counter()
+            if now - self._last_report < self.report_every:
+                return
+            rate = (self.completed - self._last_completed) / (now - self._last_report)
+            self._last_report, self._last_completed = now, self.completed
+            in_flight = self._in_flight
+        print(f"[{self.label}] {self.completed} rows written, {rate:,.0f} rows/s, in flight: {in_flight}")
+
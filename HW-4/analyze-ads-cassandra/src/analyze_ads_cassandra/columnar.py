@@ -0,0 +1,139 @@
+"""
+columnar.py
+~~~~~~~~~~~
+Посторінкова колонкова агрегація для ETL-акумуляторів.
+
+Сторінка рядків від драйвера (список кортежів) транспонується в колонки,
+колонки перетворюються на масиви NumPy, а групування виконується векторно:
+ключі кодуються словником (`pandas.factorize`), суми рахуються через
+`np.add.at` по кодах груп. Грошові значення зберігаються як int64 в одиницях
+1e-4 (масштаб DECIMAL(12,4) вихідних колонок AdCost/AdRevenue) замість `Decimal`:
+суми точні, без округлення кожного рядка. У Python-словник результатів потрапляє лише по одному
+запису на групу сторінки, а не на кожен рядок.
+"""
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+MONEY_SCALE = 4  # знаків після коми, як у DECIMAL(12,4)
+EPOCH = date(1970, 1, 1)
+
+
+def page_columns(rows: Sequence[tuple]) -> List[tuple]:
+    """Транспонує сторінку кортежів у список колонок."""
+    return list(zip(*rows)) if rows else []
+
+
+# Межа, до якої float64 * 1e4 ще округлюється до точного цілого
+_FLOAT_EXACT_LIMIT = 2 ** 53 / 10 ** MONEY_SCALE
+
+
+def _money_units(value) -> int:
+    if value is None:
+        return 0
+    # float лише через str, щоб не тягнути двійкову похибку в Decimal
+    amount = value if isinstance(value, Decimal) else Decimal(str(value))
+    return int(amount.scaleb(MONEY_SCALE).to_integral_value(ROUND_HALF_EVEN))
+
+
+def to_money_units(column: Sequence) -> np.ndarray:
+    """
+    Decimal значення → int64 в одиницях 1e-4 (None → 0). Векторно через float64:
+    значення з 4 знаками після коми до ±2^53/1e4 після `np.rint` дають точне ціле.
+    Лише значення поза цією межею рахуються по одному через `Decimal.scaleb`.
+    """
+    values = np.asarray(column, dtype=float)
+    units = np.rint(np.nan_to_num(values) * 10 ** MONEY_SCALE)
+    outside = np.abs(values) >= _FLOAT_EXACT_LIMIT
+    if not outside.any():
+        return units.astype(np.int64)
+    units[outside] = 0
+    result = units.astype(np.int64)
+    for i in np.flatnonzero(outside):
+        result[i] = _money_units(column[i])
+    return result
+
+
+def money_units_to_decimal(units: int) -> Decimal:
+    return Decimal(int(units)).scaleb(-MONEY_SCALE)
+
+
+def to_datetime64(column: Sequence) -> np.ndarray:
+    return np.asarray(column, dtype="datetime64[us]")
+
+
+def to_bool(column: Sequence) -> np.ndarray:
+    return np.asarray([bool(v) for v in column], dtype=bool) if None in column else np.asarray(column, dtype=bool)
+
+
+def datetime_threshold(moment: datetime) -> np.datetime64:
+    return np.datetime64(moment, "us")
+
+
+def to_days(timestamps: np.ndarray) -> np.ndarray:
+    """Номер дня від епохи для кожної мітки часу (int64 — швидке кодування ключа)."""
+    return timestamps.astype("datetime64[D]").astype(np.int64)
+
+
+def day_to_date(day: int) -> date:
+    return EPOCH + timedelta(days=int(day))
+
+
+def _as_key_array(key) -> np.ndarray:
+    return key if isinstance(key, np.ndarray) else np.asarray(key, dtype=object)
+
+
+def group_sums(keys: Sequence[Sequence], values: Sequence[np.ndarray],
+               mask: Optional[np.ndarray] = None) -> Dict[tuple, Tuple[int, ...]]:
+    """
+    Векторне групування сторінки: для кожного унікального складеного ключа
+    повертає суми кожної з колонок `values`. Рядки з порожнім (None/NaN)
+    ключем або з `mask == False` пропускаються.
+    """
+    if mask is not None:
+        selected = np.flatnonzero(mask)
+        if not len(selected):
+            return {}
+        keys = [_as_key_array(k)[selected] for k in keys]
+        values = [v[selected] for v in values]
+
+    codes, uniques = [], []
+    for key in keys:
+        key_codes, key_uniques = pd.factorize(_as_key_array(key))
+        codes.append(key_codes)
+        uniques.append(np.asarray(key_uniques).tolist())
+
+    valid = np.all([c >= 0 for c in codes], axis=0)
+    if not valid.all():
+        codes = [c[valid] for c in codes]
+        values = [v[valid] for v in values]
+    if not len(codes[0]):
+        return {}
+
+    if len(codes) == 1:
+        group_codes, n_groups = codes[0], len(uniques[0])
+        group_keys = [(k,) for k in uniques[0]]
+    else:
+        combined = np.ravel_multi_index(codes, dims=[len(u) for u in uniques])
+        group_ids, group_codes = np.unique(combined, return_inverse=True)
+        n_groups = len(group_ids)
+        parts = np.unravel_index(group_ids, [len(u) for u in uniques])
+        group_keys = list(zip(*([u[i] for i in p.tolist()] for u, p in zip(uniques, parts))))
+
+    sums = []
+    for value in values:
+        out = np.zeros(n_groups, dtype=np.int64)
+        np.add.at(out, group_codes, value)
+        sums.append(out.tolist())
+    return {key: tuple(s[g] for s in sums) for g, key in enumerate(group_keys)}
+
+
+def merge_sums(target: Dict, partial: Dict) -> Dict:
+    """Додає часткові суми (кортежі int) до накопиченого словника."""
+    for key, sums in partial.items():
+        current = target.get(key)
+        target[key] = sums if current is None else tuple(a + b for a, b in zip(current, sums))
+    return target
@@ -0,0 +1,35 @@
+# common.py
+# ~~~~~~~~~
+# Спільні акумулятори та допоміжні функції для ETL-скриптів.
+
+from datetime import datetime
+from typing import Optional
+
+from analyze_ads_cassandra.scanner import Accumulator, parallel_scan
+
+
+class MaxTimestamp(Accumulator):
+    """Знаходить найпізнішу мітку часу в raw_events (рядки з однієї колонки `ts`)."""
+
+    def __init__(self):
+        self.value: Optional[datetime] = None
+
+    def add(self, row) -> None:
+        event_time = row[0]
+        if event_time is not None and (self.value is None or event_time > self.value):
+            self.value = event_time
+
+    def add_page(self, rows) -> None:
+        page_max = max((row[0] for row in rows if row[0] is not None), default=None)
+        if page_max is not None and (self.value is None or page_max > self.value):
+            self.value = page_max
+
+    def merge(self, other: "MaxTimestamp") -> "MaxTimestamp":
+        if other.value is not None and (self.value is None or other.value > self.value):
+            self.value = other.value
+        return self
+
+
+def find_latest_timestamp(session) -> Optional[datetime]:
+    """Паралельно сканує raw_events і повертає найпізнішу мітку часу."""
+    return parallel_scan(session, "raw_events", ["ts"], MaxTimestamp).value
@@ -6,14 +6,31 @@
 
 import os
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Sequence
 
-from cassandra.query import SimpleStatement
+import numpy as np
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.columnar import datetime_threshold, group_sums, page_columns, to_bool, to_datetime64
+from analyze_ads_cassandra.etl_scripts.runner import EtlContext, Projection, register, run_projections
+from analyze_ads_cassandra.leaderboard import DEFAULT_TOP_K, RANK_TABLES_DDL, top_k, write_user_ranks
+from analyze_ads_cassandra.scanner import Accumulator, column_positions
 from analyze_ads_cassandra.utils import get_db_connection
 
 
+# DDL-шаблон: `{table}` — логічна назва або фізична таблиця версії
+TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    time_bucket text,
+    total_clicks int,
+    user_id int,
+    PRIMARY KEY (time_bucket, total_clicks, user_id)
+) WITH CLUSTERING ORDER BY (total_clicks DESC)
+"""
+
+
 def ensure_analytics_table_exists(session):
     """
     Перевіряє існування таблиці `top_users_by_clicks` і створює її, якщо потрібно.
@@ -28,84 +45,81 @@ def ensure_analytics_table_exists(session):
 
     if not table_check.one():
         print(f"Table {table_name} not found. Creating it...")
-        ddl_query = """
-        CREATE TABLE top_users_by_clicks (
-            time_bucket text,
-            total_clicks int,
-            user_id int,
-            PRIMARY KEY (time_bucket, total_clicks, user_id)
-        ) WITH CLUSTERING ORDER BY (total_clicks DESC)
-        """
-        session.execute(ddl_query)
+        session.execute(TABLE_DDL.format(table=table_name))
         print(f"Table {table_name} created successfully.")
     else:
         print(f"Table {table_name} already exists.")
 
 
-def process_and_load_data(session):
-    """
-    Обробляє події, знаходить останню дату, та завантажує агреговані дані про кліки.
-    """
-    print("Starting data processing for top active users...")
+class ClicksByUser(Accumulator):
+    """Кількість кліків кожного користувача, починаючи з `window_start`."""
 
-    # 1. Знайти останню мітку часу в наборі даних для визначення часового вікна
-    print("Finding the latest timestamp in raw_events...")
-    all_events_query = SimpleStatement("SELECT ts FROM raw_events", fetch_size=5000)
-    rows = session.execute(all_events_query)
+    def __init__(self, window_start: datetime, columns: Sequence[str]):
+        self.window_start = window_start
+        self.positions = column_positions(columns, "user_id", "ts", "wasclicked")
+        self.clicks = defaultdict(int)
 
-    latest_timestamp = None
-    for event in rows:
-        event_time = datetime.fromisoformat(event.ts.replace(" ", "T"))
-        if latest_timestamp is None or event_time > latest_timestamp:
-            latest_timestamp = event_time
+    def add(self, event) -> None:
+        self.add_page([event])
 
-    if not latest_timestamp:
-        print("No events found in raw_events. Exiting.")
-        return
+    def add_page(self, rows) -> None:
+        user_i, ts_i, clicked_i = self.positions
+        columns = page_columns(rows)
+        # Враховуємо лише події з кліками за останні 30 днів
+        mask = to_bool(columns[clicked_i]) & (to_datetime64(columns[ts_i]) >= datetime_threshold(self.window_start))
+        ones = np.ones(len(rows), dtype=np.int64)
+        for (user_id,), (clicks,) in group_sums([columns[user_i]], [ones], mask).items():
+            self.clicks[user_id] += clicks
 
-    print(f"Latest event timestamp found: {latest_timestamp}")
+    def merge(self, other: "ClicksByUser") -> "ClicksByUser":
+        for user_id, clicks in other.clicks.items():
+            self.clicks[user_id] += clicks
+        return self
 
-    # 2. Визначити часове вікно (останні 30 днів відносно останньої події)
-    thirty_days_ago_from_latest = latest_timestamp - timedelta(days=30)
-    print(f"Calculating clicks from {thirty_days_ago_from_latest} to {latest_timestamp}")
 
-    # 3. Прочитати дані з raw_events та агрегувати кліки для кожного користувача
-    query = SimpleStatement("SELECT user_id, ts, wasclicked FROM raw_events", fetch_size=1000)
-    rows = session.execute(query)
+class TopUsersByClicksProjection(Projection):
+    """Проекція `top_users_by_clicks`: кліки користувачів за останні 30 днів."""
+    name = "top_users_by_clicks"
+    columns = ("user_id", "ts", "wasclicked")
+    needs_window = True
+    # Лідерборд і ранги перемикаються на нову версію разом
+    versioned_tables = {"top_users_by_clicks": TABLE_DDL, **RANK_TABLES_DDL}
 
-    clicks_by_user = defaultdict(int)
-    processed_count = 0
+    def accumulator(self, context: EtlContext) -> ClicksByUser:
+        return ClicksByUser(context.window_start, context.columns)
 
-    for event in rows:
-        try:
-            event_time = datetime.fromisoformat(event.ts.replace(" ", "T"))
-            # Враховуємо лише події з кліками за останні 30 днів
-            if event.wasclicked and event_time >= thirty_days_ago_from_latest:
-                clicks_by_user[event.user_id] += 1
+    def write(self, session, accumulator: ClicksByUser, context: EtlContext) -> None:
+        clicks_by_user = accumulator.clicks
+        print(f"Found click data for {len(clicks_by_user)} users.")
 
-            processed_count += 1
-            if processed_count % 10000 == 0:
-                print(f"Scanned {processed_count} events...")
-        except Exception as e:
-            print(f"Could not process event for user '{event.user_id}': {e}")
+        # Завантажити лише top-K користувачів у нову версію таблиці
+        time_bucket_name = 'last_30_days_historical'
+        table = context.table(self.name)
+        leaders = top_k(clicks_by_user, DEFAULT_TOP_K)
+        print(f"Loading top {len(leaders)} users into `{table}` for time_bucket='{time_bucket_name}'...")
 
-    print(f"Finished scanning events. Found click data for {len(clicks_by_user)} users.")
+        insert_stmt = session.prepare(f"""
+            INSERT INTO {table} (time_bucket, user_id, total_clicks)
+            VALUES (?, ?, ?)
+        """)
 
-    # 4. Очистити таблицю та завантажити нові агреговані дані
-    time_bucket_name = 'last_30_days_historical'
-    print(f"Truncating and loading data into `top_users_by_clicks` for time_bucket='{time_bucket_name}'...")
+        # Усі рядки належать одній партиції (time_bucket) — пишемо пакетами UNLOGGED
+        with BulkWriter(session, label=self.name) as writer:
+            writer.submit_partition(insert_stmt, [(time_bucket_name, user_id, total_clicks)
+                                                  for total_clicks, user_id in leaders])
 
-    session.execute("TRUNCATE adtech.top_users_by_clicks")
+        # Повне ранжування — в окремих компактних таблицях для пошуку «місця користувача X»
+        write_user_ranks(session, time_bucket_name, clicks_by_user,
+                         context.table("user_click_rank"), context.table("user_click_rank_pages"))
 
-    insert_stmt = session.prepare("""
-        INSERT INTO top_users_by_clicks (time_bucket, user_id, total_clicks)
-        VALUES (?, ?, ?)
-    """)
+PROJECTION = register(TopUsersByClicksProjection())
 
-    for user_id, total_clicks in clicks_by_user.items():
-        session.execute(insert_stmt, (time_bucket_name, user_id, total_clicks))
 
-    print("ETL process finished.")
+def process_and_load_data(session):
+    """
+    Обробляє події, знаходить останню дату, та завантажує агреговані дані про кліки.
+    """
+    run_projections(session, [PROJECTION])
 
 
 def main():
@@ -119,7 +133,7 @@ def main():
         return
 
     try:
-        ensure_analytics_table_exists(session)
+        PROJECTION.ensure_table(session)
         process_and_load_data(session)
         print("✅ Analytics data for top active users loaded successfully.")
     finally:
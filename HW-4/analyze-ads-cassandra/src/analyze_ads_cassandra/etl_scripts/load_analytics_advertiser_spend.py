@@ -6,15 +6,31 @@
 
 import os
 from collections import defaultdict
-from datetime import datetime, timedelta
-from decimal import Decimal
+from datetime import datetime
+from typing import Sequence
 
-from cassandra.query import SimpleStatement
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.columnar import (datetime_threshold, group_sums, money_units_to_decimal, page_columns,
+                                            to_datetime64, to_money_units)
+from analyze_ads_cassandra.etl_scripts.runner import EtlContext, Projection, register, run_projections
+from analyze_ads_cassandra.leaderboard import DEFAULT_TOP_K, top_k
+from analyze_ads_cassandra.scanner import Accumulator, column_positions
 from analyze_ads_cassandra.utils import get_db_connection
 
 
+# DDL-шаблон: `{table}` — логічна назва або фізична таблиця версії
+TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    time_bucket text,
+    total_spend decimal,
+    advertiser_name text,
+    PRIMARY KEY (time_bucket, total_spend, advertiser_name)
+) WITH CLUSTERING ORDER BY (total_spend DESC)
+"""
+
+
 def ensure_analytics_table_exists(session):
     """
     Перевіряє існування таблиці `top_advertisers_by_spend` і створює її, якщо потрібно.
@@ -29,84 +45,76 @@ def ensure_analytics_table_exists(session):
 
     if not table_check.one():
         print(f"Table {table_name} not found. Creating it...")
-        ddl_query = """
-        CREATE TABLE top_advertisers_by_spend (
-            time_bucket text,
-            total_spend decimal,
-            advertiser_name text,
-            PRIMARY KEY (time_bucket, total_spend, advertiser_name)
-        ) WITH CLUSTERING ORDER BY (total_spend DESC)
-        """
-        session.execute(ddl_query)
+        session.execute(TABLE_DDL.format(table=table_name))
         print(f"Table {table_name} created successfully.")
     else:
         print(f"Table {table_name} already exists.")
 
 
-def process_and_load_data(session):
-    """
-    Обробляє події, знаходить останню дату, та завантажує агреговані дані за останні 30 днів.
-    """
-    print("Starting data processing for top advertisers...")
+class SpendByAdvertiser(Accumulator):
+    """Сумарні витрати кожного рекламодавця (в одиницях 1e-4), починаючи з `window_start`."""
 
-    # 1. Знайти останню мітку часу в наборі даних
-    print("Finding the latest timestamp in raw_events to define the time window...")
-    all_events_query = SimpleStatement("SELECT ts FROM raw_events", fetch_size=5000)
-    rows = session.execute(all_events_query)
+    def __init__(self, window_start: datetime, columns: Sequence[str]):
+        self.window_start = window_start
+        self.positions = column_positions(columns, "advertiser_name", "ts", "adcost")
+        self.spend = defaultdict(int)
 
-    latest_timestamp = None
-    for event in rows:
-        event_time = datetime.fromisoformat(event.ts.replace(" ", "T"))
-        if latest_timestamp is None or event_time > latest_timestamp:
-            latest_timestamp = event_time
+    def add(self, event) -> None:
+        self.add_page([event])
 
-    if not latest_timestamp:
-        print("No events found in raw_events. Exiting.")
-        return
+    def add_page(self, rows) -> None:
+        advertiser_i, ts_i, cost_i = self.positions
+        columns = page_columns(rows)
+        # Враховуємо лише події за останні 30 днів відносно останньої дати
+        mask = to_datetime64(columns[ts_i]) >= datetime_threshold(self.window_start)
+        for (advertiser,), (units,) in group_sums([columns[advertiser_i]], [to_money_units(columns[cost_i])], mask).items():
+            self.spend[advertiser] += units
 
-    print(f"Latest event timestamp found: {latest_timestamp}")
+    def merge(self, other: "SpendByAdvertiser") -> "SpendByAdvertiser":
+        for advertiser, spend in other.spend.items():
+            self.spend[advertiser] += spend
+        return self
 
-    # 2. Визначити часове вікно (останні 30 днів відносно останньої події)
-    thirty_days_ago_from_latest = latest_timestamp - timedelta(days=30)
-    print(f"Calculating spend from {thirty_days_ago_from_latest} to {latest_timestamp}")
 
-    # 3. Прочитати дані з raw_events та агрегувати їх у пам'яті для визначеного вікна
-    query = SimpleStatement("SELECT advertiser_name, ts, adcost FROM raw_events", fetch_size=1000)
-    rows = session.execute(query)
+class TopAdvertisersBySpendProjection(Projection):
+    """Проекція `top_advertisers_by_spend`: витрати рекламодавців за останні 30 днів."""
+    name = "top_advertisers_by_spend"
+    columns = ("advertiser_name", "ts", "adcost")
+    needs_window = True
+    versioned_tables = {"top_advertisers_by_spend": TABLE_DDL}
 
-    spend_by_advertiser = defaultdict(Decimal)
-    processed_count = 0
+    def accumulator(self, context: EtlContext) -> SpendByAdvertiser:
+        return SpendByAdvertiser(context.window_start, context.columns)
 
-    for event in rows:
-        try:
-            event_time = datetime.fromisoformat(event.ts.replace(" ", "T"))
-            # Враховуємо лише події за останні 30 днів відносно останньої дати
-            if event_time >= thirty_days_ago_from_latest:
-                spend_by_advertiser[event.advertiser_name] += Decimal(str(event.adcost))
+    def write(self, session, accumulator: SpendByAdvertiser, context: EtlContext) -> None:
+        spend_by_advertiser = accumulator.spend
+        print(f"Found spend data for {len(spend_by_advertiser)} advertisers in the time window.")
 
-            processed_count += 1
-            if processed_count % 10000 == 0:
-                print(f"Scanned {processed_count} events...")
-        except Exception as e:
-            print(f"Could not process event for advertiser '{event.advertiser_name}': {e}")
+        # Завантажити лише top-K рекламодавців у нову версію таблиці
+        time_bucket_name = 'last_30_days_historical'
+        table = context.table(self.name)
+        leaders = top_k(spend_by_advertiser, DEFAULT_TOP_K)
+        print(f"Loading top {len(leaders)} advertisers into `{table}` for time_bucket='{time_bucket_name}'...")
 
-    print(f"Finished scanning events. Found spend data for {len(spend_by_advertiser)} advertisers in the time window.")
+        insert_stmt = session.prepare(f"""
+            INSERT INTO {table} (time_bucket, advertiser_name, total_spend)
+            VALUES (?, ?, ?)
+        """)
 
-    # 4. Очистити таблицю та завантажити нові агреговані дані
-    time_bucket_name = 'last_30_days_historical'
-    print(f"Truncating and loading data into `top_advertisers_by_spend` for time_bucket='{time_bucket_name}'...")
+        # Усі рядки належать одній партиції (time_bucket) — пишемо пакетами UNLOGGED
+        with BulkWriter(session, label=self.name) as writer:
+            writer.submit_partition(insert_stmt, [(time_bucket_name, advertiser, money_units_to_decimal(total_spend))
+                                                  for total_spend, advertiser in leaders])
 
-    session.execute("TRUNCATE adtech.top_advertisers_by_spend")
 
-    insert_stmt = session.prepare("""
-        INSERT INTO top_advertisers_by_spend (time_bucket, advertiser_name, total_spend)
-        VALUES (?, ?, ?)
-    """)
+PROJECTION = register(TopAdvertisersBySpendProjection())
 
-    for advertiser, total_spend in spend_by_advertiser.items():
-        session.execute(insert_stmt, (time_bucket_name, advertiser, total_spend))
 
-    print("ETL process finished.")
+def process_and_load_data(session):
+    """
+    Обробляє події, знаходить останню дату, та завантажує агреговані дані за останні 30 днів.
+    """
+    run_projections(session, [PROJECTION])
 
 
 def main():
@@ -120,7 +128,7 @@ def main():
         return
 
     try:
-        ensure_analytics_table_exists(session)
+        PROJECTION.ensure_table(session)
         process_and_load_data(session)
         print("✅ Analytics data for top advertisers loaded successfully.")
     finally:
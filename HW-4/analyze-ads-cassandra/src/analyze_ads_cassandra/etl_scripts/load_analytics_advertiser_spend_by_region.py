@@ -6,15 +6,31 @@
 
 import os
 from collections import defaultdict
-from datetime import datetime, timedelta
-from decimal import Decimal
+from datetime import datetime
+from typing import Sequence
 
-from cassandra.query import SimpleStatement
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.columnar import (datetime_threshold, group_sums, money_units_to_decimal, page_columns,
+                                            to_datetime64, to_money_units)
+from analyze_ads_cassandra.etl_scripts.runner import EtlContext, Projection, register, run_projections
+from analyze_ads_cassandra.leaderboard import TopK
+from analyze_ads_cassandra.scanner import Accumulator, column_positions
 from analyze_ads_cassandra.utils import get_db_connection
 
 
+# DDL-шаблон: `{table}` — логічна назва або фізична таблиця версії
+TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    region text,
+    total_spend decimal,
+    advertiser_name text,
+    PRIMARY KEY (region, total_spend, advertiser_name)
+) WITH CLUSTERING ORDER BY (total_spend DESC)
+"""
+
+
 def ensure_analytics_table_exists(session):
     """
     Перевіряє існування таблиці `top_advertisers_by_region` і створює її, якщо потрібно.
@@ -29,88 +45,85 @@ def ensure_analytics_table_exists(session):
 
     if not table_check.one():
         print(f"Table {table_name} not found. Creating it...")
-        ddl_query = """
-        CREATE TABLE top_advertisers_by_region (
-            region text,
-            total_spend decimal,
-            advertiser_name text,
-            PRIMARY KEY (region, total_spend, advertiser_name)
-        ) WITH CLUSTERING ORDER BY (total_spend DESC)
-        """
-        session.execute(ddl_query)
+        session.execute(TABLE_DDL.format(table=table_name))
         print(f"Table {table_name} created successfully.")
     else:
         print(f"Table {table_name} already exists.")
 
 
-def process_and_load_data(session):
-    """
-    Обробляє події, знаходить останню дату, та завантажує агреговані дані про витрати за регіонами.
-    """
-    print("Starting data processing for top advertisers by region...")
+class SpendByRegionAdvertiser(Accumulator):
+    """Сумарні витрати за парою (регіон, рекламодавець), починаючи з `window_start`."""
 
-    # 1. Знайти останню мітку часу в наборі даних
-    print("Finding the latest timestamp in raw_events...")
-    all_events_query = SimpleStatement("SELECT ts FROM raw_events", fetch_size=5000)
-    rows = session.execute(all_events_query)
+    def __init__(self, window_start: datetime, columns: Sequence[str]):
+        self.window_start = window_start
+        self.positions = column_positions(columns, "campaign_targeting_country", "advertiser_name", "ts", "adcost")
+        self.spend = defaultdict(int)  # (регіон, рекламодавець) -> одиниці 1e-4
 
-    latest_timestamp = None
-    for event in rows:
-        event_time = datetime.fromisoformat(event.ts.replace(" ", "T"))
-        if latest_timestamp is None or event_time > latest_timestamp:
-            latest_timestamp = event_time
+    def add(self, event) -> None:
+        self.add_page([event])
 
-    if not latest_timestamp:
-        print("No events found in raw_events. Exiting.")
-        return
+    def add_page(self, rows) -> None:
+        region_i, advertiser_i, ts_i, cost_i = self.positions
+        columns = page_columns(rows)
+        # Враховуємо лише події за останні 30 днів
+        mask = to_datetime64(columns[ts_i]) >= datetime_threshold(self.window_start)
+        page_spend = group_sums([columns[region_i], columns[advertiser_i]], [to_money_units(columns[cost_i])], mask)
+        # strip виконується для унікальних ключів сторінки, а не для кожного рядка
+        for (region, advertiser), (units,) in page_spend.items():
+            region = region.strip() if region else None
+            advertiser = advertiser.strip() if advertiser else None
+            if region and advertiser:  # Ігноруємо записи без регіону або рекламодавця
+                self.spend[(region, advertiser)] += units
+
+    def merge(self, other: "SpendByRegionAdvertiser") -> "SpendByRegionAdvertiser":
+        for key, spend in other.spend.items():
+            self.spend[key] += spend
+        return self
 
-    print(f"Latest event timestamp found: {latest_timestamp}")
 
-    # 2. Визначити часове вікно (останні 30 днів відносно останньої події)
-    thirty_days_ago_from_latest = latest_timestamp - timedelta(days=30)
-    print(f"Calculating spend from {thirty_days_ago_from_latest} to {latest_timestamp}")
+class TopAdvertisersByRegionProjection(Projection):
+    """Проекція `top_advertisers_by_region`: витрати рекламодавців за регіонами за останні 30 днів."""
+    name = "top_advertisers_by_region"
+    columns = ("campaign_targeting_country", "advertiser_name", "ts", "adcost")
+    needs_window = True
+    versioned_tables = {"top_advertisers_by_region": TABLE_DDL}
 
-    # 3. Прочитати дані з raw_events та агрегувати витрати
-    # Ключ словника - кортеж (регіон, рекламодавець)
-    query = SimpleStatement("SELECT campaign_targeting_country, advertiser_name, ts, adcost FROM raw_events",
-                            fetch_size=1000)
-    rows = session.execute(query)
+    def accumulator(self, context: EtlContext) -> SpendByRegionAdvertiser:
+        return SpendByRegionAdvertiser(context.window_start, context.columns)
 
-    spend_by_region_advertiser = defaultdict(Decimal)
-    processed_count = 0
+    def write(self, session, accumulator: SpendByRegionAdvertiser, context: EtlContext) -> None:
+        spend_by_region_advertiser = accumulator.spend
+        print(f"Found spend data for {len(spend_by_region_advertiser)} region/advertiser pairs.")
 
-    for event in rows:
-        try:
-            event_time = datetime.fromisoformat(event.ts.replace(" ", "T"))
-            # Враховуємо лише події за останні 30 днів
-            if event_time >= thirty_days_ago_from_latest:
-                region = event.campaign_targeting_country.strip() if event.campaign_targeting_country else None
-                advertiser = event.advertiser_name.strip() if event.advertiser_name else None
-                if region and advertiser:  # Ігноруємо записи без регіону або рекламодавця
-                    spend_by_region_advertiser[(region, advertiser)] += Decimal(str(event.adcost))
+        # Для кожного регіону лишаємо тільки top-K рекламодавців
+        leaders = TopK()
+        for (region, advertiser), total_spend in spend_by_region_advertiser.items():
+            leaders.add(region, total_spend, advertiser)
 
-            processed_count += 1
-            if processed_count % 10000 == 0:
-                print(f"Scanned {processed_count} events...")
-        except Exception as e:
-            print(f"Could not process event for advertiser '{event.advertiser_name}': {e}")
+        # Завантажити агреговані дані в нову версію таблиці
+        table = context.table(self.name)
+        print(f"Loading {len(leaders)} rows (top {leaders.k} per region) into `{table}`...")
 
-    print(f"Finished scanning events. Found spend data for {len(spend_by_region_advertiser)} region/advertiser pairs.")
+        insert_stmt = session.prepare(f"""
+            INSERT INTO {table} (region, advertiser_name, total_spend)
+            VALUES (?, ?, ?)
+        """)
 
-    # 4. Очистити таблицю та завантажити нові агреговані дані
-    print("Truncating and loading data into `top_advertisers_by_region`...")
+        # Один пакет UNLOGGED на партицію (region)
+        with BulkWriter(session, label=self.name) as writer:
+            for region, region_leaders in leaders.items():
+                writer.submit_partition(insert_stmt, [(region, advertiser, money_units_to_decimal(total_spend))
+                                                      for total_spend, advertiser in region_leaders])
 
-    session.execute("TRUNCATE adtech.top_advertisers_by_region")
 
-    insert_stmt = session.prepare("""
-        INSERT INTO top_advertisers_by_region (region, advertiser_name, total_spend)
-        VALUES (?, ?, ?)
-    """)
+PROJECTION = register(TopAdvertisersByRegionProjection())
 
-    for (region, advertiser), total_spend in spend_by_region_advertiser.items():
-        session.execute(insert_stmt, (region, advertiser, total_spend))
 
-    print("ETL process finished.")
+def process_and_load_data(session):
+    """
+    Обробляє події, знаходить останню дату, та завантажує агреговані дані про витрати за регіонами.
+    """
+    run_projections(session, [PROJECTION])
 
 
 def main():
@@ -124,7 +137,7 @@ def main():
         return
 
     try:
-        ensure_analytics_table_exists(session)
+        PROJECTION.ensure_table(session)
         process_and_load_data(session)
         print("✅ Analytics data for top advertisers by region loaded successfully.")
     finally:
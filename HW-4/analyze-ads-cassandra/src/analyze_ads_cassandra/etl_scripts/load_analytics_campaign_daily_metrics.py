@@ -5,15 +5,31 @@
 # Результати завантажуються в таблицю `campaign_daily_metrics`.
 
 import os
-from collections import defaultdict
-from datetime import datetime
+from typing import Optional, Sequence
 
-from cassandra.query import BatchStatement, SimpleStatement
+import numpy as np
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.columnar import day_to_date, group_sums, page_columns, to_bool, to_datetime64, to_days
+from analyze_ads_cassandra.etl_scripts.runner import EtlContext, Projection, register, run_projections
+from analyze_ads_cassandra.scanner import Accumulator, column_positions
 from analyze_ads_cassandra.utils import get_db_connection
 
 
+# DDL-шаблон: `{table}` — логічна назва або фізична таблиця версії
+TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    campaign_id int,
+    event_date date,
+    impressions bigint,
+    clicks bigint,
+    ctr double,
+    PRIMARY KEY (campaign_id, event_date)
+) WITH CLUSTERING ORDER BY (event_date DESC)
+"""
+
+
 def ensure_analytics_table_exists(session):
     """
     Перевіряє існування таблиці `campaign_daily_metrics` і створює її, якщо потрібно.
@@ -28,96 +44,103 @@ def ensure_analytics_table_exists(session):
 
     if not table_check.one():
         print(f"Table {table_name} not found. Creating it...")
-        ddl_query = """
-        CREATE TABLE campaign_daily_metrics (
-            campaign_id int,
-            event_date date,
-            impressions bigint,
-            clicks bigint,
-            ctr double,
-            PRIMARY KEY (campaign_id, event_date)
-        ) WITH CLUSTERING ORDER BY (event_date DESC)
-        """
-        session.execute(ddl_query)
+        session.execute(TABLE_DDL.format(table=table_name))
         print(f"Table {table_name} created successfully.")
     else:
         print(f"Table {table_name} already exists.")
 
 
-def process_and_load_data(session):
-    """
-    Виконує повний ETL-процес: читання, агрегацію та завантаження даних.
-    """
-    print("Starting data processing for campaign daily metrics...")
-    keyspace = os.environ.get("CASSANDRA_KEYSPACE", "adtech")
-
-    # 1. Створити словник для відповідності campaign_name -> campaign_id
-    print("Building campaign name-to-ID lookup...")
-    name_to_id_lookup = {}
-    rows = session.execute(f"SELECT campaign_id, campaign_name FROM {keyspace}.raw_campaigns")
-    for r in rows:
-        name_to_id_lookup[r.campaign_name] = r.campaign_id
-    print(f"Lookup created with {len(name_to_id_lookup)} campaigns.")
-
-    # 2. Агрегувати події (покази та кліки)
-    print("Aggregating events from raw_events...")
-    metrics = defaultdict(lambda: {'impressions': 0, 'clicks': 0})
-
-    query = SimpleStatement(f"SELECT campaign_name, ts, wasclicked FROM {keyspace}.raw_events", fetch_size=1000)
-    events = session.execute(query)
-
-    processed_count = 0
-    for event in events:
-        campaign_id = name_to_id_lookup.get(event.campaign_name)
-        if campaign_id is None:
-            continue  # Пропустити, якщо кампанія не знайдена в довіднику
-
-        try:
-            # Отримати лише дату з мітки часу
-            event_date = datetime.fromisoformat(event.ts.replace(" ", "T")).date()
-            key = (campaign_id, event_date)
-
-            metrics[key]['impressions'] += 1
-            if event.wasclicked:
-                metrics[key]['clicks'] += 1
-
-            processed_count += 1
-            if processed_count % 10000 == 0:
-                print(f"Scanned {processed_count} events...")
-        except Exception as e:
-            print(f"Could not process event for campaign '{event.campaign_name}': {e}")
-
-    print(f"Finished aggregation. Found metrics for {len(metrics)} campaign/day pairs.")
-
-    # 3. Завантажити агреговані дані в аналітичну таблицю
-    print("Truncating and loading data into `campaign_daily_metrics`...")
-    session.execute(f"TRUNCATE {keyspace}.campaign_daily_metrics")
-
-    insert_stmt = session.prepare(f"""
-        INSERT INTO {keyspace}.campaign_daily_metrics (campaign_id, event_date, impressions, clicks, ctr)
-        VALUES (?, ?, ?, ?, ?)
-    """)
-
-    batch = BatchStatement()
-    batch_size = 100
-    counter = 0
-
+class CampaignDayMetrics(Accumulator):
+    """Покази та кліки для кожної пари (campaign_id, дата)."""
+
+    def __init__(self, name_to_id_lookup: dict, columns: Sequence[str]):
+        self.name_to_id_lookup = name_to_id_lookup
+        self.positions = column_positions(columns, "campaign_name", "ts", "wasclicked")
+        self.metrics = {}
+
+    def add(self, event) -> None:
+        self.add_page([event])
+
+    def add_page(self, rows) -> None:
+        campaign_i, ts_i, clicked_i = self.positions
+        columns = page_columns(rows)
+        # Групування за (назва кампанії, номер дня): покази — кількість рядків, кліки — сума прапорців
+        days = to_days(to_datetime64(columns[ts_i]))
+        impressions = np.ones(len(rows), dtype=np.int64)
+        clicks = to_bool(columns[clicked_i]).astype(np.int64)
+        for (campaign_name, day), (impr, clk) in group_sums([columns[campaign_i], days], [impressions, clicks]).items():
+            campaign_id = self.name_to_id_lookup.get(campaign_name)
+            if campaign_id is None:
+                continue  # Пропустити, якщо кампанія не знайдена в довіднику
+            values = self.metrics.setdefault((campaign_id, day_to_date(day)), {'impressions': 0, 'clicks': 0})
+            values['impressions'] += impr
+            values['clicks'] += clk
+
+    def merge(self, other: "CampaignDayMetrics") -> "CampaignDayMetrics":
+        for key, values in other.metrics.items():
+            current = self.metrics.setdefault(key, {'impressions': 0, 'clicks': 0})
+            current['impressions'] += values['impressions']
+            current['clicks'] += values['clicks']
+        return self
+
+
+def metric_rows(metrics: dict):
+    """Параметри INSERT для campaign_daily_metrics: (campaign_id, event_date, impressions, clicks, ctr)."""
     for (campaign_id, event_date), values in metrics.items():
         impressions = values['impressions']
         clicks = values['clicks']
         ctr = (clicks / impressions) if impressions > 0 else 0.0
+        yield campaign_id, event_date, impressions, clicks, ctr
+
+
+class CampaignDailyMetricsProjection(Projection):
+    """Проекція `campaign_daily_metrics`: щоденні покази, кліки та CTR кампаній."""
+    name = "campaign_daily_metrics"
+    columns = ("campaign_name", "ts", "wasclicked")
+    versioned_tables = {"campaign_daily_metrics": TABLE_DDL}
+
+    def __init__(self):
+        self.name_to_id_lookup = {}
 
-        batch.add(insert_stmt, (campaign_id, event_date, impressions, clicks, ctr))
-        counter += 1
+    def prepare(self, session, context: Optional[EtlContext] = None) -> None:
+        keyspace = os.environ.get("CASSANDRA_KEYSPACE", "adtech")
 
-        if counter % batch_size == 0:
-            session.execute(batch)
-            batch.clear()
+        # Створити словник для відповідності campaign_name -> campaign_id
+        print("Building campaign name-to-ID lookup...")
+        rows = session.execute(f"SELECT campaign_id, campaign_name FROM {keyspace}.raw_campaigns")
+        self.name_to_id_lookup = {r.campaign_name: r.campaign_id for r in rows}
+        print(f"Lookup created with {len(self.name_to_id_lookup)} campaigns.")
 
-    if len(batch) > 0:
-        session.execute(batch)
+    def accumulator(self, context: EtlContext) -> CampaignDayMetrics:
+        return CampaignDayMetrics(self.name_to_id_lookup, context.columns)
 
-    print("ETL process finished.")
+    def write(self, session, accumulator: CampaignDayMetrics, context: EtlContext) -> None:
+        keyspace = os.environ.get("CASSANDRA_KEYSPACE", "adtech")
+        metrics = accumulator.metrics
+        print(f"Found metrics for {len(metrics)} campaign/day pairs.")
+
+        # Завантажити агреговані дані в нову версію аналітичної таблиці
+        table = context.table(self.name)
+        print(f"Loading data into `{table}`...")
+
+        insert_stmt = session.prepare(f"""
+            INSERT INTO {keyspace}.{table} (campaign_id, event_date, impressions, clicks, ctr)
+            VALUES (?, ?, ?, ?, ?)
+        """)
+
+        # Пакети формуються лише з днів однієї кампанії (одна партиція)
+        with BulkWriter(session, label=self.name) as writer:
+            writer.submit_grouped(insert_stmt, metric_rows(metrics), partition_key=lambda params: params[0])
+
+
+PROJECTION = register(CampaignDailyMetricsProjection())
+
+
+def process_and_load_data(session):
+    """
+    Виконує повний ETL-процес: читання, агрегацію та завантаження даних.
+    """
+    run_projections(session, [PROJECTION])
 
 
 def main():
@@ -131,7 +154,7 @@ def main():
         return
 
     try:
-        ensure_analytics_table_exists(session)
+        PROJECTION.ensure_table(session)
         process_and_load_data(session)
         print("✅ Analytics data for daily campaign metrics loaded successfully.")
     finally:
@@ -0,0 +1,252 @@
+# load_analytics_incremental.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Інкрементальний ETL за денними бакетами `raw_events_by_day`.
+#
+# Замість TRUNCATE і перерахунку всієї історії обробляються лише закриті дні,
+# що з'явилися після останнього checkpoint у таблиці `etl_checkpoints`:
+#   - `campaign_performance_by_day` отримує дельти лічильників за день;
+#   - у `campaign_daily_metrics` перезаписуються лише рядки оброблених днів;
+#   - `user_engagement_history` доповнюється подіями нових днів.
+# Час запуску залежить від обсягу подій за день, а не від розміру raw_events.
+#
+# День вважається закритим, якщо він раніше за день останньої події з
+# ingest_metadata: поточний день ще може отримувати нові події, а повторне
+# застосування лічильників до нього подвоїло б значення.
+#
+# Повний перерахунок migrate_denormalized заповнює лічильники
+# `campaign_performance_by_day` до останнього закритого дня й записує цю межу в
+# checkpoint `COUNTERS_REBUILD_JOB`; дельти лічильників за дні до неї не
+# застосовуються повторно (інкремент лічильника не можна скасувати).
+#
+# Рядки пишуться в активні версії `campaign_daily_metrics` та
+# `user_engagement_history` (див. versioning.py).
+
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from cassandra.query import ConsistencyLevel, SimpleStatement
+from dotenv import load_dotenv
+
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.columnar import group_sums, page_columns, to_bool
+from analyze_ads_cassandra.etl_scripts import load_analytics_campaign_daily_metrics as daily_metrics
+from analyze_ads_cassandra.etl_scripts import load_analytics_user_engagement as user_engagement
+from analyze_ads_cassandra.ingest_metadata import days_between, read_day_counts, read_watermark
+from analyze_ads_cassandra.metrics import print_summary, stage
+from analyze_ads_cassandra.scanner import Accumulator, ScanMetrics, column_positions, iter_pages
+from analyze_ads_cassandra.user_history import history_params, insert_query
+from analyze_ads_cassandra.utils import TUPLE_PROFILE, get_db_connection
+from analyze_ads_cassandra.versioning import active_table, ensure_versions_table
+
+JOB_NAME = "daily_incremental"
+# Межа, до якої лічильники вже заповнено повним перерахунком migrate_denormalized
+COUNTERS_REBUILD_JOB = "campaign_performance_rebuild"
+# Порядок збігається з аргументами user_history.history_params
+BUCKET_COLUMNS = ("user_id", "ts", "campaign_name", "advertiser_name", "wasclicked")
+FETCH_SIZE = 5000
+
+CHECKPOINTS_DDL = """
+CREATE TABLE IF NOT EXISTS etl_checkpoints (
+    job         text,
+    bucket      date,
+    rows        bigint,
+    finished_at timestamp,
+    PRIMARY KEY (job, bucket)
+) WITH CLUSTERING ORDER BY (bucket DESC)
+"""
+
+CAMPAIGN_PERFORMANCE_DDL = """
+CREATE TABLE IF NOT EXISTS campaign_performance_by_day (
+    campaign_name   text,
+    impressions     counter,
+    clicks          counter,
+    event_date      date,
+    PRIMARY KEY (campaign_name, event_date)
+)
+"""
+
+
+def ensure_tables_exist(session):
+    """Створює checkpoint-таблицю та цільові таблиці, якщо їх немає."""
+    session.execute(CHECKPOINTS_DDL)
+    session.execute(CAMPAIGN_PERFORMANCE_DDL)
+    ensure_versions_table(session)
+    # Таблиці без версій (повне перезавантаження ще не запускалося) створюються під логічною назвою
+    for module in (daily_metrics, user_engagement):
+        if active_table(session, module.PROJECTION.name) == module.PROJECTION.name:
+            module.ensure_analytics_table_exists(session)
+
+
+def last_checkpoint(session, job: str = JOB_NAME) -> Optional[date]:
+    """Останній повністю оброблений день або None для першого запуску."""
+    row = session.execute("SELECT bucket FROM etl_checkpoints WHERE job = %s LIMIT 1", (job,)).one()
+    return row.bucket.date() if row else None
+
+
+def save_checkpoint(session, bucket: date, rows: int, job: str = JOB_NAME) -> None:
+    session.execute(
+        "INSERT INTO etl_checkpoints (job, bucket, rows, finished_at) VALUES (%s, %s, %s, %s)",
+        (job, bucket, rows, datetime.utcnow()),
+    )
+
+
+def reset_checkpoint(session, bucket: date, rows: int, job: str) -> None:
+    """Замінює всі checkpoint-и `job` одним (після повного перерахунку межа може зсунутися назад)."""
+    session.execute("DELETE FROM etl_checkpoints WHERE job = %s", (job,))
+    save_checkpoint(session, bucket, rows, job)
+
+
+class DayBucketAggregates(Accumulator):
+    """Агрегати одного дня: метрики кампаній для campaign_daily_metrics та дельти лічильників."""
+
+    def __init__(self, name_to_id_lookup: dict):
+        self.campaign_metrics = daily_metrics.CampaignDayMetrics(name_to_id_lookup, BUCKET_COLUMNS)
+        self.positions = column_positions(BUCKET_COLUMNS, "campaign_name", "wasclicked")
+        self.counters = defaultdict(lambda: [0, 0])  # campaign_name -> [impressions, clicks]
+
+    def add(self, event) -> None:
+        self.add_page([event])
+
+    def add_page(self, rows) -> None:
+        campaign_i, clicked_i = self.positions
+        self.campaign_metrics.add_page(rows)
+        columns = page_columns(rows)
+        impressions = np.ones(len(rows), dtype=np.int64)
+        clicks = to_bool(columns[clicked_i]).astype(np.int64)
+        for (campaign_name,), (impr, clk) in group_sums([columns[campaign_i]], [impressions, clicks]).items():
+            impr_click = self.counters[campaign_name]
+            impr_click[0] += impr
+            impr_click[1] += clk
+
+    def merge(self, other: "DayBucketAggregates") -> "DayBucketAggregates":
+        self.campaign_metrics.merge(other.campaign_metrics)
+        for name, (impr, clk) in other.counters.items():
+            impr_click = self.counters[name]
+            impr_click[0] += impr
+            impr_click[1] += clk
+        return self
+
+
+class IncrementalStatements:
+    def __init__(self, session):
+        self.select_bucket = SimpleStatement(
+            f"SELECT {', '.join(BUCKET_COLUMNS)} FROM raw_events_by_day WHERE event_date = %s",
+            fetch_size=FETCH_SIZE, consistency_level=ConsistencyLevel.ONE,
+        )
+        self.insert_engagement = session.prepare(insert_query(active_table(session, user_engagement.PROJECTION.name)))
+        self.update_counters = session.prepare("""
+            UPDATE campaign_performance_by_day
+            SET impressions = impressions + ?,
+                clicks      = clicks      + ?
+            WHERE campaign_name = ? AND event_date = ?
+        """)
+        self.insert_metrics = session.prepare(f"""
+            INSERT INTO {active_table(session, daily_metrics.PROJECTION.name)} (campaign_id, event_date, impressions, clicks, ctr)
+            VALUES (?, ?, ?, ?, ?)
+        """)
+
+
+def process_bucket(session, bucket: date, statements: IncrementalStatements, name_to_id_lookup: dict,
+                   apply_counters: bool = True) -> int:
+    """
+    Обробляє один день: читає його партицію і застосовує зміни до аналітичних таблиць.
+    `apply_counters=False` — лічильники цього дня вже заповнені повним перерахунком.
+    """
+    aggregates = DayBucketAggregates(name_to_id_lookup)
+
+    # 1. Читання партиції дня; історія користувачів дописується під час читання
+    metrics = ScanMetrics("raw_events_by_day")
+    with stage("scan"), BulkWriter(session, label=f"user_engagement_history {bucket}",
+                                   metric_label="user_engagement_history") as writer:
+        fetch_started = time.perf_counter()
+        result = session.execute(statements.select_bucket, (bucket,), execution_profile=TUPLE_PROFILE)
+        for page in iter_pages(result):
+            aggregate_started = time.perf_counter()
+            metrics.fetch_ms.observe((aggregate_started - fetch_started) * 1000)
+            aggregates.add_page(page)
+            metrics.aggregate_ms.observe((time.perf_counter() - aggregate_started) * 1000)
+            metrics.rows.inc(len(page))
+            for event in page:
+                writer.submit(statements.insert_engagement, history_params(*event))
+            fetch_started = time.perf_counter()
+    failures = len(writer.failures)
+    rows = writer.completed
+
+    # 2. Перезапис рядків цього дня в campaign_daily_metrics (upsert, ідемпотентно)
+    with stage("write:campaign_daily_metrics"), \
+            BulkWriter(session, label=f"campaign_daily_metrics {bucket}", metric_label="campaign_daily_metrics") as writer:
+        for params in daily_metrics.metric_rows(aggregates.campaign_metrics.metrics):
+            writer.submit(statements.insert_metrics, params)
+    failures += len(writer.failures)
+    if failures:
+        raise RuntimeError(f"bucket {bucket}: {failures} writes failed, checkpoint not advanced")
+
+    # 3. Дельти лічильників — останніми і без повторів: повтор запиту
+    #    після тайм-ауту міг би застосувати інкремент двічі
+    if not apply_counters:
+        print(f"Counters for {bucket} already loaded by the full rebuild, skipping.")
+        return rows
+    with stage("write:counters"), \
+            BulkWriter(session, label=f"campaign_performance_by_day {bucket}",
+                       metric_label="campaign_performance_by_day", max_retries=0) as writer:
+        for campaign_name, (impressions, clicks) in aggregates.counters.items():
+            writer.submit(statements.update_counters, (impressions, clicks, campaign_name, bucket))
+    if writer.failures:
+        print(f"⚠️  {len(writer.failures)} counter updates for {bucket} failed; "
+              f"campaign_performance_by_day may need a rebuild for this day.")
+    return rows
+
+
+def run_incremental(session) -> None:
+    watermark = read_watermark(session)
+    if watermark is None:
+        print("No ingest_metadata for raw_events. Run import_data first. Exiting.")
+        return
+
+    last_bucket = last_checkpoint(session)
+    counters_rebuilt_until = last_checkpoint(session, COUNTERS_REBUILD_JOB)
+    closed_until = watermark.latest_ts.date() - timedelta(days=1)
+    buckets = days_between(read_day_counts(session), last_bucket, closed_until)
+    print(f"Last processed bucket: {last_bucket or 'none'}; closed buckets up to {closed_until}.")
+    if counters_rebuilt_until:
+        print(f"campaign_performance_by_day rebuilt up to {counters_rebuilt_until}.")
+    if not buckets:
+        print("Analytics tables are up to date.")
+        return
+
+    daily_metrics.PROJECTION.prepare(session)  # довідник campaign_name -> campaign_id
+    statements = IncrementalStatements(session)
+    print(f"Processing {len(buckets)} new day buckets: {buckets[0]} … {buckets[-1]}")
+    for bucket in buckets:
+        apply_counters = counters_rebuilt_until is None or bucket > counters_rebuilt_until
+        rows = process_bucket(session, bucket, statements, daily_metrics.PROJECTION.name_to_id_lookup,
+                              apply_counters)
+        save_checkpoint(session, bucket, rows)
+        print(f"✅ Bucket {bucket} processed: {rows} events.")
+    print("Incremental ETL finished.")
+
+
+def main():
+    """
+    Головна функція для запуску інкрементального ETL-процесу.
+    """
+    load_dotenv()
+    session = get_db_connection()
+    if not session:
+        print("❌ Failed to connect to Cassandra. Exiting.")
+        return
+
+    try:
+        ensure_tables_exist(session)
+        run_incremental(session)
+        print_summary()
+    finally:
+        session.shutdown()
+        print("Cassandra connection closed.")
+
+
+if __name__ == "__main__":
+    main()
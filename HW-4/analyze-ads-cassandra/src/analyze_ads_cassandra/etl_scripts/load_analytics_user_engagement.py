@@ -2,14 +2,39 @@
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Цей скрипт читає дані з raw_events і заповнює денормалізовану
 # таблицю `user_engagement_history` для швидкого доступу до історії користувача.
+# Історія розбита на місячні партиції `(user_id, month)` з TTL (див. user_history.py);
+# події пишуться асинхронно через спільний BulkWriter. Кожне повне перезавантаження
+# копіює лише події в межах TTL відносно останньої події, тож нова версія таблиці
+# не тягне всю історію raw_events.
 
 import os
 from datetime import datetime
-from cassandra.query import SimpleStatement
+from typing import Optional, Sequence
+
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.etl_scripts.runner import EtlContext, Projection, register, run_projections
+from analyze_ads_cassandra.scanner import Accumulator, column_positions
+from analyze_ads_cassandra.user_history import HISTORY_TTL_DAYS, history_params, history_start, insert_query
 from analyze_ads_cassandra.utils import get_db_connection
 
+
+# DDL-шаблон: `{table}` — логічна назва або фізична таблиця версії
+TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {{table}} (
+    user_id int,
+    month date,
+    event_time timestamp,
+    campaign_name text,
+    advertiser_name text,
+    was_clicked boolean,
+    PRIMARY KEY ((user_id, month), event_time)
+) WITH CLUSTERING ORDER BY (event_time DESC)
+  AND default_time_to_live = {HISTORY_TTL_DAYS * 24 * 3600}
+"""
+
+
 def ensure_analytics_table_exists(session):
     """
     Перевіряє існування таблиці `user_engagement_history` і створює її, якщо потрібно.
@@ -24,63 +49,92 @@ def ensure_analytics_table_exists(session):
 
     if not table_check.one():
         print(f"Table {table_name} not found. Creating it...")
-        ddl_query = """
-        CREATE TABLE user_engagement_history (
-            user_id int,
-            event_time timestamp,
-            campaign_name text,
-            advertiser_name text,
-            was_clicked boolean,
-            PRIMARY KEY (user_id, event_time)
-        ) WITH CLUSTERING ORDER BY (event_time DESC)
-        """
-        session.execute(ddl_query)
+        session.execute(TABLE_DDL.format(table=table_name))
         print(f"Table {table_name} created successfully.")
     else:
         print(f"Table {table_name} already exists.")
 
 
-def process_and_load_data(session):
+class EngagementCopier(Accumulator):
     """
-    Читає дані з raw_events та завантажує їх у user_engagement_history.
+    Надсилає кожну подію піддіапазону в user_engagement_history через спільний
+    BulkWriter; «агрегат» — кількість надісланих рядків. Події, старші за `start`,
+    пропускаються.
     """
-    print("Starting data processing from raw_events for user engagement...")
 
-    # Очищення таблиці перед новим завантаженням для ідемпотентності
-    print("Truncating user_engagement_history to ensure fresh data...")
-    session.execute("TRUNCATE adtech.user_engagement_history")
+    def __init__(self, writer: BulkWriter, insert_stmt, columns: Sequence[str], start: Optional[datetime] = None):
+        self.writer = writer
+        self.insert_stmt = insert_stmt
+        self.start = start
+        # Порядок аргументів history_params: user_id, event_time, campaign_name, advertiser_name, was_clicked
+        self.positions = column_positions(columns, "user_id", "ts", "campaign_name", "advertiser_name", "wasclicked")
+        self.processed = 0
+
+    def add(self, event) -> None:
+        self.add_page([event])
+
+    def add_page(self, rows) -> None:
+        positions, start = self.positions, self.start
+        ts_i = positions[1]
+        if start is not None:
+            rows = [event for event in rows if event[ts_i] >= start]
+        for event in rows:
+            self.writer.submit(self.insert_stmt, history_params(*(event[i] for i in positions)))
+        self.processed += len(rows)
 
-    insert_stmt = session.prepare("""
-        INSERT INTO user_engagement_history (user_id, event_time, campaign_name, advertiser_name, was_clicked)
-        VALUES (?, ?, ?, ?, ?)
-    """)
+    def merge(self, other: "EngagementCopier") -> "EngagementCopier":
+        self.processed += other.processed
+        return self
 
-    query = SimpleStatement("SELECT user_id, ts, campaign_name, advertiser_name, wasclicked FROM raw_events",
-                            fetch_size=1000)
-    rows = session.execute(query)
 
-    processed_count = 0
-    for event in rows:
-        try:
-            # Конвертуємо рядок з часом у тип timestamp
-            event_timestamp = datetime.fromisoformat(event.ts.replace(" ", "T"))
+class UserEngagementHistoryProjection(Projection):
+    """
+    Проекція `user_engagement_history`: копія кожної події для історії користувача.
+    Запис виконується під час сканування, тому потрібен потоковий режим зі спільним BulkWriter.
+    """
+    name = "user_engagement_history"
+    columns = ("user_id", "ts", "campaign_name", "advertiser_name", "wasclicked")
+    thread_only = True
+    # Остання подія потрібна для межі TTL (history_start)
+    needs_window = True
+    versioned_tables = {"user_engagement_history": TABLE_DDL}
 
-            session.execute(insert_stmt, (
-                event.user_id,
-                event_timestamp,
-                event.campaign_name,
-                event.advertiser_name,
-                event.wasclicked
-            ))
+    def __init__(self):
+        self.writer = None
+        self.insert_stmt = None
 
-            processed_count += 1
-            if processed_count % 5000 == 0:
-                print(f"Processed {processed_count} events for user history...")
+    def prepare(self, session, context: Optional[EtlContext] = None) -> None:
+        # Події пишуться в нову версію таблиці; читачі бачать попередню до перемикання
+        table = context.table(self.name) if context else self.name
+        start = history_start(context.latest_timestamp) if context else None
+        print(f"Loading user history into `{table}`" + (f" from {start}..." if start else "..."))
 
-        except Exception as e:
-            print(f"Could not process event for user '{event.user_id}': {e}")
+        self.writer = BulkWriter(session, label=self.name)
+        self.insert_stmt = session.prepare(insert_query(table))
 
-    print(f"ETL process finished. Total events loaded into user_engagement_history: {processed_count}.")
+    def accumulator(self, context: EtlContext) -> EngagementCopier:
+        return EngagementCopier(self.writer, self.insert_stmt, context.columns, history_start(context.latest_timestamp))
+
+    def write(self, session, accumulator: EngagementCopier, context: EtlContext) -> None:
+        # Повтор невдалих вставок (ідемпотентні) і очікування решти запитів вікна
+        self.writer.flush()
+        if self.writer.failures:
+            self.writer.retry_failures()
+        self.writer.close()
+        if self.writer.failures:
+            raise RuntimeError(f"{len(self.writer.failures)} user history writes failed")
+        print(f"Total events loaded into {context.table(self.name)}: {self.writer.completed} "
+              f"of {accumulator.processed}.")
+
+
+PROJECTION = register(UserEngagementHistoryProjection())
+
+
+def process_and_load_data(session):
+    """
+    Читає дані з raw_events та завантажує їх у user_engagement_history.
+    """
+    run_projections(session, [PROJECTION])
 
 
 def main():
@@ -94,7 +148,7 @@ def main():
         return
 
     try:
-        ensure_analytics_table_exists(session)
+        PROJECTION.ensure_table(session)
         process_and_load_data(session)
         print("✅ Analytics data for user engagement loaded successfully.")
     finally:
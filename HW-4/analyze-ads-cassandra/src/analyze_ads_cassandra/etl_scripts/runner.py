@@ -0,0 +1,250 @@
+# runner.py
+# ~~~~~~~~~
+# Єдиний ETL-запуск для всіх аналітичних проекцій.
+#
+# Кожна проекція (top_users_by_clicks, top_advertisers_by_spend, ...) реєструється
+# як плагін з акумулятором та записувачем. Runner об'єднує потрібні колонки всіх
+# проекцій, виконує одне паралельне сканування raw_events і записує результати
+# проекцій одночасно.
+#
+# Таблиці проекцій з `versioned_tables` не очищуються: кожен запуск пише в їхні
+# нові версії (див. versioning.py), а покажчик перемикається лише після
+# успішного запису, тож читачі не бачать порожніх чи неповних таблиць.
+
+import importlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from analyze_ads_cassandra.etl_scripts.common import find_latest_timestamp
+from analyze_ads_cassandra.ingest_metadata import read_watermark
+from analyze_ads_cassandra.metrics import print_summary, stage
+from analyze_ads_cassandra.scanner import Accumulator, parallel_scan
+from analyze_ads_cassandra.utils import get_db_connection
+from analyze_ads_cassandra.versioning import VersionedLoad, ensure_versions_table, wait_for_drops
+
+# Модулі, що реєструють свої проекції під час імпорту
+PROJECTION_MODULES = [
+    "analyze_ads_cassandra.etl_scripts.load_analytics_campaign_daily_metrics",
+    "analyze_ads_cassandra.etl_scripts.load_analytics_advertiser_spend",
+    "analyze_ads_cassandra.etl_scripts.load_analytics_advertiser_spend_by_region",
+    "analyze_ads_cassandra.etl_scripts.load_analytics_active_users",
+    "analyze_ads_cassandra.etl_scripts.load_analytics_user_engagement",
+]
+
+WINDOW_DAYS = 30
+
+
+@dataclass
+class EtlContext:
+    """
+    Спільні для всіх проекцій параметри запуску. `columns` — порядок колонок
+    у кортежах рядків спільного сканування; `tables` — фізичні таблиці нових
+    версій, у які пише поточний запуск.
+    """
+    latest_timestamp: Optional[datetime] = None
+    window_start: Optional[datetime] = None
+    columns: Tuple[str, ...] = ()
+    tables: Dict[str, str] = field(default_factory=dict)
+
+    def table(self, name: str) -> str:
+        return self.tables.get(name, name)
+
+
+class Projection:
+    """
+    Плагін аналітичної проекції.
+
+    `columns` — колонки raw_events, потрібні акумулятору; `needs_window` — чи
+    потрібне 30-денне вікно відносно останньої події; `thread_only` — акумулятор
+    тримає сесію і не може виконуватися в окремому процесі; `versioned_tables` —
+    логічна назва таблиці -> DDL-шаблон з `{table}` для версійного перезавантаження.
+    """
+    name: str = ""
+    columns: Sequence[str] = ()
+    needs_window: bool = False
+    thread_only: bool = False
+    versioned_tables: Dict[str, str] = {}
+
+    def ensure_table(self, session) -> None:
+        """Створює цільову таблицю, якщо її немає."""
+        if self.versioned_tables:
+            ensure_versions_table(session)
+
+    def prepare(self, session, context: Optional[EtlContext] = None) -> None:
+        """Підготовка перед скануванням (довідники, prepared statements)."""
+
+    def accumulator(self, context: EtlContext) -> Accumulator:
+        raise NotImplementedError
+
+    def write(self, session, accumulator: Accumulator, context: EtlContext) -> None:
+        raise NotImplementedError
+
+
+PROJECTIONS: Dict[str, Projection] = {}
+
+
+def register(projection: Projection) -> Projection:
+    PROJECTIONS[projection.name] = projection
+    return projection
+
+
+class MultiAccumulator(Accumulator):
+    """Передає кожен рядок акумуляторам усіх проекцій."""
+
+    def __init__(self, parts: Dict[str, Accumulator]):
+        self.parts = parts
+        self._adders = [acc.add for acc in parts.values()]
+
+    @classmethod
+    def create(cls, projections: Sequence[Projection], context: EtlContext) -> "MultiAccumulator":
+        return cls({p.name: p.accumulator(context) for p in projections})
+
+    def add(self, row) -> None:
+        for add in self._adders:
+            add(row)
+
+    def add_page(self, rows) -> None:
+        for acc in self.parts.values():
+            acc.add_page(rows)
+
+    def merge(self, other: "MultiAccumulator") -> "MultiAccumulator":
+        for name, acc in other.parts.items():
+            self.parts[name] = self.parts[name].merge(acc)
+        self._adders = [acc.add for acc in self.parts.values()]
+        return self
+
+    def __getstate__(self):
+        return {"parts": self.parts}
+
+    def __setstate__(self, state):
+        self.__init__(state["parts"])
+
+
+def resolve_context(session, projections: Sequence[Projection]) -> Optional[EtlContext]:
+    """
+    Визначає часове вікно один раз для всіх проекцій, яким воно потрібне.
+    Межі беруться з ingest_metadata; якщо метаданих немає (дані завантажено
+    старою версією load_raw), остання мітка часу шукається скануванням.
+    """
+    context = EtlContext()
+    if not any(p.needs_window for p in projections):
+        return context
+
+    watermark = read_watermark(session)
+    if watermark:
+        print(f"Latest timestamp taken from ingest_metadata ({watermark.total_rows} rows ingested)")
+        context.latest_timestamp = watermark.latest_ts
+    else:
+        print("⚠️  No ingest_metadata for raw_events, finding the latest timestamp by scanning...")
+        context.latest_timestamp = find_latest_timestamp(session)
+    if not context.latest_timestamp:
+        return None
+    context.window_start = context.latest_timestamp - timedelta(days=WINDOW_DAYS)
+    print(f"Latest event timestamp found: {context.latest_timestamp}; "
+          f"window starts at {context.window_start}")
+    return context
+
+
+def run_projections(session, projections: Sequence[Projection], mode: str = None) -> None:
+    """Обчислює всі проекції за одне сканування raw_events і записує їх паралельно."""
+    names = ", ".join(p.name for p in projections)
+    print(f"Starting ETL for projections: {names}")
+
+    with stage("context"):
+        context = resolve_context(session, projections)
+    if context is None:
+        print("No events found in raw_events. Exiting.")
+        return
+
+    # Порожні таблиці нових версій; старі версії читаються до перемикання покажчиків
+    loads = {p.name: VersionedLoad(session, p.versioned_tables) for p in projections if p.versioned_tables}
+    for load in loads.values():
+        context.tables.update(load.begin())
+
+    try:
+        for projection in projections:
+            projection.prepare(session, context)
+
+        columns: List[str] = []
+        for projection in projections:
+            columns += [c for c in projection.columns if c not in columns]
+        context.columns = tuple(columns)
+        if any(p.thread_only for p in projections):
+            mode = "thread"
+
+        started = time.perf_counter()
+        with stage("scan"):
+            result = parallel_scan(session, "raw_events", columns,
+                                   partial(MultiAccumulator.create, list(projections), context), mode=mode)
+        print(f"Aggregation finished in {time.perf_counter() - started:.1f}s, writing projections ...")
+    except BaseException:
+        for load in loads.values():
+            load.abort()
+        raise
+
+    def write(projection: Projection) -> None:
+        with stage(f"write:{projection.name}"):
+            projection.write(session, result.parts[projection.name], context)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(projections), thread_name_prefix="write") as pool:
+        futures = {pool.submit(write, p): p.name for p in projections}
+        for future, name in futures.items():
+            try:
+                future.result()
+                if name in loads:
+                    with stage("commit"):
+                        loads[name].commit()
+            except Exception as e:
+                # Покажчик не перемикається: читачі залишаються на попередній версії
+                print(f"❌ Projection {name} failed: {e}")
+                failed.append(name)
+                if name in loads:
+                    loads[name].abort()
+                continue
+            print(f"✅ Projection {name} written.")
+
+    wait_for_drops()
+    if failed:
+        raise RuntimeError(f"Projections failed: {', '.join(failed)}")
+    print("ETL process finished.")
+
+
+def load_projections(names: Sequence[str] = None) -> List[Projection]:
+    for module in PROJECTION_MODULES:
+        importlib.import_module(module)
+    if not names:
+        return list(PROJECTIONS.values())
+    return [PROJECTIONS[name] for name in names]
+
+
+def main():
+    """
+    Оновлює всі аналітичні таблиці за один прохід по raw_events.
+    """
+    load_dotenv()
+    session = get_db_connection()
+    if not session:
+        print("❌ Failed to connect to Cassandra. Exiting.")
+        return
+
+    try:
+        projections = load_projections()
+        for projection in projections:
+            projection.ensure_table(session)
+        run_projections(session, projections)
+        print("✅ All analytics tables loaded successfully.")
+        print_summary()
+    finally:
+        session.shutdown()
+        print("Cassandra connection closed.")
+
+
+if __name__ == "__main__":
+    main()
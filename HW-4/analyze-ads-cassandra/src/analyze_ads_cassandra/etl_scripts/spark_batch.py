@@ -0,0 +1,224 @@
+# spark_batch.py
+# ~~~~~~~~~~~~~~
+# Пакетний ETL аналітичних проекцій на Spark (за замовчуванням `local[*]`).
+#
+# raw_events читається через Spark Cassandra Connector: кожна Spark-партиція —
+# діапазон токенів розміром близько `spark.cassandra.input.split.sizeInMB`,
+# який читається з вузлів-реплік. Агрегація виконується розподілено, а запис —
+# груповими пакетами конектора за ключем партиції Cassandra.
+#
+# Проекції ті самі, що в runner.py, і пишуться у нові версії таблиць
+# (versioning.py); покажчики перемикаються після успішного запису. DDL і
+# перемикання виконуються через звичайну сесію драйвера.
+#
+# Потрібен pyspark (`poetry install --extras spark`); пакет конектора
+# завантажується Spark через `spark.jars.packages`.
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from analyze_ads_cassandra.etl_scripts.runner import WINDOW_DAYS, load_projections
+from analyze_ads_cassandra.ingest_metadata import read_watermark
+from analyze_ads_cassandra.leaderboard import DEFAULT_TOP_K, RANK_PAGE_SIZE
+from analyze_ads_cassandra.user_history import history_start
+from analyze_ads_cassandra.utils import get_db_connection
+from analyze_ads_cassandra.versioning import VersionedLoad, ensure_versions_table, wait_for_drops
+
+try:
+    from pyspark.sql import DataFrame, SparkSession, Window
+    from pyspark.sql import functions as F
+except ImportError:  # pragma: no cover - pyspark є необов'язковою залежністю
+    SparkSession = None
+
+CONNECTOR_PACKAGE = os.getenv("SPARK_CASSANDRA_CONNECTOR", "com.datastax.spark:spark-cassandra-connector_2.12:3.5.1")
+CASSANDRA_FORMAT = "org.apache.spark.sql.cassandra"
+TIME_BUCKET = "last_30_days_historical"
+
+
+def create_spark_session() -> "SparkSession":
+    if SparkSession is None:
+        raise RuntimeError("pyspark is not installed. Install it with `poetry install --extras spark`.")
+    return (SparkSession.builder
+            .appName("AnalyzeAdsBatchEtl")
+            .master(os.getenv("SPARK_MASTER", "local[*]"))
+            .config("spark.jars.packages", CONNECTOR_PACKAGE)
+            .config("spark.sql.extensions", "com.datastax.spark.connector.CassandraSparkExtensions")
+            .config("spark.cassandra.connection.host", os.getenv("CASSANDRA_HOST", "127.0.0.1"))
+            .config("spark.cassandra.connection.port", os.getenv("CASSANDRA_PORT", "9042"))
+            .config("spark.cassandra.connection.localDC", os.getenv("CASSANDRA_LOCAL_DC", "datacenter1"))
+            # Читання: Spark-партиція = діапазон токенів приблизно такого розміру
+            .config("spark.cassandra.input.split.sizeInMB", os.getenv("SPARK_CASSANDRA_SPLIT_MB", "64"))
+            .config("spark.cassandra.input.fetch.sizeInRows", "5000")
+            # Запис: пакети UNLOGGED з рядків однієї партиції Cassandra
+            .config("spark.cassandra.output.batch.grouping.key", "partition")
+            .config("spark.cassandra.output.batch.size.rows", "auto")
+            .config("spark.cassandra.output.concurrent.writes", os.getenv("SPARK_CASSANDRA_CONCURRENT_WRITES", "8"))
+            .config("spark.sql.shuffle.partitions", os.getenv("SPARK_SHUFFLE_PARTITIONS", "64"))
+            # Межа вікна, дні й місяці в UTC, як у Python ETL, незалежно від часового поясу JVM
+            .config("spark.sql.session.timeZone", "UTC")
+            .getOrCreate())
+
+
+def read_table(spark: "SparkSession", keyspace: str, table: str) -> "DataFrame":
+    return spark.read.format(CASSANDRA_FORMAT).options(keyspace=keyspace, table=table).load()
+
+
+def write_table(df: "DataFrame", keyspace: str, table: str) -> None:
+    df.write.format(CASSANDRA_FORMAT).options(keyspace=keyspace, table=table).mode("append").save()
+
+
+def top_per_partition(df: "DataFrame", partition_cols, score_col: str, tie_col: str, k: int) -> "DataFrame":
+    """Top-K рядків кожної партиції за спаданням `score_col` (k <= 0 — без обмеження)."""
+    if k <= 0:
+        return df
+    order = Window.partitionBy(*partition_cols).orderBy(F.col(score_col).desc(), F.col(tie_col))
+    return df.withColumn("_rank", F.row_number().over(order)).where(F.col("_rank") <= k).drop("_rank")
+
+
+# --- Проекції: DataFrame(и) для кожної логічної таблиці ---
+def campaign_daily_metrics(events, window, campaigns) -> Dict[str, "DataFrame"]:
+    daily = (events
+             .join(F.broadcast(campaigns.select("campaign_id", "campaign_name")), "campaign_name")
+             .groupBy("campaign_id", F.to_date("ts").alias("event_date"))
+             .agg(F.count(F.lit(1)).alias("impressions"),
+                  F.sum(F.coalesce(F.col("wasclicked"), F.lit(False)).cast("long")).alias("clicks")))
+    daily = daily.withColumn("ctr", F.when(F.col("impressions") > 0,
+                                           F.col("clicks") / F.col("impressions")).otherwise(F.lit(0.0)))
+    return {"campaign_daily_metrics": daily}
+
+
+def top_advertisers_by_spend(events, window, campaigns) -> Dict[str, "DataFrame"]:
+    spend = (window.groupBy("advertiser_name")
+             .agg(F.sum(F.coalesce(F.col("adcost"), F.lit(0))).alias("total_spend"))
+             .withColumn("time_bucket", F.lit(TIME_BUCKET)))
+    return {"top_advertisers_by_spend": top_per_partition(spend, ["time_bucket"], "total_spend",
+                                                          "advertiser_name", DEFAULT_TOP_K)}
+
+
+def top_advertisers_by_region(events, window, campaigns) -> Dict[str, "DataFrame"]:
+    spend = (window
+             .select(F.trim("campaign_targeting_country").alias("region"),
+                     F.trim("advertiser_name").alias("advertiser_name"), "adcost")
+             .where((F.length("region") > 0) & (F.length("advertiser_name") > 0))
+             .groupBy("region", "advertiser_name")
+             .agg(F.sum(F.coalesce(F.col("adcost"), F.lit(0))).alias("total_spend")))
+    return {"top_advertisers_by_region": top_per_partition(spend, ["region"], "total_spend",
+                                                           "advertiser_name", DEFAULT_TOP_K)}
+
+
+def top_users_by_clicks(events, window, campaigns) -> Dict[str, "DataFrame"]:
+    clicks = (window.where(F.col("wasclicked"))
+              .groupBy("user_id").agg(F.count(F.lit(1)).cast("int").alias("total_clicks"))
+              .withColumn("time_bucket", F.lit(TIME_BUCKET)))
+    # Глобальний ранг: сортування розподілене, номер рядка — через zipWithIndex без однієї Window-партиції
+    ordered = clicks.orderBy(F.col("total_clicks").desc(), F.col("user_id"))
+    ranked = (ordered.rdd.zipWithIndex()
+              .map(lambda pair: (TIME_BUCKET, pair[0]["user_id"], pair[0]["total_clicks"], pair[1] + 1))
+              .toDF(["time_bucket", "user_id", "total_clicks", "rank"])
+              .withColumn("rank", F.col("rank").cast("int"))
+              .persist())  # ранг пишеться у дві таблиці — сортування виконується один раз
+    pages = ranked.withColumn("page", ((F.col("rank") - 1) / F.lit(RANK_PAGE_SIZE)).cast("int"))
+    return {
+        "top_users_by_clicks": top_per_partition(clicks, ["time_bucket"], "total_clicks", "user_id", DEFAULT_TOP_K),
+        "user_click_rank": ranked,
+        "user_click_rank_pages": pages,
+    }
+
+
+def user_engagement_history(events, window, campaigns, start: Optional[datetime] = None) -> Dict[str, "DataFrame"]:
+    # Лише події в межах TTL: старіші в новій версії таблиці одразу б застаріли
+    if start is not None:
+        events = events.where(F.col("ts") >= F.lit(start.replace(tzinfo=timezone.utc)))
+    history = events.select(
+        "user_id",
+        F.trunc("ts", "month").alias("month"),
+        F.col("ts").alias("event_time"),
+        "campaign_name",
+        "advertiser_name",
+        F.coalesce(F.col("wasclicked"), F.lit(False)).alias("was_clicked"),
+    )
+    return {"user_engagement_history": history}
+
+
+BUILDERS: Dict[str, Callable] = {
+    "campaign_daily_metrics": campaign_daily_metrics,
+    "top_advertisers_by_spend": top_advertisers_by_spend,
+    "top_advertisers_by_region": top_advertisers_by_region,
+    "top_users_by_clicks": top_users_by_clicks,
+    "user_engagement_history": user_engagement_history,
+}
+EVENT_COLUMNS = ["user_id", "ts", "campaign_name", "advertiser_name", "wasclicked", "adcost",
+                 "campaign_targeting_country"]
+
+
+def run_spark_etl(session, spark: "SparkSession", keyspace: str) -> None:
+    watermark = read_watermark(session)
+    if watermark is None:
+        print("No ingest_metadata for raw_events. Run import_data first. Exiting.")
+        return
+    window_start = watermark.latest_ts - timedelta(days=WINDOW_DAYS)
+    print(f"Latest event timestamp: {watermark.latest_ts}; window starts at {window_start}")
+
+    events = read_table(spark, keyspace, "raw_events").select(*EVENT_COLUMNS).persist()
+    # Драйвер повертає наївний UTC-час; з tzinfo літерал не залежить від часового поясу сесії
+    window = events.where(F.col("ts") >= F.lit(window_start.replace(tzinfo=timezone.utc)))
+    campaigns = read_table(spark, keyspace, "raw_campaigns")
+    print(f"raw_events is read in {events.rdd.getNumPartitions()} token-range splits.")
+
+    projections = [p for p in load_projections() if p.name in BUILDERS]
+    # Додаткові аргументи будівників, яким потрібне більше, ніж спільні DataFrame
+    options = {"user_engagement_history": {"start": history_start(watermark.latest_ts)}}
+    failed = []
+    for projection in projections:
+        projection.ensure_table(session)
+        load = VersionedLoad(session, projection.versioned_tables)
+        tables = load.begin()
+        frames = {}
+        try:
+            frames = BUILDERS[projection.name](events, window, campaigns, **options.get(projection.name, {}))
+            for table, df in frames.items():
+                write_table(df, keyspace, tables[table])
+            load.commit()
+            print(f"✅ Projection {projection.name} written.")
+        except Exception as e:
+            print(f"❌ Projection {projection.name} failed: {e}")
+            load.abort()
+            failed.append(projection.name)
+        finally:
+            # Проміжні результати, закешовані будівником (ранг користувачів), звільняються після запису всіх таблиць
+            for df in frames.values():
+                df.unpersist()
+
+    events.unpersist()
+    wait_for_drops()
+    if failed:
+        raise RuntimeError(f"Projections failed: {', '.join(failed)}")
+
+
+def main():
+    """
+    Перераховує всі аналітичні таблиці пакетним Spark-завданням.
+    """
+    load_dotenv()
+    keyspace = os.getenv("CASSANDRA_KEYSPACE", "adtech")
+    session = get_db_connection()
+    if not session:
+        print("❌ Failed to connect to Cassandra. Exiting.")
+        return
+
+    spark = create_spark_session()
+    try:
+        ensure_versions_table(session)
+        run_spark_etl(session, spark, keyspace)
+        print("✅ All analytics tables loaded with Spark.")
+    finally:
+        spark.stop()
+        session.shutdown()
+        print("Cassandra connection closed.")
+
+
+if __name__ == "__main__":
+    main()
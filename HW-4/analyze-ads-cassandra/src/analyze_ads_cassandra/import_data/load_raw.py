@@ -5,13 +5,20 @@ load_raw.py
     raw_campaigns, raw_users, raw_events
 """
 import csv
+import multiprocessing as mp
 import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from decimal import Decimal
 from pathlib import Path
 
-from cassandra.query import BatchStatement
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.ingest_metadata import IngestStats, ensure_metadata_table, reset_metadata, write_metadata
+from analyze_ads_cassandra.import_data.shards import ShardState, iter_shard_rows, plan_shards, read_header
+from analyze_ads_cassandra.metrics import REGISTRY, print_summary, stage
 from analyze_ads_cassandra.utils import gdrive_download, get_db_connection
 
 # --- Константи та налаштування ---
@@ -22,6 +29,33 @@ DATA_DIR = PROJECT_ROOT / "data"
 CSV_SEP = os.getenv("CSV_SEPARATOR", ",")
 
 
+# --- Перетворення значень CSV у нативні типи Cassandra (один раз під час завантаження) ---
+def to_date(value: str):
+    return date.fromisoformat(value[:10]) if value else None
+
+
+def to_timestamp(value: str):
+    return datetime.fromisoformat(value) if value else None
+
+
+def to_decimal(value: str):
+    return Decimal(value) if value else None
+
+
+def drop_if_legacy(session, keyspace: str, table_name: str, column: str, expected_type: str) -> None:
+    """
+    Видаляє таблицю, створену попередньою версією схеми (з текстовими датами),
+    щоб її було створено заново з нативними типами.
+    """
+    row = session.execute("""
+        SELECT type FROM system_schema.columns
+        WHERE keyspace_name = %s AND table_name = %s AND column_name = %s
+    """, (keyspace, table_name, column)).one()
+    if row and row.type != expected_type:
+        print(f"Table {table_name} has legacy type {row.type} for {column}. Dropping it...")
+        session.execute(f"DROP TABLE {table_name}")
+
+
 def load_raw_campaigns(session):
     # 1. Download campaigns CSV
     gdrive_campaigns_file_id = os.environ["GDRIVE_CAMPAIGNS_FILE_ID"]
@@ -32,6 +66,7 @@ def load_raw_campaigns(session):
     # 2. Check if table exists, then truncate or create
     keyspace = os.environ.get("CASSANDRA_KEYSPACE", "adtech")
     table_name = "raw_campaigns"
+    drop_if_legacy(session, keyspace, table_name, "campaign_start_date", "date")
 
     table_check = session.execute(f"""
             SELECT table_name FROM system_schema.tables
@@ -48,12 +83,12 @@ def load_raw_campaigns(session):
             campaign_id int PRIMARY KEY,
             advertiser_name text,
             campaign_name text,
-            campaign_start_date text,
-            campaign_end_date text,
+            campaign_start_date date,
+            campaign_end_date date,
             targeting_criteria text,
             adslotsize text,
-            budget float,
-            remainingbudget float
+            budget decimal,
+            remainingbudget decimal
         )
         """
         session.execute(ddl_users)
@@ -69,19 +104,19 @@ def load_raw_campaigns(session):
     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     """)
 
-    with open(campaigns_csv_file, newline="") as fh:
+    with open(campaigns_csv_file, newline="") as fh, BulkWriter(session, label=table_name) as writer:
         rdr = csv.DictReader(fh, delimiter=CSV_SEP)
         for row in rdr:
-            session.execute(stmt, (
+            writer.submit(stmt, (
                 int(row["CampaignID"]),
                 row["AdvertiserName"],
                 row["CampaignName"],
-                row["CampaignStartDate"],
-                row["CampaignEndDate"],
+                to_date(row["CampaignStartDate"]),
+                to_date(row["CampaignEndDate"]),
                 row["TargetingCriteria"],
                 row["AdSlotSize"],
-                float(row["Budget"]),
-                float(row["RemainingBudget"]),
+                to_decimal(row["Budget"]),
+                to_decimal(row["RemainingBudget"]),
             ))
 
 
@@ -95,6 +130,7 @@ def load_raw_users(session):
     # 2. Check if table exists, then truncate or create
     keyspace = os.environ.get("CASSANDRA_KEYSPACE", "adtech")
     table_name = "raw_users"
+    drop_if_legacy(session, keyspace, table_name, "signup_date", "date")
 
     table_check = session.execute(f"""
                SELECT table_name FROM system_schema.tables
@@ -113,7 +149,7 @@ def load_raw_users(session):
             gender text,
             location text,
             interests set<text>,
-            signup_date text
+            signup_date date
         )
         """
         session.execute(ddl_users)
@@ -127,57 +163,185 @@ def load_raw_users(session):
     ) VALUES (?, ?, ?, ?, ?, ?)
     """)
 
-    # Створюємо пакет
-    batch = BatchStatement()
-    batch_size = 100  # Максимальний розмір пакету
-    counter = 0  # Лічильник для відстеження розміру пакету
-
-    with open(users_csv_file, newline="") as fh:
+    # Кожен користувач — окрема партиція, тож пакети не потрібні:
+    # запити виконуються паралельно в межах вікна BulkWriter
+    with open(users_csv_file, newline="") as fh, BulkWriter(session, label=table_name) as writer:
         rdr = csv.DictReader(fh, delimiter=CSV_SEP)
         for row in rdr:
-            # Додаємо запит до пакета
-            batch.add(stmt, (
+            writer.submit(stmt, (
                 int(row["UserID"]),
                 int(row["Age"]),
                 row["Gender"],
                 row["Location"],
                 set(row["Interests"].split(",")),
-                row["SignupDate"],
+                to_date(row["SignupDate"]),
             ))
-            counter += 1
 
-            # Виконуємо пакет, коли він досягає потрібного розміру
-            if counter % batch_size == 0:
-                session.execute(batch)
-                batch.clear()  # Очищуємо пакет для наступної ітерації
-                print(f"Processed {counter} records...")
+    print(f"Total records processed: {writer.completed}")
+
 
-    # Виконуємо залишок пакету, якщо він не порожній
-    if len(batch) > 0:
-        session.execute(batch)
-        print(f"Processed final {len(batch)} records.")
+INSERT_EVENT_CQL = """
+    INSERT INTO raw_events (
+        event_id, advertiser_name, campaign_name,
+        campaign_start_date, campaign_end_date, campaign_targeting_criteria,
+        campaign_targeting_interest, campaign_targeting_country,
+        adslotsize, user_id, device, location,
+        ts, bidamount, adcost, wasclicked,
+        clickts, adrevenue, budget, remainingbudget
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
 
-    print(f"Total records processed: {counter}")
+# Денна компаньйон-таблиця: ті самі колонки, партиція — день події.
+# Інкрементальний ETL читає з неї лише нові дні замість сканування всієї raw_events.
+INSERT_EVENT_BY_DAY_CQL = """
+    INSERT INTO raw_events_by_day (
+        event_date, event_id, advertiser_name, campaign_name,
+        campaign_start_date, campaign_end_date, campaign_targeting_criteria,
+        campaign_targeting_interest, campaign_targeting_country,
+        adslotsize, user_id, device, location,
+        ts, bidamount, adcost, wasclicked,
+        clickts, adrevenue, budget, remainingbudget
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+EVENT_COLUMNS = [
+    "EventID", "AdvertiserName", "CampaignName", "CampaignStartDate", "CampaignEndDate",
+    "CampaignTargetingCriteria", "CampaignTargetingInterest", "CampaignTargetingCountry",
+    "AdSlotSize", "UserID", "Device", "Location", "Timestamp", "BidAmount", "AdCost",
+    "WasClicked", "ClickTimestamp", "AdRevenue", "Budget", "RemainingBudget",
+]
+# Параметри INSERT йдуть у порядку EVENT_COLUMNS
+TS_PARAM = EVENT_COLUMNS.index("Timestamp")
+
+
+def event_row_to_params(row, idx):
+    """Перетворює рядок CSV (список полів) на параметри INSERT для raw_events."""
+    return (
+        uuid.UUID(row[idx["EventID"]]),  # Використовуємо UUID для унікального ідентифікатора події
+        row[idx["AdvertiserName"]],
+        row[idx["CampaignName"]],
+        to_date(row[idx["CampaignStartDate"]]),
+        to_date(row[idx["CampaignEndDate"]]),
+        row[idx["CampaignTargetingCriteria"]],
+        row[idx["CampaignTargetingInterest"]],
+        row[idx["CampaignTargetingCountry"]],
+        row[idx["AdSlotSize"]],
+        int(row[idx["UserID"]]),
+        row[idx["Device"]],
+        row[idx["Location"]],
+        to_timestamp(row[idx["Timestamp"]]),
+        to_decimal(row[idx["BidAmount"]]),
+        to_decimal(row[idx["AdCost"]]),
+        row[idx["WasClicked"]].lower() == "true",
+        to_timestamp(row[idx["ClickTimestamp"]]),
+        to_decimal(row[idx["AdRevenue"]]),
+        to_decimal(row[idx["Budget"]]),
+        to_decimal(row[idx["RemainingBudget"]]),
+    )
+
+
+def _load_events_shard(csv_file: Path, shard_id: int, shard, header):
+    """
+    Виконується в окремому процесі: парсить свій діапазон байтів і записує рядки
+    через власну сесію Cassandra. Prepared statement маршрутизується token-aware
+    політикою драйвера безпосередньо на репліку партиції.
+
+    Повертає кількість записаних рядків, статистику шарду для ingest_metadata
+    і метрики процесу за цей шард.
+    """
+    load_dotenv()
+    REGISTRY.reset()  # процес пулу виконує кілька шардів
+    session = get_db_connection()
+    if not session:
+        raise RuntimeError(f"shard {shard_id}: failed to connect to Cassandra")
+
+    idx = {name: header.index(name) for name in EVENT_COLUMNS}
+    ts_idx = idx["Timestamp"]
+    stats = IngestStats()
+    try:
+        stmt = session.prepare(INSERT_EVENT_CQL)
+        stmt_by_day = session.prepare(INSERT_EVENT_BY_DAY_CQL)
+        with BulkWriter(session, label=f"raw_events shard {shard_id}", metric_label="raw_events") as writer:
+            for row in iter_shard_rows(csv_file, shard, CSV_SEP):
+                if row:
+                    params = event_row_to_params(row, idx)
+                    writer.submit(stmt, params)
+                    # rows=0: копія в raw_events_by_day не рахується як окремий рядок події
+                    writer.submit(stmt_by_day, (params[TS_PARAM].date(),) + params, rows=0)
+                    stats.add(row[ts_idx])
+        if writer.failures:
+            raise RuntimeError(f"shard {shard_id}: {len(writer.failures)} rows failed")
+        return writer.completed, stats.to_dict(), REGISTRY.snapshot()
+    finally:
+        session.cluster.shutdown()
+
+
+RAW_EVENTS_BY_DAY_DDL = """
+CREATE TABLE IF NOT EXISTS raw_events_by_day (
+    event_date date,
+    ts timestamp,
+    event_id uuid,
+    advertiser_name text,
+    campaign_name text,
+    campaign_start_date date,
+    campaign_end_date date,
+    campaign_targeting_criteria text,
+    campaign_targeting_interest text,
+    campaign_targeting_country text,
+    adslotsize text,
+    user_id int,
+    device text,
+    location text,
+    bidamount decimal,
+    adcost decimal,
+    wasclicked boolean,
+    clickts timestamp,
+    adrevenue decimal,
+    budget decimal,
+    remainingbudget decimal,
+    PRIMARY KEY ((event_date), ts, event_id)
+)
+"""
 
 
 def load_raw_events(session):
-    # 1. Download events CSV
-    gdrive_events_file_id = os.environ["GDRIVE_EVENTS_FILE_ID"]
+    """
+    Завантажує events.csv у raw_events (і денну копію raw_events_by_day) паралельно:
+    файл ділиться на діапазони байтів, кожен з яких парситься й записується окремим процесом.
+
+    LOAD_WORKERS — кількість процесів (за замовчуванням — кількість CPU);
+    LOAD_SHARDS — кількість шардів (за замовчуванням — 4 на процес);
+    LOAD_RESUME=true — продовжити попереднє завантаження, пропустивши завершені шарди.
+    """
     events_csv_file = DATA_DIR / "events.csv"
-    print(f"⬇️  Downloading CSV to {events_csv_file} …")
-    gdrive_download(gdrive_events_file_id, events_csv_file)
+    state = ShardState(DATA_DIR / "events.shards.json")
+    resume = os.getenv("LOAD_RESUME", "false").lower() == "true"
+    workers = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 1)))
+    n_shards = int(os.getenv("LOAD_SHARDS", str(workers * 4)))
+
+    # 1. Download events CSV (при відновленні використовуємо вже завантажений файл)
+    if resume and events_csv_file.exists() and state.load(events_csv_file):
+        print(f"🔁 Resuming load of {events_csv_file}: {len(state.data['done'])}/{len(state.shards)} shards done")
+    else:
+        resume = False
+        gdrive_events_file_id = os.environ["GDRIVE_EVENTS_FILE_ID"]
+        print(f"⬇️  Downloading CSV to {events_csv_file} …")
+        gdrive_download(gdrive_events_file_id, events_csv_file)
 
     # 2. Check if table exists, then truncate or create
     keyspace = os.environ.get("CASSANDRA_KEYSPACE", "adtech")
     table_name = "raw_events"
+    drop_if_legacy(session, keyspace, table_name, "ts", "timestamp")
+    drop_if_legacy(session, keyspace, "raw_events_by_day", "ts", "timestamp")
 
     table_check = session.execute(f"""
                    SELECT table_name FROM system_schema.tables
                    WHERE keyspace_name = %s AND table_name = %s
                """, (keyspace, table_name))
     if table_check.one():
-        print(f"Table {table_name} exists. Truncating it...")
-        session.execute(f"TRUNCATE {table_name}")
+        if not resume:
+            print(f"Table {table_name} exists. Truncating it...")
+            session.execute(f"TRUNCATE {table_name}")
     else:
         print(f"Table {table_name} not found. Creating it...")
         ddl_users = f"""
@@ -185,8 +349,8 @@ def load_raw_events(session):
             event_id uuid PRIMARY KEY,
             advertiser_name text,
             campaign_name text,
-            campaign_start_date text,
-            campaign_end_date text,
+            campaign_start_date date,
+            campaign_end_date date,
             campaign_targeting_criteria text,
             campaign_targeting_interest text,
             campaign_targeting_country text,
@@ -194,77 +358,62 @@ def load_raw_events(session):
             user_id int,
             device text,
             location text,
-            ts text,
-            bidamount float,
-            adcost float,
+            ts timestamp,
+            bidamount decimal,
+            adcost decimal,
             wasclicked boolean,
-            clickts text,
-            adrevenue float,
-            budget float,
-            remainingbudget float
+            clickts timestamp,
+            adrevenue decimal,
+            budget decimal,
+            remainingbudget decimal
         )
         """
         session.execute(ddl_users)
 
-    print("Table raw_events ensured, now inserting data...")
+    session.execute(RAW_EVENTS_BY_DAY_DDL)
+    ensure_metadata_table(session)
+    if not resume:
+        session.execute("TRUNCATE raw_events_by_day")
+        reset_metadata(session, table_name)
 
-    # 3. Load events CSV into raw_events table
-    stmt = session.prepare("""
-        INSERT INTO raw_events (
-            event_id, advertiser_name, campaign_name,
-            campaign_start_date, campaign_end_date, campaign_targeting_criteria,
-            campaign_targeting_interest, campaign_targeting_country,
-            adslotsize, user_id, device, location,
-            ts, bidamount, adcost, wasclicked,
-            clickts, adrevenue, budget, remainingbudget
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-    """)
-
-    # Створюємо пакет
-    batch = BatchStatement()
-    batch_size = 50  # Максимальний розмір пакету
-    counter = 0  # Лічильник для відстеження розміру пакету
-
-    with open(events_csv_file, newline="") as fh:
-        rdr = csv.DictReader(fh, delimiter=CSV_SEP)
-        for r in rdr:
-            # Додаємо запит до пакета
-            batch.add(stmt, (
-                uuid.UUID(r["EventID"]),  # Використовуємо UUID для унікального ідентифікатора події
-                r["AdvertiserName"],
-                r["CampaignName"],
-                r["CampaignStartDate"],
-                r["CampaignEndDate"],
-                r["CampaignTargetingCriteria"],
-                r["CampaignTargetingInterest"],
-                r["CampaignTargetingCountry"],
-                r["AdSlotSize"],
-                int(r["UserID"]),
-                r["Device"],
-                r["Location"],
-                r["Timestamp"],
-                float(r["BidAmount"]),
-                float(r["AdCost"]),
-                r["WasClicked"].lower() == "true",
-                r["ClickTimestamp"] or None,
-                float(r["AdRevenue"]),
-                float(r["Budget"]),
-                float(r["RemainingBudget"]),
-            ))
-            counter += 1
-
-            # Виконуємо пакет, коли він наповниться
-            if counter % batch_size == 0:
-                session.execute(batch)
-                batch.clear()  # Очищуємо пакет для наступної ітерації
-                print(f"Processed {counter} event records...")
-
-    # Виконуємо залишок пакету, якщо він не порожній
-    if len(batch) > 0:
-        session.execute(batch)
-        print(f"Processed final {len(batch)} records.")
+    print("Table raw_events ensured, now inserting data...")
 
-    print(f"Total records processed: {counter}")
+    # 3. Load events CSV into raw_events table, shard by shard
+    if not resume:
+        state.start(events_csv_file, plan_shards(events_csv_file, n_shards))
+    header = read_header(events_csv_file, CSV_SEP)
+    pending = [(i, shard) for i, shard in enumerate(state.shards) if not state.is_done(i)]
+    print(f"Loading {len(pending)} shards with {workers} worker processes ...")
+
+    failed = []
+    total = state.done_rows
+    stats = IngestStats()
+    for shard_stats in state.done_stats:
+        stats.merge(IngestStats.from_dict(shard_stats))
+    # spawn: дочірні процеси не успадковують потоки драйвера батьківської сесії
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        futures = {pool.submit(_load_events_shard, events_csv_file, i, shard, header): i for i, shard in pending}
+        for future in as_completed(futures):
+            shard_id = futures[future]
+            try:
+                rows, shard_stats, shard_metrics = future.result()
+            except Exception as e:
+                failed.append(shard_id)
+                print(f"❌ Shard {shard_id} failed: {e}")
+                continue
+            REGISTRY.merge(shard_metrics)
+            state.mark_done(shard_id, rows, shard_stats)
+            total += rows
+            # Метадані оновлюються після кожного шарду: ETL бачить актуальний watermark
+            stats.merge(IngestStats.from_dict(shard_stats))
+            write_metadata(session, table_name, stats)
+            print(f"✅ Shard {shard_id} done: {rows} rows "
+                  f"({len(state.data['done'])}/{len(state.shards)} shards, {total} rows total)")
+
+    if failed:
+        print(f"⚠️  Shards {sorted(failed)} failed. Re-run with LOAD_RESUME=true to retry only them.")
+    print(f"Total records processed: {total}; latest event: {stats.latest_ts}, "
+          f"{len(stats.day_rows)} days recorded in ingest_metadata")
 
 
 def main():
@@ -276,8 +425,10 @@ def main():
     print("Starting RAW ingest ...")
     # load_raw_campaigns(session)
     # load_raw_users(session)
-    load_raw_events(session)
+    with stage("import:raw_events"):
+        load_raw_events(session)
     print("RAW ingest finished 👍")
+    print_summary()
     session.shutdown()
 
 
@@ -5,18 +5,27 @@ ETL із raw_* → денормалізовані проекції під ана
 Запускати ad-hoc або по крону/airflow після надходження «сирих» подій.
 """
 
-import decimal
 import os
-from collections import defaultdict
-from datetime import datetime
+from datetime import timedelta
+from functools import partial
 
-from cassandra.query import SimpleStatement, ConsistencyLevel, BatchStatement
+import numpy as np
 from cassandra.util import uuid_from_time
 from dotenv import load_dotenv
 
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.columnar import (day_to_date, group_sums, money_units_to_decimal, page_columns, to_bool,
+                                            to_datetime64, to_days, to_money_units)
+from analyze_ads_cassandra.etl_scripts.load_analytics_incremental import (CHECKPOINTS_DDL, COUNTERS_REBUILD_JOB,
+                                                                          reset_checkpoint)
+from analyze_ads_cassandra.ingest_metadata import read_watermark
+from analyze_ads_cassandra.leaderboard import TopK
+from analyze_ads_cassandra.metrics import print_summary, stage
+from analyze_ads_cassandra.scanner import Accumulator, column_positions, parallel_scan
+from analyze_ads_cassandra.spill import SpillingAggregator, memory_limit_entries
+from analyze_ads_cassandra.user_history import HISTORY_TTL_DAYS, month_bucket
 from analyze_ads_cassandra.utils import get_db_connection
 
-
 # --- Ініціалізація таблиць у Cassandra ---
 def init_cassandra_tables(session, keyspace_name: str):
     print(f"🔗 Initializing Cassandra tables in keyspace '{keyspace_name}' ...")
@@ -48,15 +57,18 @@ def init_cassandra_tables(session, keyspace_name: str):
             PRIMARY KEY (event_date, click_count, user_id)
         ) WITH CLUSTERING ORDER BY (click_count DESC);
         """,
-        "user_engagement": """
+        # Місячні партиції (user_id, month) з TTL, як у user_engagement_history
+        "user_engagement": f"""
         CREATE TABLE AdTech.user_engagement(
             user_id           int,
+            month             date,
             event_timestamp   timeuuid,
             campaign_name     text,
             advertiser_name   text,
             was_clicked       boolean,
-            PRIMARY KEY (user_id, event_timestamp)
-        ) WITH CLUSTERING ORDER BY (event_timestamp DESC);
+            PRIMARY KEY ((user_id, month), event_timestamp)
+        ) WITH CLUSTERING ORDER BY (event_timestamp DESC)
+          AND default_time_to_live = {HISTORY_TTL_DAYS * 24 * 3600};
         """,
         "advertiser_spend_by_region": """
         CREATE TABLE AdTech.advertiser_spend_by_region(
@@ -88,21 +100,82 @@ def init_cassandra_tables(session, keyspace_name: str):
     print("✅  All tables initialized or truncated successfully.")
 
 
+class MigrationAggregates(Accumulator):
+    """
+    Часткові агрегати одного піддіапазону токенів raw_events.
+    Рядки user_engagement записуються одразу під час сканування через спільний
+    BulkWriter: коли його вікно заповнене, сканування чекає.
+    Кожен агрегат обмежений `max_entries` ключами в пам'яті й вивантажується на диск.
+    """
+
+    def __init__(self, engagement_writer: BulkWriter, ins_user_eng, columns, max_entries: int):
+        self.engagement_writer = engagement_writer
+        self.ins_user_eng = ins_user_eng
+        self.positions = column_positions(columns, "ts", "adcost", "wasclicked", "user_id",
+                                          "campaign_name", "advertiser_name", "location")
+        self.camp_perf = SpillingAggregator("camp_perf", max_entries)              # (impressions, clicks)
+        self.user_day_clicks = SpillingAggregator("user_day_clicks", max_entries)  # (clicks,)
+        self.adv_reg_spend = SpillingAggregator("adv_reg_spend", max_entries)      # (одиниці 1e-4,)
+        self.adv_day_spend = SpillingAggregator("adv_day_spend", max_entries)      # (одиниці 1e-4,)
+
+    @property
+    def aggregators(self):
+        return [self.camp_perf, self.user_day_clicks, self.adv_reg_spend, self.adv_day_spend]
+
+    def add(self, ev) -> None:
+        self.add_page([ev])
+
+    def add_page(self, rows) -> None:
+        # 1) базові поля: ts (datetime) і adcost (Decimal) вже десеріалізовані драйвером
+        ts_i, cost_i, clicked_i, user_i, campaign_i, advertiser_i, location_i = self.positions
+
+        # -------- 1. user_engagement (insert on every event) --------
+        for ev in rows:
+            self.engagement_writer.submit(self.ins_user_eng, (
+                ev[user_i], month_bucket(ev[ts_i]), uuid_from_time(ev[ts_i]), ev[campaign_i],
+                ev[advertiser_i], bool(ev[clicked_i])
+            ))
+
+        # Колонкова агрегація сторінки: дні як int64, витрати — int64 в одиницях 1e-4
+        columns = page_columns(rows)
+        days = to_days(to_datetime64(columns[ts_i]))
+        clicks = to_bool(columns[clicked_i])
+        spend = to_money_units(columns[cost_i])
+        ones = np.ones(len(rows), dtype=np.int64)
+        campaigns, users, advertisers = columns[campaign_i], columns[user_i], columns[advertiser_i]
+
+        # -------- 2. aggregate for campaign_performance_by_day --------
+        for (camp_name, day), sums in group_sums([campaigns, days], [ones, clicks.astype(np.int64)]).items():
+            self.camp_perf.add((camp_name, day_to_date(day)), sums)
+
+        # -------- 3. aggregate for top_users_by_clicks --------
+        for (day, uid), sums in group_sums([days, users], [ones], clicks).items():
+            self.user_day_clicks.add((day_to_date(day), uid), sums)
+
+        # -------- 4. aggregate for advertiser_spend_by_region --------
+        for (region, day, adv_name), sums in group_sums([columns[location_i], days, advertisers], [spend]).items():
+            self.adv_reg_spend.add((region, day_to_date(day), adv_name), sums)
+
+        # -------- 5. aggregate for top_advertisers_by_spend --------
+        for (day, adv_name), sums in group_sums([days, advertisers], [spend]).items():
+            self.adv_day_spend.add((day_to_date(day), adv_name), sums)
+
+    def merge(self, other: "MigrationAggregates") -> "MigrationAggregates":
+        for mine, theirs in zip(self.aggregators, other.aggregators):
+            mine.merge(theirs)
+        return self
+
+
 def run_migration(session):
     print("🔄 Starting migration from raw_events to denormalized projections ...")
-    select_raw = SimpleStatement(
-        "SELECT event_id, advertiser_name, campaign_name, adslotsize, "
-        "       user_id, device, location, ts, adcost, wasclicked "
-        "FROM   raw_events",
-        fetch_size=10_000,
-        consistency_level=ConsistencyLevel.ONE
-    )
+    raw_columns = ["event_id", "advertiser_name", "campaign_name", "adslotsize",
+                   "user_id", "device", "location", "ts", "adcost", "wasclicked"]
 
     # ---------- prepared statements ----------
     ins_user_eng = session.prepare("""
-        INSERT INTO user_engagement (user_id, event_timestamp, 
+        INSERT INTO user_engagement (user_id, month, event_timestamp,
         campaign_name, advertiser_name, was_clicked)
-        VALUES (?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?)
     """)
 
     upd_campaign_perf = session.prepare("""
@@ -128,87 +201,100 @@ def run_migration(session):
         VALUES (?, ?, ?)
     """)
 
-    # ---------- in-memory accumulators ----------
-    camp_perf = defaultdict(lambda: [0, 0])
-    user_day_clicks = defaultdict(int)
-    adv_reg_spend = defaultdict(decimal.Decimal)
-    adv_day_spend = defaultdict(decimal.Decimal)
-    user_engagement_rows = []
+    # ---------- memory-bounded accumulators ----------
+    # Бюджет ділиться між 4 агрегатами кожного одночасно активного піддіапазону
+    # та підсумковим акумулятором, у який зливаються завершені піддіапазони
+    memory_mb = int(os.getenv("MIGRATION_MEMORY_MB", "256"))
+    workers = int(os.getenv("SCAN_WORKERS", "8"))
+    max_entries = memory_limit_entries(memory_mb, 4 * (workers + 1))
+    print(f"Aggregation memory budget: {memory_mb} MiB ({max_entries} keys per aggregate before spilling)")
 
     # ---------------------------------------------------------------------------
     print("⏳  Scanning raw_events …")
-    for ev in session.execute(select_raw):
-        # 1) базові поля
-        ts_dt = datetime.fromisoformat(ev.ts)
-        ev_date = ts_dt.date()
-
-        spend = decimal.Decimal(str(ev.adcost or 0.0))
-        is_click = bool(ev.wasclicked)
-
-        # -------- 1. user_engagement (insert on every event) --------
-        timeuuid = uuid_from_time(ts_dt)
-        session.execute_async(ins_user_eng, (
-            ev.user_id, timeuuid, ev.campaign_name,
-            ev.advertiser_name, is_click
-        ))
-
-        # -------- 2. aggregate for campaign_performance_by_day --------
-        impr_click = camp_perf[(ev.campaign_name, ev_date)]
-        impr_click[0] += 1
-        if is_click:
-            impr_click[1] += 1
-
-        # -------- 3. aggregate for top_users_by_clicks --------
-        if is_click:
-            user_day_clicks[(ev_date, ev.user_id)] += 1
-
-        # -------- 4. aggregate for advertiser_spend_by_region --------
-        adv_reg_spend[(ev.location, ev_date, ev.advertiser_name)] += spend
-
-        # -------- 5. aggregate for top_advertisers_by_spend --------
-        adv_day_spend[(ev_date, ev.advertiser_name)] += spend
+    engagement_writer = BulkWriter(session, label="user_engagement")
+    with stage("scan"):
+        aggregates = parallel_scan(
+            session, "raw_events", raw_columns,
+            partial(MigrationAggregates, engagement_writer, ins_user_eng, raw_columns, max_entries),
+            workers=workers, fetch_size=10_000, mode="thread",
+        )
+        engagement_writer.flush()
+    for aggregator in aggregates.aggregators:
+        print(aggregator.report())
+    camp_perf = aggregates.camp_perf
+    user_day_clicks = aggregates.user_day_clicks
+    adv_reg_spend = aggregates.adv_reg_spend
+    adv_day_spend = aggregates.adv_day_spend
 
     print("✅  Raw scan finished, writing aggregates …")
 
     # ------------------- phase A: counters --------------------------
-    for (camp_name, ev_date), (impr, clk) in camp_perf.items():
-        session.execute_async(upd_campaign_perf, (impr, clk, camp_name, ev_date))
+    # Інкременти лічильників не ідемпотентні, тому без автоматичних повторів:
+    # невдалі оновлення лише фіксуються у звіті.
+    # Пишуться лише закриті дні (як в load_analytics_incremental), а межа записується
+    # в etl_checkpoints: інкрементальний ETL не додасть ці дні вдруге, а поточний
+    # день обробить, коли той закриється.
+    watermark = read_watermark(session)
+    closed_until = watermark.latest_ts.date() - timedelta(days=1) if watermark else None
+    counter_writer = BulkWriter(session, label="campaign_performance_by_day", max_retries=0)
+    skipped_days, last_day = set(), None
+    with stage("write:counters"):
+        for (camp_name, ev_date), (impr, clk) in camp_perf.items():
+            if closed_until is not None and ev_date > closed_until:
+                skipped_days.add(ev_date)
+                continue
+            counter_writer.submit(upd_campaign_perf, (impr, clk, camp_name, ev_date))
+            last_day = max(last_day, ev_date) if last_day else ev_date
+        counter_writer.flush()
+    session.execute(CHECKPOINTS_DDL)
+    rebuilt_until = closed_until or last_day
+    if rebuilt_until:
+        reset_checkpoint(session, rebuilt_until, counter_writer.completed, COUNTERS_REBUILD_JOB)
+        print(f"campaign_performance_by_day loaded up to {rebuilt_until}"
+              + (f"; open days left to the incremental ETL: {sorted(skipped_days)}" if skipped_days else ""))
 
     # ------------------- phase B: leaderboard tables ---------------
-    batch_size = 100
-    batch = BatchStatement(consistency_level=ConsistencyLevel.ONE)
-
-    def flush_batch():
-        nonlocal batch
-        if len(batch) > 0:
-            session.execute(batch)
-            batch = BatchStatement(consistency_level=ConsistencyLevel.ONE)
-
-    # --- top_users_by_clicks ---
-    for (ev_date, uid), clicks in user_day_clicks.items():
-        batch.add(ins_user_clicks, (ev_date, clicks, uid))
-        if len(batch) >= batch_size:
-            flush_batch()
-    flush_batch()
-
-    # --- advertiser_spend_by_region ---
-    for (region, ev_date, adv_name), spend in adv_reg_spend.items():
-        batch.add(ins_adv_reg, (
-            region, ev_date, spend, adv_name
-        ))
-        if len(batch) >= batch_size:
-            flush_batch()
-    flush_batch()
-
-    # --- top_advertisers_by_spend ---
-    for (ev_date, adv_name), spend in adv_day_spend.items():
-        batch.add(ins_adv_day, (
-            ev_date, spend, adv_name
-        ))
-        if len(batch) >= batch_size:
-            flush_batch()
-    flush_batch()
-
+    # Підсумки читаються потоком; у пам'яті лишаються тільки top-K рядків кожної партиції.
+    # Пакети UNLOGGED лише в межах однієї партиції (event_date або (region, event_date))
+    with stage("write:leaderboards"):
+        top_users = TopK()
+        for (ev_date, uid), (clicks,) in user_day_clicks.items():
+            top_users.add(ev_date, clicks, uid)
+        user_clicks_writer = BulkWriter(session, label="top_users_by_clicks")
+        for ev_date, leaders in top_users.items():
+            user_clicks_writer.submit_partition(ins_user_clicks, [(ev_date, clicks, uid) for clicks, uid in leaders])
+
+        top_adv_region = TopK()
+        for (region, ev_date, adv_name), (spend,) in adv_reg_spend.items():
+            top_adv_region.add((region, ev_date), spend, adv_name)
+        adv_reg_writer = BulkWriter(session, label="advertiser_spend_by_region")
+        for (region, ev_date), leaders in top_adv_region.items():
+            adv_reg_writer.submit_partition(ins_adv_reg, [(region, ev_date, money_units_to_decimal(spend), adv_name)
+                                                          for spend, adv_name in leaders])
+
+        top_adv_day = TopK()
+        for (ev_date, adv_name), (spend,) in adv_day_spend.items():
+            top_adv_day.add(ev_date, spend, adv_name)
+        adv_day_writer = BulkWriter(session, label="top_advertisers_by_spend")
+        for ev_date, leaders in top_adv_day.items():
+            adv_day_writer.submit_partition(ins_adv_day, [(ev_date, money_units_to_decimal(spend), adv_name)
+                                                          for spend, adv_name in leaders])
+    print(f"Leaderboards: top {top_users.k} rows per partition "
+          f"({len(top_users)} user, {len(top_adv_region)} region, {len(top_adv_day)} advertiser rows).")
+
+    # ------------------- summary and retry of failed writes ---------------
+    idempotent_writers = [engagement_writer, user_clicks_writer, adv_reg_writer, adv_day_writer]
+    for writer in idempotent_writers:
+        if writer.failures:
+            print(f"🔁 [{writer.label}] retrying {len(writer.failures)} failed writes ...")
+            writer.retry_failures()
+    with stage("write:flush"):
+        for writer in idempotent_writers + [counter_writer]:
+            writer.close()
+
+    failed = {w.label: len(w.failures) for w in idempotent_writers + [counter_writer] if w.failures}
+    if failed:
+        print(f"⚠️  Some writes failed permanently: {failed}")
     print("🎉  Migration completed!")
 
 
@@ -224,6 +310,7 @@ def main():
         init_cassandra_tables(session, keyspace)
         # Execute migration.
         run_migration(session)
+        print_summary()
     finally:
         session.shutdown()
 
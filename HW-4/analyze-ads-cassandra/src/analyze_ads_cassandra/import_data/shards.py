@@ -0,0 +1,116 @@
+"""
+shards.py
+~~~~~~~~~
+Розбиття великого CSV на діапазони байтів (shards) для паралельного парсингу
+в пулі процесів, а також збереження стану для відновлення невдалих шардів.
+"""
+import csv
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+Shard = Tuple[int, int]
+
+
+def plan_shards(csv_file: Path, n_shards: int) -> List[Shard]:
+    """
+    Ділить файл (без рядка заголовка) на `n_shards` діапазонів `[start, end)`,
+    межі яких вирівняні по початку рядка.
+    """
+    size = csv_file.stat().st_size
+    with open(csv_file, "rb") as fh:
+        fh.readline()  # заголовок
+        data_start = fh.tell()
+        step = max((size - data_start) // max(n_shards, 1), 1)
+
+        bounds = [data_start]
+        for i in range(1, n_shards):
+            fh.seek(data_start + i * step)
+            fh.readline()  # дочитуємо до кінця поточного рядка
+            pos = fh.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+        bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i + 1]]
+
+
+def read_header(csv_file: Path, sep: str) -> List[str]:
+    with open(csv_file, newline="", encoding="utf-8") as fh:
+        return next(csv.reader(fh, delimiter=sep))
+
+
+def iter_shard_rows(csv_file: Path, shard: Shard, sep: str) -> Iterator[List[str]]:
+    """Повертає рядки CSV (списки полів) одного шарду."""
+    start, end = shard
+
+    def lines():
+        with open(csv_file, "rb") as fh:
+            fh.seek(start)
+            while fh.tell() < end:
+                line = fh.readline()
+                if not line:
+                    break
+                yield line.decode("utf-8")
+
+    yield from csv.reader(lines(), delimiter=sep)
+
+
+class ShardState:
+    """
+    Стан шардованого завантаження у JSON-файлі поряд із CSV.
+
+    Стан вважається дійсним лише для того самого файлу (розмір і час модифікації)
+    і того самого плану шардів.
+    """
+
+    def __init__(self, state_file: Path):
+        self.state_file = state_file
+        self.data: Dict = {}
+
+    @staticmethod
+    def _fingerprint(csv_file: Path) -> Dict:
+        st = csv_file.stat()
+        return {"file": str(csv_file), "size": st.st_size, "mtime": int(st.st_mtime)}
+
+    def load(self, csv_file: Path) -> Optional[Dict]:
+        if not self.state_file.exists():
+            return None
+        data = json.loads(self.state_file.read_text())
+        fingerprint = self._fingerprint(csv_file)
+        if any(data.get(k) != v for k, v in fingerprint.items()):
+            print(f"⚠️  {self.state_file.name} belongs to a different file, ignoring it.")
+            return None
+        self.data = data
+        return data
+
+    def start(self, csv_file: Path, shards: List[Shard]) -> None:
+        self.data = {**self._fingerprint(csv_file), "shards": [list(s) for s in shards], "done": {}}
+        self._save()
+
+    @property
+    def shards(self) -> List[Shard]:
+        return [tuple(s) for s in self.data.get("shards", [])]
+
+    def is_done(self, shard_id: int) -> bool:
+        return str(shard_id) in self.data.get("done", {})
+
+    def mark_done(self, shard_id: int, rows: int, stats: Optional[Dict] = None) -> None:
+        """Позначає шард завершеним; `stats` — довільна JSON-статистика шарду."""
+        self.data.setdefault("done", {})[str(shard_id)] = {"rows": rows, "stats": stats}
+        self._save()
+
+    @property
+    def done_rows(self) -> int:
+        return sum(entry["rows"] for entry in self.data.get("done", {}).values())
+
+    @property
+    def done_stats(self) -> List[Dict]:
+        return [entry["stats"] for entry in self.data.get("done", {}).values() if entry.get("stats")]
+
+    def _save(self) -> None:
+        tmp = self.state_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.data, indent=2))
+        os.replace(tmp, self.state_file)
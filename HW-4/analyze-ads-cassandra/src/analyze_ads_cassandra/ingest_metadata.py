@@ -0,0 +1,117 @@
+"""
+ingest_metadata.py
+~~~~~~~~~~~~~~~~~~
+Метадані завантаження «сирих» таблиць: остання мітка часу події, загальна
+кількість рядків і кількість рядків за кожен день.
+
+Таблицю `ingest_metadata` підтримує `load_raw` під час завантаження, а ETL-скрипти
+читають з неї межі часового вікна одним запитом замість повного сканування.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+
+TABLE_NAME = "ingest_metadata"
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    table_name  text,
+    event_date  date,
+    latest_ts   timestamp static,
+    total_rows  bigint static,
+    updated_at  timestamp static,
+    day_rows    bigint,
+    PRIMARY KEY (table_name, event_date)
+) WITH CLUSTERING ORDER BY (event_date DESC)
+"""
+
+
+@dataclass
+class IngestStats:
+    """
+    Статистика завантажених рядків. Мітки часу мають формат ISO
+    ("YYYY-MM-DD HH:MM:SS"), тож максимум і дата визначаються без парсингу.
+    """
+    latest_ts: Optional[str] = None
+    total_rows: int = 0
+    day_rows: Counter = field(default_factory=Counter)
+
+    def add(self, ts: str) -> None:
+        self.total_rows += 1
+        self.day_rows[ts[:10]] += 1
+        if self.latest_ts is None or ts > self.latest_ts:
+            self.latest_ts = ts
+
+    def merge(self, other: "IngestStats") -> "IngestStats":
+        self.total_rows += other.total_rows
+        self.day_rows.update(other.day_rows)
+        if other.latest_ts is not None and (self.latest_ts is None or other.latest_ts > self.latest_ts):
+            self.latest_ts = other.latest_ts
+        return self
+
+    def to_dict(self) -> Dict:
+        return {"latest_ts": self.latest_ts, "total_rows": self.total_rows, "day_rows": dict(self.day_rows)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "IngestStats":
+        return cls(data.get("latest_ts"), data.get("total_rows", 0), Counter(data.get("day_rows", {})))
+
+
+@dataclass
+class Watermark:
+    latest_ts: datetime
+    total_rows: int
+    updated_at: Optional[datetime] = None
+
+
+def ensure_metadata_table(session) -> None:
+    session.execute(DDL)
+
+
+def reset_metadata(session, table_name: str) -> None:
+    session.execute(f"DELETE FROM {TABLE_NAME} WHERE table_name = %s", (table_name,))
+
+
+def write_metadata(session, table_name: str, stats: IngestStats) -> None:
+    """Записує поточну статистику (статичні колонки + рядок на кожен день)."""
+    if stats.latest_ts is None:
+        return
+    session.execute(
+        f"INSERT INTO {TABLE_NAME} (table_name, latest_ts, total_rows, updated_at) VALUES (%s, %s, %s, %s)",
+        (table_name, datetime.fromisoformat(stats.latest_ts), stats.total_rows, datetime.utcnow()),
+    )
+    stmt = session.prepare(f"INSERT INTO {TABLE_NAME} (table_name, event_date, day_rows) VALUES (?, ?, ?)")
+    with BulkWriter(session, label=TABLE_NAME, report_every=60) as writer:
+        writer.submit_partition(stmt, [(table_name, date.fromisoformat(day), rows)
+                                       for day, rows in sorted(stats.day_rows.items())])
+
+
+def read_watermark(session, table_name: str = "raw_events") -> Optional[Watermark]:
+    """Повертає останню мітку часу та кількість рядків або None, якщо метаданих немає."""
+    row = session.execute(
+        f"SELECT latest_ts, total_rows, updated_at FROM {TABLE_NAME} WHERE table_name = %s LIMIT 1",
+        (table_name,),
+    ).one()
+    if row is None or row.latest_ts is None:
+        return None
+    return Watermark(row.latest_ts, row.total_rows or 0, row.updated_at)
+
+
+def read_day_counts(session, table_name: str = "raw_events") -> Dict[date, int]:
+    """Кількість рядків за кожен день (від найновішого до найстарішого)."""
+    rows = session.execute(
+        f"SELECT event_date, day_rows FROM {TABLE_NAME} WHERE table_name = %s", (table_name,)
+    )
+    counts: Dict[date, int] = {}
+    for row in rows:
+        if row.event_date is not None:
+            counts[row.event_date.date()] = row.day_rows or 0
+    return counts
+
+
+def days_between(counts: Dict[date, int], start: Optional[date], end: Optional[date]) -> List[date]:
+    """Дні з даними у проміжку (start, end], відсортовані за зростанням."""
+    return sorted(d for d in counts if (start is None or d > start) and (end is None or d <= end))
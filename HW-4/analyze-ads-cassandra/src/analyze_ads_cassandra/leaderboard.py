@@ -0,0 +1,139 @@
+"""
+leaderboard.py
+~~~~~~~~~~~~~~
+Таблиці-лідерборди: лише top-K рядків на партицію замість рядка на кожного
+користувача чи рекламодавця.
+
+`TopK` під час проходу по фінальних агрегатах тримає для кожної партиції
+мін-купу розміру K, тож пам'ять — O(K × кількість партицій), а запис — K рядків
+на партицію. Повне ранжування користувачів зберігається окремо в компактних
+таблицях `user_click_rank` (ранг за user_id) і `user_click_rank_pages`
+(сторінки рангу), з яких читається «місце користувача X» і його сусіди.
+Читання йде з активних версій таблиць (див. versioning.py).
+"""
+import heapq
+import itertools
+import os
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from analyze_ads_cassandra.bulk_writer import BulkWriter
+from analyze_ads_cassandra.utils import prepare_cached
+from analyze_ads_cassandra.versioning import active_table
+
+# LEADERBOARD_TOP_K=0 вимикає обмеження (записуються всі рядки)
+DEFAULT_TOP_K = int(os.getenv("LEADERBOARD_TOP_K", "100"))
+RANK_PAGE_SIZE = int(os.getenv("LEADERBOARD_RANK_PAGE_SIZE", "100"))
+
+# DDL-шаблони: `{table}` — логічна назва або фізична таблиця версії
+RANK_TABLES_DDL = {
+    "user_click_rank": """
+    CREATE TABLE IF NOT EXISTS {table} (
+        time_bucket  text,
+        user_id      int,
+        rank         int,
+        total_clicks int,
+        PRIMARY KEY ((time_bucket, user_id))
+    )
+    """,
+    "user_click_rank_pages": """
+    CREATE TABLE IF NOT EXISTS {table} (
+        time_bucket  text,
+        page         int,
+        rank         int,
+        user_id      int,
+        total_clicks int,
+        PRIMARY KEY ((time_bucket, page), rank)
+    ) WITH CLUSTERING ORDER BY (rank ASC)
+    """,
+}
+
+
+class TopK:
+    """Top-K елементів за спаданням `score` для кожної партиції."""
+
+    def __init__(self, k: int = DEFAULT_TOP_K):
+        self.k = k
+        self.heaps: Dict[Hashable, list] = defaultdict(list)
+        self._seq = itertools.count()  # розв'язує нічиї без порівняння самих елементів
+
+    def add(self, partition: Hashable, score, item) -> None:
+        heap = self.heaps[partition]
+        entry = (score, next(self._seq), item)
+        if self.k <= 0 or len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def items(self) -> Iterable[Tuple[Hashable, List[Tuple[object, object]]]]:
+        """(партиція, [(score, item), ...] за спаданням score)."""
+        for partition, heap in self.heaps.items():
+            yield partition, [(score, item) for score, _, item in sorted(heap, reverse=True)]
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self.heaps.values())
+
+
+def top_k(scores: Dict[Hashable, object], k: int = DEFAULT_TOP_K) -> List[Tuple[object, Hashable]]:
+    """Top-K пар (score, ключ) однієї партиції."""
+    leaders = TopK(k)
+    for key, score in scores.items():
+        leaders.add(None, score, key)
+    return next(iter(leaders.items()), (None, []))[1]
+
+
+# --- Ранги користувачів ---
+def write_user_ranks(session, time_bucket: str, clicks_by_user: Dict[int, int],
+                     rank_table: str = "user_click_rank", pages_table: str = "user_click_rank_pages",
+                     page_size: int = RANK_PAGE_SIZE) -> None:
+    """
+    Записує повне ранжування (кліки за спаданням, при рівності — менший user_id вище).
+    Ранг — позиція в цьому порядку, починаючи з 1.
+    """
+    ranked = sorted(clicks_by_user.items(), key=lambda item: (-item[1], item[0]))
+    rank_stmt = session.prepare(
+        f"INSERT INTO {rank_table} (time_bucket, user_id, rank, total_clicks) VALUES (?, ?, ?, ?)")
+    page_stmt = session.prepare(
+        f"INSERT INTO {pages_table} (time_bucket, page, rank, user_id, total_clicks) VALUES (?, ?, ?, ?, ?)")
+
+    with BulkWriter(session, label=rank_table, metric_label="user_click_rank") as writer:
+        for rank, (user_id, clicks) in enumerate(ranked, start=1):
+            writer.submit(rank_stmt, (time_bucket, user_id, rank, clicks))
+        # Сторінка — одна партиція, тож пишемо її пакетом UNLOGGED
+        for start in range(0, len(ranked), page_size):
+            page = start // page_size
+            writer.submit_partition(page_stmt, [
+                (time_bucket, page, start + i + 1, user_id, clicks)
+                for i, (user_id, clicks) in enumerate(ranked[start:start + page_size])
+            ])
+
+
+def get_rank_page(session, time_bucket: str, page: int) -> List[dict]:
+    """Одна сторінка рангу: [{rank, user_id, total_clicks}, ...]."""
+    table = active_table(session, "user_click_rank_pages")
+    stmt = prepare_cached(session, f"SELECT rank, user_id, total_clicks FROM {table} WHERE time_bucket = ? AND page = ?",
+                          idempotent=True)
+    rows = session.execute(stmt, (time_bucket, page))
+    return [{"rank": r.rank, "user_id": r.user_id, "total_clicks": r.total_clicks} for r in rows]
+
+
+def get_user_rank(session, time_bucket: str, user_id: int,
+                  page_size: int = RANK_PAGE_SIZE) -> Optional[dict]:
+    """
+    Місце користувача: ранг, кількість кліків і сторінка рангу, на якій він знаходиться
+    (для показу сусідів). None, якщо користувач не має кліків у цьому бакеті.
+    """
+    table = active_table(session, "user_click_rank")
+    stmt = prepare_cached(session, f"SELECT rank, total_clicks FROM {table} WHERE time_bucket = ? AND user_id = ?",
+                          idempotent=True)
+    row = session.execute(stmt, (time_bucket, user_id)).one()
+    if row is None:
+        return None
+    page = (row.rank - 1) // page_size
+    return {
+        "user_id": user_id,
+        "rank": row.rank,
+        "total_clicks": row.total_clicks,
+        "page": page,
+        "neighbours": get_rank_page(session, time_bucket, page),
+    }
@@ -0,0 +1,153 @@
+import json
+import os
+
+from cassandra import DriverException
+from dotenv import load_dotenv
+from rich.console import Console
+from rich.prompt import IntPrompt, Prompt
+from rich.table import Table
+
+from analyze_ads_cassandra.queries import AdsQueries, LeaderboardCache, benchmark
+from analyze_ads_cassandra.utils import get_db_connection, save_results
+
+load_dotenv()
+console = Console()
+
+
+def print_rows(rows: list, title: str) -> None:
+    if not rows:
+        console.print("[yellow]Немає даних.[/yellow]")
+        return
+    table = Table(title=title)
+    for column in rows[0]:
+        table.add_column(column)
+    for row in rows:
+        table.add_row(*(str(v) for v in row.values()))
+    console.print(table)
+
+
+def ask_to_save(rows: list, choice: str) -> None:
+    if not rows:
+        return
+    save_choice = Prompt.ask("\nЗберегти результати у файл?", choices=["y", "n"], default="n")
+    if save_choice == 'y':
+        file_format = Prompt.ask("Виберіть формат", choices=["json", "csv"], default="json")
+        filename = Prompt.ask("Введіть ім'я файлу", default=f"query_{choice}_results.{file_format}")
+        save_results(rows, filename, file_format)
+
+
+# --- Запити меню ---
+def campaign_metrics(queries: AdsQueries) -> list:
+    """Сторінки метрик кампанії: курсор paging_state передається в наступний запит."""
+    campaign_id = IntPrompt.ask("Введіть ID кампанії (напр., 1)")
+    page_size = IntPrompt.ask("Рядків на сторінці", default=20)
+    rows, cursor = [], None
+    while True:
+        page = queries.campaign_daily_metrics(campaign_id, page_size, cursor)
+        rows += page.rows
+        print_rows(page.rows, f"campaign_daily_metrics: кампанія {campaign_id}")
+        cursor = page.cursor
+        if not cursor or Prompt.ask("Наступна сторінка?", choices=["y", "n"], default="y") == 'n':
+            return rows
+
+
+def top_advertisers(queries: AdsQueries) -> list:
+    region = Prompt.ask("Регіон (порожньо — усі регіони)", default="") or None
+    rows = queries.top_advertisers(IntPrompt.ask("Скільки рекламодавців", default=5), region)
+    print_rows(rows, f"Топ рекламодавців за витратами{f' ({region})' if region else ''}")
+    return rows
+
+
+def user_history(queries: AdsQueries) -> list:
+    rows = queries.user_history(IntPrompt.ask("Введіть ID користувача (напр., 302602)"),
+                                IntPrompt.ask("Скільки подій", default=10))
+    print_rows(rows, "Останні події користувача")
+    return rows
+
+
+def top_users(queries: AdsQueries) -> list:
+    rows = queries.top_users(IntPrompt.ask("Скільки користувачів", default=10))
+    print_rows(rows, "Топ користувачів за кліками")
+    return rows
+
+
+def user_rank(queries: AdsQueries) -> list:
+    rank = queries.user_rank(IntPrompt.ask("Введіть ID користувача"))
+    if rank is None:
+        console.print("[yellow]Користувач не має кліків за останні 30 днів.[/yellow]")
+        return []
+    console.print(f"Місце: [bold cyan]{rank['rank']}[/bold cyan], кліків: {rank['total_clicks']}")
+    print_rows(rank["neighbours"], f"Сторінка рейтингу {rank['page']}")
+    return [rank]
+
+
+def run_benchmark(queries: AdsQueries) -> list:
+    """Затримки запитів до локальної Cassandra: з кешем лідербордів і без нього."""
+    iterations = IntPrompt.ask("Кількість повторів кожного запиту", default=200)
+    user_id = IntPrompt.ask("ID користувача для запитів історії", default=302602)
+    campaign_id = IntPrompt.ask("ID кампанії для запиту метрик", default=1)
+    uncached = AdsQueries(queries.session, LeaderboardCache(max_size=0))
+    calls = {
+        "campaign_daily_metrics (page 100)": lambda: uncached.campaign_daily_metrics(campaign_id, 100),
+        "user_history (last 10)": lambda: uncached.user_history(user_id, 10),
+        "top_users (no cache)": lambda: uncached.top_users(10),
+        "top_users (LRU)": lambda: queries.top_users(10),
+        "top_advertisers (no cache)": lambda: uncached.top_advertisers(5),
+        "top_advertisers (LRU)": lambda: queries.top_advertisers(5),
+        "user_rank": lambda: uncached.user_rank(user_id),
+    }
+    console.print("...Виконується бенчмарк...")
+    report = benchmark(calls, iterations=iterations)
+    rows = [{"query": name, **stats} for name, stats in report.items()]
+    print_rows(rows, f"Затримки запитів, мс ({iterations} повторів)")
+    return rows
+
+
+def main():
+    """Головна функція, що відображає меню та керує процесом."""
+    session = get_db_connection()
+    if session is None:
+        return
+    queries = AdsQueries(session)
+
+    query_map = {
+        "1": ("Щоденні метрики кампанії (посторінково)", campaign_metrics),
+        "2": ("Топ рекламодавців за витратами (загалом або в регіоні)", top_advertisers),
+        "3": ("Останні події користувача", user_history),
+        "4": ("Топ користувачів за кліками", top_users),
+        "5": ("Місце користувача в рейтингу за кліками", user_rank),
+        "6": ("Бенчмарк затримок запитів", run_benchmark),
+    }
+
+    try:
+        while True:
+            console.print(f"\n[bold magenta]--- Меню запитів Cassandra ({os.getenv('CASSANDRA_KEYSPACE', 'adtech')}) "
+                          f"---[/bold magenta]")
+            for key, (desc, _) in query_map.items():
+                console.print(f"[cyan]{key}[/cyan]: {desc}")
+            console.print("[cyan]q[/cyan]: Вийти")
+
+            choice = Prompt.ask("Виберіть номер запиту", choices=list(query_map.keys()) + ["q"])
+            if choice == 'q':
+                console.print("[bold]До побачення![/bold]")
+                break
+
+            description, query_func = query_map[choice]
+            console.print(f"\nВи обрали: [bold yellow]{description}[/bold yellow]")
+            try:
+                rows = query_func(queries)
+                console.print(f"Знайдено [bold cyan]{len(rows)}[/bold cyan] результатів. "
+                              f"LRU лідербордів: {queries.cache.hits} влучань, {queries.cache.misses} промахів.")
+                if rows and choice != "6":
+                    console.print(json.dumps(rows[:1], indent=2, default=str))
+                ask_to_save(rows, choice)
+            except DriverException as e:
+                console.print(f"[bold red]Помилка виконання запиту до Cassandra:[/bold red] {e}")
+            except Exception as e:
+                console.print(f"[bold red]Сталася неочікувана помилка:[/bold red] {e}")
+    finally:
+        session.cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
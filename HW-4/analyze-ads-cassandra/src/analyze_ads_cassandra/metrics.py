@@ -0,0 +1,303 @@
+"""
+metrics.py
+~~~~~~~~~~
+Метрики етапів завантажувачів і ETL-завдань: сканування (рядки, сторінки,
+затримка отримання сторінки від драйвера), агрегація (час обробки сторінок),
+запис (затримки, запити у вікні, повтори) і тривалість етапів.
+
+Усі метрики живуть у реєстрі процесу `REGISTRY` з мітками (`table`, `writer`,
+`stage`). Після завершення запуску реєстр експортується в JSON (METRICS_FILE),
+а під час роботи може віддаватися у текстовому форматі Prometheus
+(METRICS_PORT, шлях `/metrics`). Дочірні процеси (сканування в режимі process,
+шарди import_data) повертають `REGISTRY.snapshot()`, який батьківський процес
+додає через `REGISTRY.merge`.
+
+Порівняння `etl_stage_seconds_total` з сумами `etl_scan_fetch_ms`,
+`etl_scan_aggregate_ms` і `etl_write_latency_ms` показує, чим обмежений
+запуск: читанням, CPU чи записом (`print_summary`).
+"""
+import atexit
+import bisect
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Межі кошиків гістограм затримок, мс
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def reset(self) -> None:
+        with self._lock:
+            self.value = 0.0
+
+    def state(self):
+        return self.value
+
+    def merge_state(self, state) -> None:
+        self.inc(state)
+
+    def to_dict(self):
+        return self.value
+
+
+class Gauge(Counter):
+    """Поточне значення (запити у вікні, швидкість); не підсумовується між процесами."""
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def merge_state(self, state) -> None:
+        pass
+
+
+class Histogram:
+    """Гістограма з фіксованими кошиками; перцентилі — верхня межа кошика (не більше max)."""
+    kind = "histogram"
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS_MS):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            target, seen = q / 100 * self.count, 0
+            for bound, count in zip(self.buckets + (self.max,), self.counts):
+                seen += count
+                if count and seen >= target:
+                    return float(min(bound, self.max))
+        return 0.0
+
+    def state(self):
+        with self._lock:
+            return list(self.counts), self.count, self.total, self.max
+
+    def merge_state(self, state) -> None:
+        counts, count, total, max_value = state
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.total += total
+            self.max = max(self.max, max_value)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            data = {
+                "count": self.count,
+                "sum": round(self.total, 3),
+                "mean": round(self.total / self.count, 3) if self.count else 0.0,
+                "max": round(self.max, 3),
+                "buckets": {f"le_{b}": c for b, c in zip(self.buckets, self.counts)},
+            }
+            data["buckets"]["le_inf"] = self.counts[-1]
+        data.update({f"p{q}": self.percentile(q) for q in (50, 95, 99)})
+        return data
+
+
+class Registry:
+    """Метрики процесу за назвою та мітками."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[Tuple[str, Labels], object] = {}
+        self._help: Dict[str, str] = {}
+
+    def _get(self, cls, name: str, help_text: str, labels: dict, **kwargs):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(**kwargs)
+                self._help.setdefault(name, help_text)
+            return metric
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "", **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "", buckets=LATENCY_BUCKETS_MS, **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Додає тривалість блоку до `etl_stage_seconds_total{stage=...}`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.counter("etl_stage_seconds_total", "Wall time spent in a job stage", stage=stage).inc(
+                time.perf_counter() - started)
+
+    def _items(self) -> List[Tuple[str, Labels, object]]:
+        with self._lock:
+            return [(name, labels, metric) for (name, labels), metric in sorted(self._metrics.items())]
+
+    # --- передача між процесами ---
+    def reset(self) -> None:
+        """Обнуляє значення (об'єкти метрик, на які тримають посилання, залишаються)."""
+        for _, _, metric in self._items():
+            metric.reset()
+
+    def snapshot(self) -> list:
+        return [(metric.kind, name, labels, metric.state()) for name, labels, metric in self._items()]
+
+    def merge(self, snapshot: list) -> None:
+        factories = {"counter": self.counter, "gauge": self.gauge, "histogram": self.histogram}
+        for kind, name, labels, state in snapshot:
+            factories[kind](name, **dict(labels)).merge_state(state)
+
+    # --- експорт ---
+    def to_dict(self) -> dict:
+        data: Dict[str, dict] = {}
+        for name, labels, metric in self._items():
+            key = ",".join(f"{k}={v}" for k, v in labels) or "total"
+            data.setdefault(name, {})[key] = metric.to_dict()
+        return data
+
+    def export(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+        print(f"📈 Job metrics written to {path}")
+
+    def prometheus_text(self) -> str:
+        lines, seen = [], set()
+        for name, labels, metric in self._items():
+            if name not in seen:
+                seen.add(name)
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+            if isinstance(metric, Histogram):
+                counts, count, total, _ = metric.state()
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+REGISTRY = Registry()
+
+
+def stage(name: str):
+    return REGISTRY.stage(name)
+
+
+def serve_prometheus(port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """HTTP-сервер у фоновому потоці, що віддає `/metrics` у форматі Prometheus."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"📈 Prometheus metrics at http://0.0.0.0:{server.server_address[1]}/metrics")
+    return server
+
+
+_configured = False
+
+
+def configure_from_env() -> None:
+    """
+    METRICS_FILE — JSON з усіма метриками після завершення скрипта;
+    METRICS_PORT — endpoint Prometheus на час роботи. Лише в головному процесі:
+    дочірні процеси повертають свої метрики через snapshot.
+    """
+    global _configured
+    if _configured or mp.current_process().name != "MainProcess":
+        return
+    _configured = True
+    # CASSANDRA_METRICS_FILE — попередня назва змінної
+    metrics_file = os.getenv("METRICS_FILE") or os.getenv("CASSANDRA_METRICS_FILE")
+    if metrics_file:
+        atexit.register(REGISTRY.export, metrics_file)
+    port = os.getenv("METRICS_PORT")
+    if port:
+        try:
+            serve_prometheus(int(port))
+        except OSError as e:
+            print(f"⚠️  Failed to start metrics endpoint on port {port}: {e}")
+
+
+def _sum(name: str, field: Optional[str] = "sum") -> float:
+    return sum(metric[field] if field else metric for metric in REGISTRY.to_dict().get(name, {}).values())
+
+
+def print_summary() -> None:
+    """Тривалість етапів і сумарний час читання, агрегації та очікування записів."""
+    stages = REGISTRY.to_dict().get("etl_stage_seconds_total", {})
+    if stages:
+        print("⏱️  Stages: " + ", ".join(f"{key.split('=', 1)[-1]} {seconds:.1f}s"
+                                         for key, seconds in stages.items()))
+    rows, fetch_ms, aggregate_ms = _sum("etl_scan_rows_total", None), _sum("etl_scan_fetch_ms"), \
+        _sum("etl_scan_aggregate_ms")
+    if rows:
+        print(f"⏱️  Scan: {rows:,.0f} rows, {_sum('etl_scan_fetch_ms', 'count'):,.0f} pages; "
+              f"waiting for pages {fetch_ms / 1000:.1f}s, aggregating {aggregate_ms / 1000:.1f}s (summed over workers)")
+    writes = _sum("etl_write_latency_ms", "count")
+    if writes:
+        print(f"⏱️  Writes: {writes:,.0f} requests, {_sum('etl_write_latency_ms') / 1000:.1f}s total latency, "
+              f"{_sum('etl_write_retries_total', None):,.0f} retries")
@@ -0,0 +1,168 @@
+"""
+queries.py
+~~~~~~~~~~
+API читання денормалізованих проекцій (ті самі запити, що в `cassandra_queries/dml_queries.cql`).
+
+- Усі запити — підготовлені й ідемпотентні (`prepare_cached`), тож token-aware
+  політика кластера надсилає їх одразу на репліку партиції, а повільна репліка
+  дублюється спекулятивним запитом.
+- Великі партиції (`campaign_daily_metrics` кампанії) читаються сторінками:
+  курсор — закодований `paging_state` драйвера, який повертається клієнту і
+  передається назад для наступної сторінки.
+- Лідерборди кешуються в LRU процесу. Ключ кешу містить фізичну таблицю
+  активної версії, тому після перемикання версії кеш не віддає застарілі дані.
+"""
+import base64
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from analyze_ads_cassandra.leaderboard import get_user_rank
+from analyze_ads_cassandra.user_history import recent_events
+from analyze_ads_cassandra.utils import prepare_cached
+from analyze_ads_cassandra.versioning import active_table
+
+TIME_BUCKET = "last_30_days_historical"
+DEFAULT_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", "100"))
+# 0 вимикає кеш лідербордів
+LEADERBOARD_CACHE_SIZE = int(os.getenv("LEADERBOARD_CACHE_SIZE", "256"))
+
+
+class Page(NamedTuple):
+    rows: List[dict]
+    cursor: Optional[str]  # None — сторінок більше немає
+
+
+def encode_cursor(paging_state: Optional[bytes]) -> Optional[str]:
+    return base64.urlsafe_b64encode(paging_state).decode("ascii") if paging_state else None
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[bytes]:
+    return base64.urlsafe_b64decode(cursor.encode("ascii")) if cursor else None
+
+
+class LeaderboardCache:
+    """LRU-кеш результатів лідербордів з лічильниками влучань."""
+
+    def __init__(self, max_size: int = LEADERBOARD_CACHE_SIZE):
+        self._max_size = max_size
+        self._items: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: tuple, load: Callable[[], Any]) -> Any:
+        if self._max_size <= 0:
+            return load()
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+        value = load()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class AdsQueries:
+    """Запити до аналітичних таблиць keyspace сесії."""
+
+    def __init__(self, session, cache: Optional[LeaderboardCache] = None):
+        self.session = session
+        self.cache = cache if cache is not None else LeaderboardCache()
+
+    def _statement(self, table: str, query: str):
+        return prepare_cached(self.session, query.format(table=active_table(self.session, table)), idempotent=True)
+
+    # --- сторінкові запити ---
+    def campaign_daily_metrics(self, campaign_id: int, page_size: int = DEFAULT_PAGE_SIZE,
+                               cursor: Optional[str] = None) -> Page:
+        """Щоденні метрики кампанії від найновішого дня, сторінками по `page_size` рядків."""
+        stmt = self._statement("campaign_daily_metrics",
+                               "SELECT event_date, impressions, clicks, ctr FROM {table} WHERE campaign_id = ?")
+        bound = stmt.bind((campaign_id,))
+        bound.fetch_size = page_size
+        result = self.session.execute(bound, paging_state=decode_cursor(cursor))
+        rows = [{"event_date": r.event_date, "impressions": r.impressions, "clicks": r.clicks, "ctr": r.ctr}
+                for r in result.current_rows]
+        return Page(rows, encode_cursor(result.paging_state))
+
+    # --- історія користувача ---
+    def user_history(self, user_id: int, limit: int = 10, start=None) -> List[dict]:
+        """Останні `limit` подій користувача (місячні бакети від нового до старого)."""
+        return recent_events(self.session, user_id, limit, start=start)
+
+    # --- лідерборди (кешуються) ---
+    def top_advertisers(self, limit: int = 10, region: Optional[str] = None) -> List[dict]:
+        """Топ рекламодавців за витратами за 30 днів — загальний або в регіоні."""
+        if region is None:
+            table, query, params = "top_advertisers_by_spend", (
+                "SELECT advertiser_name, total_spend FROM {table} WHERE time_bucket = ? LIMIT ?"), (TIME_BUCKET, limit)
+        else:
+            table, query, params = "top_advertisers_by_region", (
+                "SELECT advertiser_name, total_spend FROM {table} WHERE region = ? LIMIT ?"), (region, limit)
+
+        def load():
+            rows = self.session.execute(self._statement(table, query), params)
+            return [{"advertiser_name": r.advertiser_name, "total_spend": r.total_spend} for r in rows]
+
+        return self.cache.get_or_load((active_table(self.session, table), region, limit), load)
+
+    def top_users(self, limit: int = 10) -> List[dict]:
+        """Топ користувачів за кліками за 30 днів."""
+        table = "top_users_by_clicks"
+
+        def load():
+            stmt = self._statement(table, "SELECT user_id, total_clicks FROM {table} WHERE time_bucket = ? LIMIT ?")
+            return [{"user_id": r.user_id, "total_clicks": r.total_clicks}
+                    for r in self.session.execute(stmt, (TIME_BUCKET, limit))]
+
+        return self.cache.get_or_load((active_table(self.session, table), limit), load)
+
+    def user_rank(self, user_id: int) -> Optional[dict]:
+        """Місце користувача в рейтингу за кліками та його сусіди."""
+        return get_user_rank(self.session, TIME_BUCKET, user_id)
+
+
+# --- Бенчмарк затримок ---
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def benchmark(calls: Dict[str, Callable[[], Any]], iterations: int = 200,
+              warmup: int = 10) -> Dict[str, Dict[str, float]]:
+    """
+    Затримки кожного запиту в мілісекундах (p50/p95/p99/max). Прогрів прибирає
+    з вимірювання підготовку запитів і перше читання покажчиків версій.
+    """
+    report = {}
+    for name, call in calls.items():
+        for _ in range(warmup):
+            call()
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - started) * 1000)
+        report[name] = {
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "max_ms": round(max(samples), 3),
+            "ops_per_s": round(iterations / (sum(samples) / 1000), 1),
+        }
+    return report
@@ -0,0 +1,181 @@
+"""
+scanner.py
+~~~~~~~~~~
+Паралельне сканування таблиці Cassandra за діапазонами токенів.
+
+Кільце токенів Murmur3 ділиться на N піддіапазонів, кожен з яких читається
+окремим запитом `WHERE token(pk) > ? AND token(pk) <= ?` у власному потоці
+(або процесі). Кожен піддіапазон наповнює свій частковий акумулятор, а після
+завершення всі часткові результати об'єднуються через `merge`.
+
+Рядки надходять в акумулятори посторінково (`add_page`) як кортежі в порядку
+`columns` (профіль `TUPLE_PROFILE`): значення вже десеріалізовані драйвером у
+datetime/Decimal, а позиції колонок акумулятор визначає один раз через
+`column_positions`. Колонкові акумулятори (див. `columnar.py`) агрегують
+сторінку векторно, решта — построчно через `add`.
+
+Для кожної таблиці в реєстр метрик (metrics.py) пишуться кількість рядків і
+сторінок, час очікування сторінки від драйвера (`etl_scan_fetch_ms`) і час її
+обробки акумулятором (`etl_scan_aggregate_ms`).
+"""
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+from cassandra.query import ConsistencyLevel, SimpleStatement
+from dotenv import load_dotenv
+
+from analyze_ads_cassandra.metrics import REGISTRY
+from analyze_ads_cassandra.utils import TUPLE_PROFILE, get_db_connection
+
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+TokenRange = Tuple[int, int]
+
+
+class Accumulator:
+    """Частковий агрегат одного піддіапазону: `add` для рядка-кортежу, `merge` для іншого акумулятора."""
+
+    def add(self, row) -> None:
+        raise NotImplementedError
+
+    def add_page(self, rows: Sequence) -> None:
+        """Сторінка рядків від драйвера; за замовчуванням — построчно через `add`."""
+        for row in rows:
+            self.add(row)
+
+    def merge(self, other: "Accumulator") -> "Accumulator":
+        raise NotImplementedError
+
+
+def column_positions(columns: Sequence[str], *names: str) -> Tuple[int, ...]:
+    """Індекси колонок `names` у кортежі рядка, отриманому запитом по `columns`."""
+    columns = list(columns)
+    return tuple(columns.index(name) for name in names)
+
+
+def iter_pages(result) -> Iterator[List]:
+    """Повертає сторінки результату запиту (списки рядків) у міру їх отримання."""
+    while True:
+        yield result.current_rows
+        if not result.has_more_pages:
+            return
+        result.fetch_next_page()
+
+
+class ScanMetrics:
+    """Метрики сканування однієї таблиці в реєстрі процесу."""
+
+    def __init__(self, table: str):
+        self.rows = REGISTRY.counter("etl_scan_rows_total", "Rows scanned", table=table)
+        self.fetch_ms = REGISTRY.histogram("etl_scan_fetch_ms", "Wait for a page from the driver, ms", table=table)
+        self.aggregate_ms = REGISTRY.histogram("etl_scan_aggregate_ms", "Aggregation time per page, ms", table=table)
+        self.rows_per_second = REGISTRY.gauge("etl_scan_rows_per_second", "Scan throughput", table=table)
+
+
+def split_token_ring(n_splits: int) -> List[TokenRange]:
+    """Ділить кільце на `n_splits` рівних діапазонів `(start, end]`."""
+    n_splits = max(n_splits, 1)
+    step = (MAX_TOKEN - MIN_TOKEN) // n_splits
+    bounds = [MIN_TOKEN + i * step for i in range(n_splits)] + [MAX_TOKEN]
+    return [(bounds[i], bounds[i + 1]) for i in range(n_splits)]
+
+
+def table_of(query: str) -> str:
+    return query.split(" FROM ", 1)[1].split()[0]
+
+
+def build_range_query(table: str, columns: Sequence[str], partition_key: Sequence[str]) -> str:
+    pk = ", ".join(partition_key)
+    return (f"SELECT {', '.join(columns)} FROM {table} "
+            f"WHERE token({pk}) > %s AND token({pk}) <= %s")
+
+
+def scan_range(session, query: str, token_range: TokenRange, accumulator: Accumulator,
+               fetch_size: int = 5000) -> Tuple[Accumulator, int]:
+    """Сканує один піддіапазон токенів і повертає (акумулятор, кількість рядків)."""
+    # Ідемпотентне читання: драйвер може повторити запит після таймауту на іншій репліці
+    # (спекулятивних запитів TUPLE_PROFILE не робить, див. NoSpeculativeExecutionPolicy)
+    statement = SimpleStatement(query, fetch_size=fetch_size, consistency_level=ConsistencyLevel.ONE,
+                                is_idempotent=True)
+    metrics = ScanMetrics(table_of(query))
+    rows = 0
+    fetch_started = time.perf_counter()
+    for page in iter_pages(session.execute(statement, token_range, execution_profile=TUPLE_PROFILE)):
+        aggregate_started = time.perf_counter()
+        metrics.fetch_ms.observe((aggregate_started - fetch_started) * 1000)
+        accumulator.add_page(page)
+        fetch_started = time.perf_counter()
+        metrics.aggregate_ms.observe((fetch_started - aggregate_started) * 1000)
+        metrics.rows.inc(len(page))
+        rows += len(page)
+    return accumulator, rows
+
+
+def _scan_range_in_process(query: str, token_range: TokenRange, accumulator_factory: Callable[[], Accumulator],
+                           fetch_size: int):
+    """
+    Точка входу для процесного режиму: кожен процес відкриває власну сесію.
+    Разом з результатом повертає метрики процесу за цей піддіапазон.
+    """
+    load_dotenv()
+    REGISTRY.reset()  # процес пулу виконує кілька піддіапазонів
+    session = get_db_connection()
+    if not session:
+        raise RuntimeError("Failed to connect to Cassandra")
+    try:
+        accumulator, rows = scan_range(session, query, token_range, accumulator_factory(), fetch_size)
+        return accumulator, rows, REGISTRY.snapshot()
+    finally:
+        session.cluster.shutdown()
+
+
+def parallel_scan(session, table: str, columns: Sequence[str], accumulator_factory: Callable[[], Accumulator],
+                  partition_key: Sequence[str] = ("event_id",),
+                  workers: int = None, splits: int = None, fetch_size: int = 5000,
+                  mode: str = None) -> Accumulator:
+    """
+    Сканує всю таблицю паралельно і повертає об'єднаний акумулятор.
+
+    `mode="thread"` використовує одну спільну сесію (драйвер потокобезпечний);
+    `mode="process"` запускає окремі процеси зі своїми сесіями — тоді
+    `accumulator_factory` і акумулятор мають підтримувати pickle.
+    Значення за замовчуванням беруться з SCAN_WORKERS, SCAN_SPLITS, SCAN_MODE.
+    """
+    workers = workers or int(os.getenv("SCAN_WORKERS", "8"))
+    splits = splits or int(os.getenv("SCAN_SPLITS", str(workers * 4)))
+    mode = mode or os.getenv("SCAN_MODE", "thread")
+
+    query = build_range_query(table, columns, partition_key)
+    ranges = split_token_ring(splits)
+    print(f"🔎 Scanning {table} in {len(ranges)} token ranges with {workers} {mode} workers ...")
+
+    started = time.perf_counter()
+    if mode == "process":
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+        submit = lambda r: executor.submit(_scan_range_in_process, query, r, accumulator_factory, fetch_size)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+        submit = lambda r: executor.submit(scan_range, session, query, r, accumulator_factory(), fetch_size)
+
+    result = None
+    total_rows = 0
+    with executor:
+        futures = [submit(r) for r in ranges]
+        for done, future in enumerate(as_completed(futures), start=1):
+            partial, rows, *snapshot = future.result()
+            if snapshot:
+                REGISTRY.merge(snapshot[0])
+            total_rows += rows
+            with REGISTRY.stage("merge"):
+                result = partial if result is None else result.merge(partial)
+            print(f"Scanned range {done}/{len(ranges)}: {total_rows} rows so far")
+
+    elapsed = time.perf_counter() - started
+    ScanMetrics(table).rows_per_second.set(total_rows / elapsed if elapsed > 0 else 0)
+    print(f"Finished scanning {table}: {total_rows} rows in {elapsed:.1f}s "
+          f"({total_rows / elapsed if elapsed > 0 else 0:,.0f} rows/s)")
+    return result
@@ -0,0 +1,135 @@
+"""
+spill.py
+~~~~~~~~
+Агрегація з обмеженням пам'яті та вивантаженням на диск (external aggregation).
+
+`SpillingAggregator` тримає суми за ключами у словнику. Коли кількість ключів
+перевищує ліміт, словник сортується і записується на локальний диск як
+відсортований частковий прогін (run), а пам'ять звільняється. Наприкінці всі
+прогони зливаються (`heapq.merge`) з поточним словником, і суми однакових
+ключів додаються — у пам'яті одночасно є лише по одному блоку з кожного прогону.
+"""
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+# Приблизний розмір одного запису словника (ключ-кортеж + суми + слот словника)
+ENTRY_BYTES = 256
+RUN_CHUNK = 10_000
+
+
+def memory_limit_entries(memory_mb: int, n_aggregators: int = 1) -> int:
+    """Ліміт ключів на один агрегатор для заданого бюджету пам'яті в мегабайтах."""
+    return max(memory_mb * 1024 * 1024 // (ENTRY_BYTES * max(n_aggregators, 1)), 1_000)
+
+
+def _order(item):
+    """Порядок сортування ключів, стійкий до None у компонентах ключа."""
+    return tuple((0, 0) if v is None else (1, v) for v in item[0])
+
+
+def _read_run(path: Path) -> Iterator[Tuple[Hashable, tuple]]:
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                chunk = pickle.load(fh)
+            except EOFError:
+                return
+            yield from chunk
+
+
+class SpillingAggregator:
+    """
+    Суми кортежів цілих чисел за ключем-кортежем з лімітом `max_entries` ключів у пам'яті.
+    Після `items()` тимчасові файли видаляються.
+    """
+
+    def __init__(self, name: str, max_entries: int, spill_dir: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir or os.getenv("SPILL_DIR") or None
+        self.memory: Dict[Hashable, tuple] = {}
+        self.runs: List[Path] = []
+        self._tmpdir: Optional[str] = None
+        self._dirs: List[str] = []  # каталоги з прогонами, включно з отриманими через merge
+
+        self.spills = 0
+        self.spilled_entries = 0
+        self.spilled_bytes = 0
+        self.peak_entries = 0
+
+    def add(self, key: Hashable, values: tuple) -> None:
+        current = self.memory.get(key)
+        self.memory[key] = values if current is None else tuple(a + b for a, b in zip(current, values))
+        if len(self.memory) >= self.max_entries:
+            self.spill()
+
+    def spill(self) -> None:
+        """Записує поточний словник на диск відсортованим прогоном."""
+        if not self.memory:
+            return
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix=f"spill-{self.name}-", dir=self.spill_dir)
+            self._dirs.append(self._tmpdir)
+        items = sorted(self.memory.items(), key=_order)
+        path = Path(self._tmpdir) / f"run-{len(self.runs):05d}.pkl"
+        with open(path, "wb") as fh:
+            for i in range(0, len(items), RUN_CHUNK):
+                pickle.dump(items[i:i + RUN_CHUNK], fh, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(path)
+        self.peak_entries = max(self.peak_entries, len(self.memory))
+        self.spills += 1
+        self.spilled_entries += len(items)
+        self.spilled_bytes += path.stat().st_size
+        self.memory = {}
+
+    def merge(self, other: "SpillingAggregator") -> "SpillingAggregator":
+        """Забирає прогони іншого агрегатора і додає його словник до свого."""
+        self.runs.extend(other.runs)
+        self._dirs.extend(other._dirs)
+        memory = other.memory
+        other.memory, other.runs, other._dirs, other._tmpdir = {}, [], [], None
+        for key, values in memory.items():
+            self.add(key, values)
+        self.spills += other.spills
+        self.spilled_entries += other.spilled_entries
+        self.spilled_bytes += other.spilled_bytes
+        self.peak_entries = max(self.peak_entries, other.peak_entries)
+        return self
+
+    def items(self) -> Iterator[Tuple[Hashable, tuple]]:
+        """
+        Підсумки за кожним ключем: злиття всіх прогонів і словника в пам'яті
+        (відсортовані за ключем, якщо були вивантаження на диск).
+        """
+        self.peak_entries = max(self.peak_entries, len(self.memory))
+        try:
+            if not self.runs:
+                yield from self.memory.items()
+                return
+            sources = [_read_run(path) for path in self.runs]
+            sources.append(iter(sorted(self.memory.items(), key=_order)))
+            self.memory = {}
+            merged = heapq.merge(*sources, key=_order)
+            for key, group in groupby(merged, key=lambda item: item[0]):
+                totals = None
+                for _, values in group:
+                    totals = values if totals is None else tuple(a + b for a, b in zip(totals, values))
+                yield key, totals
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for directory in self._dirs:
+            shutil.rmtree(directory, ignore_errors=True)
+        self._tmpdir, self._dirs, self.runs = None, [], []
+
+    def report(self) -> str:
+        peak = max(self.peak_entries, len(self.memory))
+        return (f"[{self.name}] spills: {self.spills}, spilled entries: {self.spilled_entries}, "
+                f"spilled: {self.spilled_bytes / 1024 / 1024:.1f} MiB, peak in memory: {peak}")
@@ -0,0 +1,96 @@
+"""
+user_history.py
+~~~~~~~~~~~~~~~
+Історія подій користувача, розбита на місячні партиції.
+
+`user_engagement_history` має ключ `((user_id, month), event_time)`: розмір
+партиції обмежений подіями одного місяця, а `default_time_to_live` прибирає
+старі записи. Запит «останні N подій» проходить місячні бакети від нового до
+старого, поки не набере N рядків; кілька наступних бакетів запитуються
+асинхронно наперед, тож порожні місяці не додають послідовних звернень.
+Прохід починається з місяця останньої завантаженої події (ingest_metadata),
+а не з поточного: історичні дані можуть бути старшими за `MAX_BUCKETS` місяців.
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterator, List, Optional, Sequence
+
+from analyze_ads_cassandra.ingest_metadata import read_watermark
+from analyze_ads_cassandra.utils import prepare_cached
+from analyze_ads_cassandra.versioning import active_table
+
+TABLE_NAME = "user_engagement_history"
+# TTL рахується від моменту запису; 0 — без обмеження
+HISTORY_TTL_DAYS = int(os.getenv("USER_HISTORY_TTL_DAYS", "365"))
+# Скільки місяців назад шукати події і скільки бакетів запитувати одночасно
+MAX_BUCKETS = int(os.getenv("USER_HISTORY_MAX_BUCKETS", "24"))
+PREFETCH_BUCKETS = int(os.getenv("USER_HISTORY_PREFETCH_BUCKETS", "3"))
+
+
+def month_bucket(moment) -> date:
+    """Перший день місяця — ключ бакета для мітки часу або дати."""
+    return date(moment.year, moment.month, 1)
+
+
+def previous_month(bucket: date) -> date:
+    return date(bucket.year - 1, 12, 1) if bucket.month == 1 else date(bucket.year, bucket.month - 1, 1)
+
+
+def month_buckets(start, count: int = MAX_BUCKETS) -> Iterator[date]:
+    """`count` місячних бакетів від місяця `start` у минуле."""
+    bucket = month_bucket(start)
+    for _ in range(count):
+        yield bucket
+        bucket = previous_month(bucket)
+
+
+def history_start(latest: Optional[datetime]) -> Optional[datetime]:
+    """
+    Найстаріша подія, яку варто копіювати при повному перезавантаженні: старіші
+    на момент `latest` (остання подія) вже вийшли б за TTL. None — без обмеження.
+    """
+    if not HISTORY_TTL_DAYS or latest is None:
+        return None
+    return latest - timedelta(days=HISTORY_TTL_DAYS)
+
+
+def history_params(user_id, event_time: datetime, campaign_name, advertiser_name, was_clicked) -> tuple:
+    """Параметри INSERT у user_engagement_history (з ключем місяця)."""
+    return user_id, month_bucket(event_time), event_time, campaign_name, advertiser_name, bool(was_clicked)
+
+
+def insert_query(table: str = TABLE_NAME) -> str:
+    return (f"INSERT INTO {table} (user_id, month, event_time, campaign_name, advertiser_name, was_clicked) "
+            f"VALUES (?, ?, ?, ?, ?, ?)")
+
+
+def recent_events(session, user_id: int, limit: int = 10, start: Optional[datetime] = None,
+                  max_buckets: int = MAX_BUCKETS, prefetch: int = PREFETCH_BUCKETS) -> List[dict]:
+    """
+    Останні `limit` подій користувача, від нових до старих.
+    Пошук починається з місяця `start`; за замовчуванням — з місяця останньої
+    події raw_events, а без метаданих завантаження — з поточного.
+    """
+    table = active_table(session, TABLE_NAME)
+    stmt = prepare_cached(session, f"SELECT event_time, campaign_name, advertiser_name, was_clicked FROM {table} "
+                                   f"WHERE user_id = ? AND month = ? LIMIT ?", idempotent=True)
+    if start is None:
+        watermark = read_watermark(session)
+        start = watermark.latest_ts if watermark else datetime.utcnow()
+    buckets: Sequence[date] = list(month_buckets(start, max_buckets))
+
+    events: List[dict] = []
+    step = max(prefetch, 1)
+    for i in range(0, len(buckets), step):
+        futures = [session.execute_async(stmt, (user_id, bucket, limit)) for bucket in buckets[i:i + step]]
+        for future in futures:
+            for row in future.result():
+                events.append({
+                    "event_time": row.event_time,
+                    "campaign_name": row.campaign_name,
+                    "advertiser_name": row.advertiser_name,
+                    "was_clicked": row.was_clicked,
+                })
+                if len(events) >= limit:
+                    return events
+    return events
@@ -1,26 +1,133 @@
 import json
 import os
+import time
 from pathlib import Path
 
 import gdown
 import pandas as pd
-from cassandra.cluster import Cluster
+from cassandra.cluster import EXEC_PROFILE_DEFAULT, Cluster, ExecutionProfile
+from cassandra.connection import locally_supported_compressions
+from cassandra.policies import (ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy,
+                                NoSpeculativeExecutionPolicy, TokenAwarePolicy)
+from cassandra.query import tuple_factory
+
+from analyze_ads_cassandra.metrics import REGISTRY, Registry, configure_from_env
+
+# Профіль виконання для сканувань: рядки повертаються як звичайні кортежі,
+# без створення namedtuple на кожен рядок
+TUPLE_PROFILE = "tuples"
 
 
 # --- Функції для роботи з Cassandra ---
+class RequestMetrics:
+    """
+    Затримки всіх запитів сесії: гістограма `cassandra_request_latency_ms` і
+    лічильник помилок у реєстрі метрик процесу (metrics.py).
+    Підключається через `session.add_request_init_listener`, тож не потребує
+    додаткових залежностей (вбудовані метрики драйвера вимагають пакет scales).
+    """
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.latency = registry.histogram("cassandra_request_latency_ms", "Driver request latency, ms")
+        self.errors = registry.counter("cassandra_request_errors_total", "Failed driver requests")
+
+    def on_request(self, response_future) -> None:
+        started = time.perf_counter()
+        response_future.add_callbacks(self._done, self._failed,
+                                      callback_args=(started,), errback_args=(started,))
+
+    def _done(self, _rows, started: float) -> None:
+        self.latency.observe((time.perf_counter() - started) * 1000)
+
+    def _failed(self, _exc, started: float) -> None:
+        self.latency.observe((time.perf_counter() - started) * 1000)
+        self.errors.inc()
+
+    def percentile(self, q: float) -> float:
+        return self.latency.percentile(q)
+
+    def to_dict(self) -> dict:
+        return {**self.latency.to_dict(), "errors": self.errors.value}
+
+
+def _compression():
+    """LZ4, якщо встановлено пакет lz4; інакше будь-яке доступне стиснення (або без нього)."""
+    wanted = os.getenv("CASSANDRA_COMPRESSION", "lz4").lower()
+    if wanted in ("none", "false", "0"):
+        return False
+    return wanted if wanted in locally_supported_compressions else bool(locally_supported_compressions)
+
+
+def create_cluster(host: str = None, port: int = None) -> Cluster:
+    """
+    Налаштований кластер для всіх скриптів пакета:
+    token-aware + DC-aware балансування, стиснення протоколу, спекулятивне
+    виконання ідемпотентних запитів і профіль TUPLE_PROFILE для сканувань.
+    У TUPLE_PROFILE спекулятивне виконання вимкнене: сторінки сканування
+    ідемпотентні, але повільні, тож кожна сторінка довша за затримку
+    відправлялася б двічі й подвоювала навантаження на координаторів.
+    """
+    host = host or os.getenv("CASSANDRA_HOST") or "127.0.0.1"
+    port = port or int(os.getenv("CASSANDRA_PORT", "9042"))
+
+    def profile(speculative_execution_policy, **kwargs) -> ExecutionProfile:
+        return ExecutionProfile(
+            # Координатор — репліка потрібної партиції в локальному DC
+            load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=os.getenv("CASSANDRA_LOCAL_DC"))),
+            speculative_execution_policy=speculative_execution_policy,
+            request_timeout=float(os.getenv("CASSANDRA_REQUEST_TIMEOUT", "10")),
+            **kwargs,
+        )
+
+    # Діє лише для запитів з is_idempotent=True
+    speculative = ConstantSpeculativeExecutionPolicy(
+        delay=float(os.getenv("CASSANDRA_SPECULATIVE_DELAY_MS", "50")) / 1000,
+        max_attempts=int(os.getenv("CASSANDRA_SPECULATIVE_ATTEMPTS", "2")),
+    )
+
+    cluster = Cluster(
+        [host], port=port,
+        compression=_compression(),
+        executor_threads=int(os.getenv("CASSANDRA_EXECUTOR_THREADS", "4")),
+        execution_profiles={
+            EXEC_PROFILE_DEFAULT: profile(speculative),
+            TUPLE_PROFILE: profile(NoSpeculativeExecutionPolicy(), row_factory=tuple_factory),
+        },
+    )
+    return cluster
+
+
+def prepare_cached(session, query: str, idempotent: bool = False):
+    """
+    `session.prepare` з кешем на рівні сесії: повторна підготовка того самого
+    запиту не звертається до кластера. `idempotent=True` дозволяє спекулятивне виконання.
+    """
+    cache = session.__dict__.setdefault("_prepared_cache", {})
+    statement = cache.get(query)
+    if statement is None:
+        statement = session.prepare(query)
+        statement.is_idempotent = idempotent
+        cache[query] = statement
+    return statement
+
+
+def request_metrics(session) -> RequestMetrics:
+    return session.__dict__.setdefault("_request_metrics", RequestMetrics())
+
+
 def get_db_connection() -> 'cassandra.cluster.Session':
     """Establishes connection to Cassandra and returns the session.
        Works for both Docker (using environment vars) and local execution."""
-    host = os.getenv("CASSANDRA_HOST")
-    if not host:
-        # Default to localhost when not running in Docker
-        host = "127.0.0.1"
+    host = os.getenv("CASSANDRA_HOST") or "127.0.0.1"
     port = os.getenv("CASSANDRA_PORT", "9042")
     keyspace = os.getenv("CASSANDRA_KEYSPACE", "adtech")
     try:
         print(f"🔗 Connecting to Cassandra at {host}:{port} (keyspace: {keyspace}) ...")
-        cluster = Cluster([host], port=int(port))
+        cluster = create_cluster(host, int(port))
         session = cluster.connect(keyspace)
+        session.add_request_init_listener(request_metrics(session).on_request)
+        # METRICS_FILE / METRICS_PORT — експорт метрик запуску (див. metrics.py)
+        configure_from_env()
         # Check connection by executing a simple query
         session.execute("SELECT now() FROM system.local")
         print("✅ Successfully connected to Cassandra.")
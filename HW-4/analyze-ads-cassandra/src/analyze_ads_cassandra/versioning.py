@@ -0,0 +1,191 @@
+"""
+versioning.py
+~~~~~~~~~~~~~
+Версійне перезавантаження аналітичних таблиць замість TRUNCATE.
+
+Повне перезавантаження пише у нову фізичну таблицю `<назва>_v<N>`, поки
+читачі продовжують працювати з попередньою версією. Після запису покажчик у
+таблиці `active_versions` перемикається одним умовним (LWT) пакетом: усі
+покажчики keyspace лежать в одній партиції, тож кілька пов'язаних таблиць
+перемикаються атомарно, а одночасний конкурентний запуск не перезапише чужу
+версію. Старі версії видаляються через `DROP TABLE` асинхронно — без
+tombstone-ів, які залишає TRUNCATE/DELETE великих обсягів.
+
+Читачі визначають фізичну таблицю через `active_table()`; покажчик кешується
+в процесі на `ACTIVE_VERSION_CACHE_SECONDS`, тож зайвого запиту на кожне читання немає.
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from cassandra.query import BatchStatement, BatchType
+
+# Скільки версій зберігати: активну та попередню (для читачів, що ще працюють зі старим покажчиком)
+KEEP_VERSIONS = int(os.getenv("KEEP_TABLE_VERSIONS", "2"))
+POINTER_CACHE_SECONDS = float(os.getenv("ACTIVE_VERSION_CACHE_SECONDS", "5"))
+
+ACTIVE_VERSIONS_DDL = """
+CREATE TABLE IF NOT EXISTS active_versions (
+    keyspace_name  text,
+    table_name     text,
+    version        int,
+    physical_table text,
+    updated_at     timestamp,
+    PRIMARY KEY (keyspace_name, table_name)
+)
+"""
+
+_cache: Dict[Tuple[str, str], Tuple[float, str]] = {}
+_cache_lock = threading.Lock()
+_pending_drops: list = []
+
+
+def physical_name(table: str, version: int) -> str:
+    return f"{table}_v{version}"
+
+
+def _keyspace(session, keyspace: Optional[str] = None) -> str:
+    return (keyspace or session.keyspace or os.getenv("CASSANDRA_KEYSPACE", "adtech")).lower()
+
+
+def ensure_versions_table(session) -> None:
+    session.execute(ACTIVE_VERSIONS_DDL)
+
+
+def read_versions(session, keyspace: Optional[str] = None) -> Dict[str, Tuple[int, str]]:
+    """Поточні покажчики keyspace: логічна назва -> (версія, фізична таблиця)."""
+    rows = session.execute(
+        "SELECT table_name, version, physical_table FROM active_versions WHERE keyspace_name = %s",
+        (_keyspace(session, keyspace),),
+    )
+    return {r.table_name: (r.version, r.physical_table) for r in rows}
+
+
+def active_table(session, table: str, keyspace: Optional[str] = None,
+                 max_age: float = POINTER_CACHE_SECONDS) -> str:
+    """
+    Фізична таблиця, з якої зараз треба читати. Якщо версій ще немає,
+    повертається сама логічна назва (таблиця, створена без версіонування).
+    """
+    key = (_keyspace(session, keyspace), table)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached and now - cached[0] < max_age:
+        return cached[1]
+    row = session.execute(
+        "SELECT physical_table FROM active_versions WHERE keyspace_name = %s AND table_name = %s",
+        key,
+    ).one()
+    physical = row.physical_table if row else table
+    with _cache_lock:
+        _cache[key] = (now, physical)
+    return physical
+
+
+class VersionedLoad:
+    """
+    Нові версії групи пов'язаних таблиць.
+
+    `tables` — логічна назва -> DDL-шаблон з полем `{table}`. `begin()` створює
+    порожні таблиці нових версій і повертає їхні фізичні назви; `commit()`
+    атомарно перемикає покажчики і запускає видалення застарілих версій;
+    `abort()` видаляє незавершені версії.
+    """
+
+    def __init__(self, session, tables: Dict[str, str], keyspace: Optional[str] = None):
+        self.session = session
+        self.tables = tables
+        self.keyspace = _keyspace(session, keyspace)
+        self.current: Dict[str, Tuple[int, str]] = {}
+        self.physical: Dict[str, str] = {}
+        self.versions: Dict[str, int] = {}
+
+    def begin(self) -> Dict[str, str]:
+        existing = read_versions(self.session, self.keyspace)
+        for table, ddl in self.tables.items():
+            if table in existing:
+                self.current[table] = existing[table]
+            version = existing.get(table, (0, None))[0] + 1
+            physical = physical_name(table, version)
+            # Залишок невдалого запуску з тим самим номером версії
+            self.session.execute(f"DROP TABLE IF EXISTS {self.keyspace}.{physical}")
+            self.session.execute(ddl.format(table=f"{self.keyspace}.{physical}"))
+            self.versions[table] = version
+            self.physical[table] = physical
+        print(f"🆕 Loading new table versions: {', '.join(self.physical.values())}")
+        return dict(self.physical)
+
+    def commit(self) -> None:
+        """Перемикає всі покажчики групи одним умовним пакетом у партиції keyspace."""
+        batch = BatchStatement(batch_type=BatchType.LOGGED)
+        now = datetime.utcnow()
+        for table, version in self.versions.items():
+            if table in self.current:
+                batch.add(
+                    "UPDATE active_versions SET version = %s, physical_table = %s, updated_at = %s "
+                    "WHERE keyspace_name = %s AND table_name = %s IF version = %s",
+                    (version, self.physical[table], now, self.keyspace, table, self.current[table][0]),
+                )
+            else:
+                batch.add(
+                    "INSERT INTO active_versions (keyspace_name, table_name, version, physical_table, updated_at) "
+                    "VALUES (%s, %s, %s, %s, %s) IF NOT EXISTS",
+                    (self.keyspace, table, version, self.physical[table], now),
+                )
+        if not self.session.execute(batch).was_applied:
+            self.abort()
+            raise RuntimeError(f"Concurrent refresh of {', '.join(self.versions)}: active version has changed")
+
+        with _cache_lock:
+            for table, physical in self.physical.items():
+                _cache[(self.keyspace, table)] = (time.monotonic(), physical)
+        print(f"🔀 Switched to new table versions: {', '.join(self.physical.values())}")
+        for table, version in self.versions.items():
+            drop_old_versions(self.session, table, version, self.keyspace)
+
+    def abort(self) -> None:
+        for physical in self.physical.values():
+            self.session.execute(f"DROP TABLE IF EXISTS {self.keyspace}.{physical}")
+        self.physical, self.versions = {}, {}
+
+    def __enter__(self) -> Dict[str, str]:
+        return self.begin()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def drop_old_versions(session, table: str, active_version: int, keyspace: Optional[str] = None) -> List[str]:
+    """
+    Асинхронно видаляє версії, старші за `KEEP_VERSIONS` останніх.
+    Запити лише надсилаються; дочекатися їх можна через `wait_for_drops()`.
+    """
+    keyspace = _keyspace(session, keyspace)
+    pattern = re.compile(rf"^{re.escape(table)}_v(\d+)$")
+    rows = session.execute("SELECT table_name FROM system_schema.tables WHERE keyspace_name = %s", (keyspace,))
+    dropped = []
+    for row in rows:
+        match = pattern.match(row.table_name)
+        if match and int(match.group(1)) <= active_version - KEEP_VERSIONS:
+            _pending_drops.append(session.execute_async(f"DROP TABLE IF EXISTS {keyspace}.{row.table_name}"))
+            dropped.append(row.table_name)
+    if dropped:
+        print(f"🧹 Dropping old table versions in background: {', '.join(dropped)}")
+    return dropped
+
+
+def wait_for_drops() -> None:
+    """Чекає завершення фонових DROP TABLE (перед закриттям сесії)."""
+    while _pending_drops:
+        future = _pending_drops.pop()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"⚠️  Failed to drop an old table version: {e}")
@@ -0,0 +1,60 @@
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from analyze_ads_cassandra.user_history import MAX_BUCKETS, month_bucket, recent_events
+
+
+class FakeSession:
+    """Сесія в пам'яті: user_engagement_history без версій і рядок ingest_metadata."""
+
+    keyspace = "adtech"
+
+    def __init__(self, events, latest_ts=None):
+        self.events = sorted(events, key=lambda e: e[1], reverse=True)
+        self.latest_ts = latest_ts
+        self.requested = []
+
+    def execute(self, query, params=None):
+        if "ingest_metadata" in query and self.latest_ts is not None:
+            row = SimpleNamespace(latest_ts=self.latest_ts, total_rows=len(self.events), updated_at=None)
+        else:
+            row = None
+        return SimpleNamespace(one=lambda: row)
+
+    def prepare(self, query):
+        return SimpleNamespace(query=query)
+
+    def execute_async(self, statement, params):
+        user_id, bucket, limit = params
+        self.requested.append(bucket)
+        rows = [SimpleNamespace(event_time=ts, campaign_name=campaign, advertiser_name="adv", was_clicked=False)
+                for uid, ts, campaign in self.events if uid == user_id and month_bucket(ts) == bucket][:limit]
+        return SimpleNamespace(result=lambda: rows)
+
+
+def test_history_older_than_max_buckets_starts_from_watermark():
+    events = [(1, datetime(2021, 3, 5, 12), "march"), (1, datetime(2021, 1, 20), "january"),
+              (1, datetime(2020, 12, 31, 23), "december"), (2, datetime(2021, 3, 6), "other user")]
+    assert (date.today().year - 2021) * 12 > MAX_BUCKETS
+    session = FakeSession(events, latest_ts=datetime(2021, 3, 31, 18))
+
+    rows = recent_events(session, 1, limit=3)
+
+    assert [r["campaign_name"] for r in rows] == ["march", "january", "december"]
+    assert session.requested[0] == date(2021, 3, 1)
+
+
+def test_explicit_start_overrides_watermark():
+    events = [(1, datetime(2021, 3, 5), "march"), (1, datetime(2021, 1, 20), "january")]
+    session = FakeSession(events, latest_ts=datetime(2021, 3, 31))
+
+    rows = recent_events(session, 1, limit=10, start=datetime(2021, 2, 1))
+
+    assert [r["campaign_name"] for r in rows] == ["january"]
+
+
+def test_without_ingest_metadata_starts_from_current_month():
+    session = FakeSession([(1, datetime(2021, 3, 5), "march")])
+
+    assert recent_events(session, 1, limit=10, max_buckets=2) == []
+    assert session.requested[0] == month_bucket(datetime.utcnow())
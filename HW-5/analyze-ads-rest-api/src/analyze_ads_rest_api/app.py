@@ -5,8 +5,10 @@ from dotenv import load_dotenv
 from flask import Flask, request
 from flask_smorest import Api, Blueprint
 
+from analyze_ads_rest_api.cache import start_invalidation_listener
 from analyze_ads_rest_api.db import db
 from analyze_ads_rest_api.resources import blueprints
+from analyze_ads_rest_api.watermark import start_refresher
 
 server = Flask(__name__)
 load_dotenv()
@@ -46,6 +48,9 @@ def log_request_data():
 with server.app_context():
     db.create_all()
 
+start_refresher(server)
+start_invalidation_listener()
+
 adtech = Blueprint("adtech", "adtech", url_prefix="/adtech", description="AdTech REST API")
 
 blueprints_list = [
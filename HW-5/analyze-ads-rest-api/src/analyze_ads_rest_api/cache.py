@@ -1,11 +1,138 @@
-"""Helper functions for a simple read‑through Redis cache"""
+"""Helper functions for a read‑through Redis cache.
+
+Values are ready-to-send response bodies (bytes, see ``responses.encode_body``)
+stored behind a 16-byte header with the soft expiry and the compute time, so a hit
+never decodes the body. The Redis key lives ``CACHE_STALE_SECONDS`` longer than the soft TTL, which gives
+``read_through`` three protections against cache stampedes on hot keys:
+
+- single flight: on a miss only the caller holding the Redis lock ``lock:<key>``
+  recomputes the value; concurrent callers wait for it instead of running the query;
+- stale-while-revalidate: after the soft TTL the stale value is still served while
+  one background refresh (guarded by the same lock) recomputes it;
+- probabilistic early expiration (XFetch): a key is refreshed slightly before its
+  soft TTL with a probability that grows as expiry nears and with the compute time,
+  so hot keys are usually refreshed before anyone sees them expire.
+
+In front of Redis every worker keeps entries in a small in-process LRU
+(``CACHE_LOCAL_MAX_ITEMS`` entries, ``CACHE_LOCAL_TTL`` seconds), so hot keys are
+served without a network round trip. Every write is published on
+``CACHE_INVALIDATION_CHANNEL``; the listener thread of each worker drops its local
+copy of the written keys, which keeps gunicorn workers coherent. Hits and misses
+are counted per tier (``cache_stats``).
+"""
 import json
+import math
 import os
-from typing import Any
+import random
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 
 import redis
+from flask import current_app, has_app_context
 
 _redis = None
+_binary_redis = None
+
+# Extra time a value may be served stale while it is refreshed in the background
+CACHE_STALE_SECONDS = int(os.getenv("CACHE_STALE_SECONDS", 60))
+# Lock lifetime (upper bound for one recompute) and how long a caller waits for another's recompute
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", 10))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", 5))
+CACHE_POLL_INTERVAL = 0.05
+# XFetch beta: > 1 favours earlier refreshes, 0 disables early expiration
+CACHE_EARLY_EXPIRY_BETA = float(os.getenv("CACHE_EARLY_EXPIRY_BETA", 1.0))
+
+# In-process tier: entry count bound and how long a worker trusts its copy
+CACHE_LOCAL_MAX_ITEMS = int(os.getenv("CACHE_LOCAL_MAX_ITEMS", 10000))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", 2))
+CACHE_INVALIDATION_CHANNEL = "adtech:cache:invalidate"
+
+# Soft expiry (epoch seconds) and compute time in front of the body
+_HEADER = struct.Struct("!dd")
+
+_refresh_pool = ThreadPoolExecutor(max_workers=int(os.getenv("CACHE_REFRESH_WORKERS", 4)),
+                                   thread_name_prefix="cache-refresh")
+
+
+class Entry(NamedTuple):
+    exp: float
+    compute_seconds: float
+    body: bytes
+
+
+class LocalCache:
+    """Size-bounded LRU with a per-entry TTL, shared by the threads of one worker."""
+
+    def __init__(self, max_items: int, ttl: float):
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()
+        self.max_items = max_items
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Entry):
+        if self.max_items <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class TierStats:
+    """Hit/miss counters of one cache tier in this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"Hits": self.hits, "Misses": self.misses,
+                    "HitRatio": round(self.hits / total, 4) if total else 0.0}
+
+
+_local = LocalCache(CACHE_LOCAL_MAX_ITEMS, CACHE_LOCAL_TTL)
+_stats = {"local": TierStats(), "redis": TierStats()}
+_listener_pid = None
 
 
 def _get_redis() -> redis.Redis:
@@ -19,9 +146,278 @@ def _get_redis() -> redis.Redis:
     return _redis
 
 
-def cache_get(key: str):
-    return json.loads(_get_redis().get(key) or "null")
+def _get_binary_redis() -> redis.Redis:
+    """Client for cached bodies, which are stored as raw bytes."""
+    global _binary_redis
+    if _binary_redis is None:
+        _binary_redis = redis.Redis(
+            host=os.environ.get("REDIS_HOST", "localhost"),
+            port=int(os.environ.get("REDIS_PORT", 6379)),
+        )
+    return _binary_redis
+
+
+def _wrap(body: bytes, ttl: int, compute_seconds: float = 0.0) -> bytes:
+    return _HEADER.pack(time.time() + ttl, compute_seconds) + body
+
+
+def _unwrap(raw: Optional[bytes]) -> Optional[Entry]:
+    if not raw:
+        return None
+    exp, compute_seconds = _HEADER.unpack_from(raw)
+    return Entry(exp, compute_seconds, raw[_HEADER.size:])
+
+
+def _origin() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _publish_invalidation(pipe, keys: List[str]):
+    pipe.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({"origin": _origin(), "keys": keys}))
+
+
+def _setex(key: str, body: bytes, ttl: int, compute_seconds: float = 0.0):
+    raw = _wrap(body, ttl, compute_seconds)
+    pipe = _get_binary_redis().pipeline(transaction=False)
+    pipe.setex(key, ttl + CACHE_STALE_SECONDS, raw)
+    _publish_invalidation(pipe, [key])
+    pipe.execute()
+    _local.set(key, _unwrap(raw))
+
+
+def _read(key: str) -> Optional[Entry]:
+    """Entry from the local tier, then from Redis (cached locally on a hit)."""
+    start_invalidation_listener()
+    entry = _local.get(key)
+    _stats["local"].record(entry is not None)
+    if entry is not None:
+        return entry
+    entry = _unwrap(_get_binary_redis().get(key))
+    _stats["redis"].record(entry is not None)
+    if entry is not None:
+        _local.set(key, entry)
+    return entry
+
+
+def _is_fresh(entry: Entry) -> bool:
+    """Soft TTL check with XFetch: expiry is moved earlier by delta * beta * -ln(rand)."""
+    early = entry.compute_seconds * CACHE_EARLY_EXPIRY_BETA * -math.log(1.0 - random.random())
+    return time.time() + early < entry.exp
+
+
+def cache_get(key: str) -> Optional[bytes]:
+    entry = _read(key)
+    return entry.body if entry else None
+
+
+def cache_set(key: str, body: bytes, ttl: int):
+    _setex(key, body, ttl)
+
+
+def read_through(key: str, compute: Callable[[], Optional[bytes]], ttl: int) -> Optional[bytes]:
+    """
+    Returns the cached body for `key`, computing it with `compute()` at most once
+    per key across all workers. `None` results are returned but not cached.
+    Falls back to calling `compute()` directly when Redis is unavailable.
+    """
+    try:
+        entry = _read(key)
+    except redis.exceptions.RedisError as e:
+        print(f"Redis connection error: {e}")
+        return compute()
+
+    if entry is not None:
+        if _is_fresh(entry):
+            print(f"CACHE HIT for {key}")
+        else:
+            print(f"CACHE STALE for {key}")
+            _refresh_in_background(key, compute, ttl)
+        return entry.body
+
+    print(f"CACHE MISS for {key}")
+    return _compute_single_flight(key, compute, ttl)
+
+
+def _lock(key: str):
+    # thread_local=False: a background refresh acquires the lock in the request
+    # thread and releases it in a pool thread, which needs the same token
+    return _get_redis().lock(f"lock:{key}", timeout=CACHE_LOCK_TIMEOUT, blocking=False, thread_local=False)
+
+
+def _compute_and_store(key: str, compute: Callable[[], Optional[bytes]], ttl: int) -> Optional[bytes]:
+    started = time.perf_counter()
+    body = compute()
+    if body is not None:
+        try:
+            _setex(key, body, ttl, time.perf_counter() - started)
+        except redis.exceptions.RedisError as e:
+            print(f"Could not write to Redis: {e}")
+    return body
+
+
+def _compute_single_flight(key: str, compute: Callable[[], Optional[bytes]], ttl: int) -> Optional[bytes]:
+    lock = _lock(key)
+    try:
+        acquired = lock.acquire()
+    except redis.exceptions.RedisError as e:
+        print(f"Redis connection error: {e}")
+        return compute()
+
+    if acquired:
+        try:
+            return _compute_and_store(key, compute, ttl)
+        finally:
+            _release(lock)
+
+    # Another worker is computing the value: wait for it instead of hitting the database
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(CACHE_POLL_INTERVAL)
+            entry = _unwrap(_get_binary_redis().get(key))
+            if entry is not None:
+                return entry.body
+            if not lock.locked():
+                break  # the holder finished without caching (e.g. a None result)
+    except redis.exceptions.RedisError as e:
+        print(f"Redis connection error: {e}")
+    return compute()
+
+
+def _refresh_in_background(key: str, compute: Callable[[], Optional[bytes]], ttl: int):
+    lock = _lock(key)
+    try:
+        if not lock.acquire():
+            return  # another worker is already refreshing this key
+    except redis.exceptions.RedisError as e:
+        print(f"Redis connection error: {e}")
+        return
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def refresh():
+        try:
+            if app is None:
+                _compute_and_store(key, compute, ttl)
+            else:
+                with app.app_context():
+                    _compute_and_store(key, compute, ttl)
+        except Exception as e:
+            print(f"Background refresh of {key} failed: {e}")
+        finally:
+            _release(lock)
+
+    _refresh_pool.submit(refresh)
+
+
+def _release(lock):
+    try:
+        lock.release()
+    except redis.exceptions.LockNotOwnedError:
+        # The computation outlived CACHE_LOCK_TIMEOUT; another worker may hold the lock now
+        print(f"Cache lock {lock.name} expired before release")
+    except redis.exceptions.RedisError as e:
+        print(f"Could not release cache lock {lock.name}: {e}")
+
+
+def cache_get_many(keys: List[str]) -> List[Optional[bytes]]:
+    """
+    Local tier first, then one MGET for the remaining keys; missing keys come back
+    as None. Bodies past their soft TTL are returned as None too, so batch callers
+    recompute them.
+    """
+    if not keys:
+        return []
+    start_invalidation_listener()
+    entries = [_local.get(key) for key in keys]
+    for entry in entries:
+        _stats["local"].record(entry is not None)
+    remote = [i for i, entry in enumerate(entries) if entry is None]
+    if remote:
+        for i, raw in zip(remote, _get_binary_redis().mget([keys[i] for i in remote])):
+            entries[i] = _unwrap(raw)
+            _stats["redis"].record(entries[i] is not None)
+            if entries[i] is not None:
+                _local.set(keys[i], entries[i])
+    return [entry.body if entry and _is_fresh(entry) else None for entry in entries]
+
+
+def cache_set_many(items: Dict[str, bytes], ttl: int, compute_seconds: float = 0.0):
+    """SETEX for every body and one invalidation message in a single pipelined round trip."""
+    if not items:
+        return
+    pipe = _get_binary_redis().pipeline(transaction=False)
+    raws = {key: _wrap(body, ttl, compute_seconds) for key, body in items.items()}
+    for key, raw in raws.items():
+        pipe.setex(key, ttl + CACHE_STALE_SECONDS, raw)
+    _publish_invalidation(pipe, list(raws))
+    pipe.execute()
+    for key, raw in raws.items():
+        _local.set(key, _unwrap(raw))
+
+
+def read_through_many(ids: List, key_fn: Callable[[Any], str], load: Callable[[List], Dict[Any, bytes]],
+                      ttl: int) -> Dict[Any, bytes]:
+    """
+    Batch read-through: cached bodies are fetched with one MGET, the misses are
+    loaded with one `load(missing_ids)` call and written back in one pipeline.
+    Returns {id: body} for the ids that have a value.
+    """
+    keys = [key_fn(item_id) for item_id in ids]
+    try:
+        cached = cache_get_many(keys)
+    except redis.exceptions.RedisError as e:
+        print(f"Redis connection error: {e}")
+        cached = [None] * len(keys)
+
+    found = {item_id: body for item_id, body in zip(ids, cached) if body}
+    missing = [item_id for item_id in ids if item_id not in found]
+    print(f"BATCH CACHE: {len(found)} hits, {len(missing)} misses")
+    if missing:
+        started = time.perf_counter()
+        loaded = load(missing)
+        try:
+            cache_set_many({key_fn(item_id): body for item_id, body in loaded.items()}, ttl,
+                           time.perf_counter() - started)
+        except redis.exceptions.RedisError as e:
+            print(f"Could not write to Redis: {e}")
+        found.update(loaded)
+    return found
+
+
+def cache_stats() -> dict:
+    """Per-tier hit ratios of this worker and the size of its local tier."""
+    return {
+        "Local": _stats["local"].to_dict(),
+        "Redis": _stats["redis"].to_dict(),
+        "LocalItems": len(_local),
+        "LocalMaxItems": _local.max_items,
+    }
+
+
+def _listen_for_invalidations():
+    while True:
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            # Messages may have been missed while disconnected
+            _local.clear()
+            for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                payload = json.loads(message["data"])
+                if payload.get("origin") != _origin():
+                    _local.delete(payload.get("keys", []))
+        except Exception as e:
+            print(f"Cache invalidation listener error: {e}")
+            _local.clear()
+            time.sleep(1)
 
 
-def cache_set(key: str, value: Any, ttl: int):
-    _get_redis().setex(key, ttl, json.dumps(value))
+def start_invalidation_listener():
+    """Subscribes this worker to cache invalidations once per process (safe after fork)."""
+    global _listener_pid
+    if _local.max_items <= 0 or _listener_pid == os.getpid():
+        return
+    _listener_pid = os.getpid()
+    _local.clear()
+    threading.Thread(target=_listen_for_invalidations, name="cache-invalidation", daemon=True).start()
@@ -0,0 +1,12 @@
+# Import every model so relationship() names (e.g. "ClickModel") resolve
+# no matter which models the resources import directly.
+from analyze_ads_rest_api.models.advertiser import AdvertiserModel
+from analyze_ads_rest_api.models.campaign import CampaignModel
+from analyze_ads_rest_api.models.click import ClickModel
+from analyze_ads_rest_api.models.daily_stats import (AdvertiserDailyStatsModel, CampaignDailyStatsModel,
+                                                     RollupWatermarkModel, UserDailyStatsModel)
+from analyze_ads_rest_api.models.event import EventModel
+from analyze_ads_rest_api.models.user import UserModel
+
+__all__ = ["AdvertiserModel", "CampaignModel", "ClickModel", "AdvertiserDailyStatsModel", "CampaignDailyStatsModel",
+           "RollupWatermarkModel", "UserDailyStatsModel", "EventModel", "UserModel"]
@@ -0,0 +1,41 @@
+from analyze_ads_rest_api.db import db
+
+# Daily rollups of Events/Clicks maintained by `rollup.refresh_rollups`.
+# No foreign keys: the tables are derived data and are rewritten by upserts.
+# Money uses exact DECIMAL like the source AdCost/AdRevenue columns (MySQL FLOAT
+# keeps ~7 significant digits, not enough for advertiser totals).
+
+
+class CampaignDailyStatsModel(db.Model):
+    __tablename__ = "CampaignDailyStats"
+
+    CampaignID = db.Column(db.String(36), primary_key=True)
+    StatDate = db.Column(db.Date, primary_key=True)
+    Impressions = db.Column(db.Integer, nullable=False, default=0)
+    Clicks = db.Column(db.Integer, nullable=False, default=0)
+    TotalCost = db.Column(db.Numeric(16, 4), nullable=False, default=0)
+
+
+class AdvertiserDailyStatsModel(db.Model):
+    __tablename__ = "AdvertiserDailyStats"
+
+    AdvertiserID = db.Column(db.Integer, primary_key=True)
+    StatDate = db.Column(db.Date, primary_key=True)
+    TotalSpend = db.Column(db.Numeric(16, 4), nullable=False, default=0)
+
+
+class UserDailyStatsModel(db.Model):
+    __tablename__ = "UserDailyStats"
+
+    UserID = db.Column(db.Integer, primary_key=True)
+    StatDate = db.Column(db.Date, primary_key=True)
+    Clicks = db.Column(db.Integer, nullable=False, default=0)
+    Revenue = db.Column(db.Numeric(16, 4), nullable=False, default=0)
+
+
+class RollupWatermarkModel(db.Model):
+    """Latest event timestamp covered by the rollups (one row, written with them)."""
+    __tablename__ = "RollupWatermark"
+
+    Name = db.Column(db.String(32), primary_key=True)
+    MaxTimestamp = db.Column(db.DateTime, nullable=True)
@@ -1,20 +1,49 @@
-from datetime import timedelta
+from datetime import datetime
+from typing import Dict, List
 
-import redis
-from flask import jsonify
 from flask.views import MethodView
 from flask_smorest import Blueprint
 from sqlalchemy import func
 
-from analyze_ads_rest_api.cache import cache_get, cache_set
+from analyze_ads_rest_api.cache import read_through, read_through_many
 from analyze_ads_rest_api.db import db
-from analyze_ads_rest_api.models.advertiser import AdvertiserModel
-from analyze_ads_rest_api.models.campaign import CampaignModel
-from analyze_ads_rest_api.models.event import EventModel
-from analyze_ads_rest_api.schemas import AdvertiserSpendingSchema
+from analyze_ads_rest_api.models.daily_stats import AdvertiserDailyStatsModel
+from analyze_ads_rest_api.responses import encode_body, json_response, stream_json_array
+from analyze_ads_rest_api.rollup import window_dates
+from analyze_ads_rest_api.schemas import AdvertiserBatchRequestSchema, AdvertiserSpendingSchema
+from analyze_ads_rest_api.watermark import get_max_ts, watermark_token
 
 blp = Blueprint("AdvertiserSpending", __name__, description="Advertiser Spending")
 
+CACHE_TTL = 30  # seconds
+
+_schema = AdvertiserSpendingSchema()
+
+
+def cache_key(advertiser_id: int, max_ts: datetime) -> str:
+    return f"advertiser:{advertiser_id}:spending:{watermark_token(max_ts)}"
+
+
+def query_spending(advertiser_ids: List[int], max_ts: datetime) -> Dict[int, dict]:
+    """Sums the daily rollup rows of the 30-day window for all advertisers in one grouped query."""
+    start_date, end_date = window_dates(max_ts)
+    rows = db.session.query(
+        AdvertiserDailyStatsModel.AdvertiserID,
+        func.sum(AdvertiserDailyStatsModel.TotalSpend).label("TotalSpend")
+    ).filter(
+        AdvertiserDailyStatsModel.AdvertiserID.in_(advertiser_ids),
+        AdvertiserDailyStatsModel.StatDate.between(start_date, end_date)
+    ).group_by(AdvertiserDailyStatsModel.AdvertiserID) \
+        .all()
+    return {row.AdvertiserID: {"AdvertiserID": row.AdvertiserID, "TotalSpend": float(row.TotalSpend or 0.0)}
+            for row in rows}
+
+
+def spending_bodies(advertiser_ids: List[int], max_ts: datetime) -> Dict[int, bytes]:
+    """Response bodies as the endpoint schema dumps them, ready to cache and send."""
+    return {advertiser_id: encode_body(_schema.dump(result))
+            for advertiser_id, result in query_spending(advertiser_ids, max_ts).items()}
+
 
 @blp.route("/advertiser/<int:advertiser_id>/spending")
 class AdvertiserSpendingResource(MethodView):
@@ -23,52 +52,40 @@ class AdvertiserSpendingResource(MethodView):
     def get(self, advertiser_id):
         """
         Returns an advertiser’s total ad spend.
-        Implements a read-through cache with a 5-minute TTL.
+        Implements a read-through cache with a 30-second TTL: concurrent misses
+        run one query, and expired values are served stale while they are refreshed.
+        The cache key includes the data watermark, so new events invalidate it.
+        The cache holds the encoded response, which is sent without re-serialization.
         """
-        cache_key = f"advertiser:{advertiser_id}:spending"
-
-        # 1. Check Redis cache
-        try:
-            cached_data = cache_get(cache_key)
-            if cached_data:
-                print(f"CACHE HIT for advertiser {advertiser_id}")
-                return jsonify(cached_data)
-        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError) as e:
-            print(f"Redis connection error: {e}")
-
-        print(f"CACHE MISS for advertiser {advertiser_id}")
-        max_ts = db.session.query(func.max(EventModel.Timestamp)).scalar()
+        max_ts = get_max_ts()
         if not max_ts:
             return {"AdvertiserID": advertiser_id, "TotalSpend": 0.0}
 
-        start_ts = max_ts - timedelta(days=30)
-
-        result = db.session.query(
-            AdvertiserModel.AdvertiserID,
-            func.sum(EventModel.AdCost).label("TotalSpend")
-        ).join(CampaignModel, AdvertiserModel.AdvertiserID == CampaignModel.AdvertiserID) \
-            .join(EventModel, CampaignModel.CampaignID == EventModel.CampaignID) \
-            .filter(
-            AdvertiserModel.AdvertiserID == advertiser_id,
-            EventModel.Timestamp.between(start_ts, max_ts)
-        ).group_by(AdvertiserModel.AdvertiserID) \
-            .first()
-
-        if result:
-            result = result._asdict()  # Convert SQLAlchemy result to dict
-
-            # 3. Store the result in Redis with a 30-second TTL
-            try:
-                cache_set(cache_key, result, 30)
-            except (redis.exceptions.ConnectionError, redis.exceptions.RedisError) as e:
-                print(f"Could not write to Redis: {e}")
-
-            return {
-                "AdvertiserID": result["AdvertiserID"],
-                "TotalSpend": float(result["TotalSpend"] or 0.0)
-            }
-        else:
-            return {
-                "AdvertiserID": advertiser_id,
-                "TotalSpend": 0.0
-            }
+        # Single flight on misses, stale-while-revalidate and early refresh on hits
+        body = read_through(cache_key(advertiser_id, max_ts),
+                            lambda: spending_bodies([advertiser_id], max_ts).get(advertiser_id), CACHE_TTL)
+        if body is None:
+            return {"AdvertiserID": advertiser_id, "TotalSpend": 0.0}
+        return json_response(body)
+
+
+@blp.route("/advertisers/spending")
+class AdvertiserSpendingBatchResource(MethodView):
+
+    @blp.arguments(AdvertiserBatchRequestSchema)
+    @blp.response(200, AdvertiserSpendingSchema(many=True))
+    def post(self, payload):
+        """
+        Returns total ad spend for many advertisers in one call.
+        Cached advertisers are read with one Redis MGET, the rest with one grouped SQL
+        query and written back with a pipelined SETEX. Advertisers without spend in
+        the window get 0.0. The JSON array is streamed in request order.
+        """
+        advertiser_ids = list(dict.fromkeys(payload["AdvertiserIDs"]))
+        max_ts = get_max_ts()
+        spending = {}
+        if max_ts:
+            spending = read_through_many(advertiser_ids, lambda advertiser_id: cache_key(advertiser_id, max_ts),
+                                         lambda missing: spending_bodies(missing, max_ts), CACHE_TTL)
+        return stream_json_array(spending.get(advertiser_id, {"AdvertiserID": advertiser_id, "TotalSpend": 0.0})
+                                 for advertiser_id in advertiser_ids)
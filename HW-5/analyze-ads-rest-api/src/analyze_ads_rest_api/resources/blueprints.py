@@ -1,5 +1,8 @@
 from analyze_ads_rest_api.resources.advertiser_spending import blp as AdvertiserSpendingBlueprint
 from analyze_ads_rest_api.resources.campaign_performance import blp as CampaignPerformance
+from .cache_stats import blp as CacheStatsBlueprint
 from .user_engagement import blp as UserEngagementBlueprint
+from .watermark import blp as WatermarkBlueprint
 
-__all__ = ["CampaignPerformance", "AdvertiserSpendingBlueprint", "UserEngagementBlueprint"]
+__all__ = ["CampaignPerformance", "AdvertiserSpendingBlueprint", "UserEngagementBlueprint", "WatermarkBlueprint",
+           "CacheStatsBlueprint"]
@@ -0,0 +1,19 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from analyze_ads_rest_api.cache import cache_stats
+from analyze_ads_rest_api.schemas import CacheStatsSchema
+
+blp = Blueprint("CacheStats", __name__, description="Hit ratios of the in-process and Redis cache tiers")
+
+
+@blp.route("/cache/stats")
+class CacheStatsResource(MethodView):
+
+    @blp.response(200, CacheStatsSchema)
+    def get(self):
+        """
+        Returns hit/miss counters per cache tier for the worker that serves the request.
+        Redis counters only cover lookups that missed the local tier.
+        """
+        return cache_stats()
@@ -1,20 +1,62 @@
-from datetime import timedelta
+from datetime import datetime
+from typing import Dict, List
 
-import redis
-from flask import jsonify
 from flask.views import MethodView
 from flask_smorest import Blueprint
 from sqlalchemy import func
 
-from analyze_ads_rest_api.cache import cache_get, cache_set
+from analyze_ads_rest_api.cache import read_through, read_through_many
 from analyze_ads_rest_api.db import db
 from analyze_ads_rest_api.models.campaign import CampaignModel
-from analyze_ads_rest_api.models.click import ClickModel
-from analyze_ads_rest_api.models.event import EventModel
-from analyze_ads_rest_api.schemas import CampaignPerformanceSchema
+from analyze_ads_rest_api.models.daily_stats import CampaignDailyStatsModel
+from analyze_ads_rest_api.responses import encode_body, json_response, stream_json_array
+from analyze_ads_rest_api.rollup import window_dates
+from analyze_ads_rest_api.schemas import CampaignBatchRequestSchema, CampaignPerformanceSchema
+from analyze_ads_rest_api.watermark import get_max_ts, watermark_token
 
 blp = Blueprint("CampaignPerformance", __name__, description="Campaign Performance Endpoints")
 
+CACHE_TTL = 30  # seconds
+
+_schema = CampaignPerformanceSchema()
+
+
+def cache_key(campaign_id: str, max_ts: datetime) -> str:
+    return f"campaign:{campaign_id}:performance:{watermark_token(max_ts)}"
+
+
+def query_performance(campaign_ids: List[str], max_ts: datetime) -> Dict[str, dict]:
+    """Sums the daily rollup rows of the 30-day window for all campaigns in one grouped query."""
+    start_date, end_date = window_dates(max_ts)
+    rows = db.session.query(
+        CampaignModel.CampaignID,
+        CampaignModel.CampaignName,
+        func.sum(CampaignDailyStatsModel.Impressions).label("Impressions"),
+        func.sum(CampaignDailyStatsModel.Clicks).label("Clicks"),
+        func.coalesce(func.sum(CampaignDailyStatsModel.TotalCost), 0).label("TotalCost"),
+    ).join(CampaignDailyStatsModel, CampaignModel.CampaignID == CampaignDailyStatsModel.CampaignID) \
+        .filter(
+        CampaignModel.CampaignID.in_(campaign_ids),
+        CampaignDailyStatsModel.StatDate.between(start_date, end_date)
+    ).group_by(CampaignModel.CampaignID, CampaignModel.CampaignName) \
+        .all()
+
+    performance = {}
+    for row in rows:
+        ctr = (row.Clicks / row.Impressions) * 100 if row.Impressions else 0
+        performance[row.CampaignID] = {
+            "CampaignID": row.CampaignID, "CampaignName": row.CampaignName,
+            "Impressions": int(row.Impressions), "Clicks": int(row.Clicks),
+            "TotalCost": float(row.TotalCost or 0), "CTR": round(ctr, 4),
+        }
+    return performance
+
+
+def performance_bodies(campaign_ids: List[str], max_ts: datetime) -> Dict[str, bytes]:
+    """Response bodies as the endpoint schema dumps them, ready to cache and send."""
+    return {campaign_id: encode_body(_schema.dump(result))
+            for campaign_id, result in query_performance(campaign_ids, max_ts).items()}
+
 
 @blp.route("/campaign/<string:campaign_id>/performance")
 class CampaignPerformanceResource(MethodView):
@@ -23,67 +65,41 @@ class CampaignPerformanceResource(MethodView):
     def get(self, campaign_id):
         """
         Retrieves CTR, clicks, impressions, and ad spend for a campaign.
-        Implements a read-through cache with a 30-second TTL.
+        Implements a read-through cache with a 30-second TTL: concurrent misses
+        run one query, and expired values are served stale while they are refreshed.
+        The cache key includes the data watermark, so new events invalidate it.
+        The cache holds the encoded response, which is sent without re-serialization.
         """
-        cache_key = f"campaign:{campaign_id}:performance"
-        # 1. Check Redis cache first
-        try:
-            cached_data = cache_get(cache_key)
-            if cached_data:
-                print(f"CACHE HIT for campaign {campaign_id}")
-                return jsonify(cached_data)
-        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError) as e:
-            print(f"Redis connection error: {e}")
-            # If Redis is down, proceed to query the database directly
-
-        print(f"CACHE MISS for campaign {campaign_id}")
-        # 2. If not in cache, query the database
-        max_ts = db.session.query(func.max(EventModel.Timestamp)).scalar()
+        max_ts = get_max_ts()
         if not max_ts:
             return {"message": "No events found"}, 404
 
-        start_range = max_ts - timedelta(days=30)
-
-        # Subquery with filter
-        events_query = db.session.query(
-            EventModel.EventID,
-            EventModel.AdCost,
-            EventModel.CampaignID
-        ).filter(
-            EventModel.CampaignID == campaign_id,
-            EventModel.Timestamp.between(start_range, max_ts)
-        ).subquery()
-
-        # Clicks subquery
-        clicks_query = db.session.query(
-            ClickModel.EventID.label('ClickedEventID')
-        ).join(events_query, ClickModel.EventID == events_query.c.EventID).subquery()
-
-        # Final aggregation
-        result = db.session.query(
-            CampaignModel.CampaignID,
-            CampaignModel.CampaignName,
-            func.count(events_query.c.EventID).label("Impressions"),
-            func.count(clicks_query.c.ClickedEventID).label("Clicks"),
-            func.coalesce(func.sum(events_query.c.AdCost), 0).label("TotalCost"),
-        ).join(events_query, CampaignModel.CampaignID == events_query.c.CampaignID) \
-            .outerjoin(clicks_query, events_query.c.EventID == clicks_query.c.ClickedEventID) \
-            .group_by(CampaignModel.CampaignID, CampaignModel.CampaignName) \
-            .first()
-
-        if result is None:
+        # Single flight on misses, stale-while-revalidate and early refresh on hits
+        body = read_through(cache_key(campaign_id, max_ts),
+                            lambda: performance_bodies([campaign_id], max_ts).get(campaign_id), CACHE_TTL)
+        if body is None:
             return {"message": "Campaign not found or no events in range"}, 404
+        return json_response(body)
+
 
-        ctr = (result.Clicks / result.Impressions) * 100 if result.Impressions else 0
-        result = result._asdict()  # Convert SQLAlchemy result to dict
-        result["CTR"] = round(ctr, 4)
+@blp.route("/campaigns/performance")
+class CampaignPerformanceBatchResource(MethodView):
 
-        # 3. Store the result in Redis with a 30-second TTL
-        try:
-            cache_set(cache_key, result, 30)
-        except (redis.exceptions.ConnectionError, redis.exceptions.RedisError) as e:
-            print(f"Could not write to Redis: {e}")
+    @blp.arguments(CampaignBatchRequestSchema)
+    @blp.response(200, CampaignPerformanceSchema(many=True))
+    def post(self, payload):
+        """
+        Retrieves performance for many campaigns in one call.
+        Cached campaigns are read with one Redis MGET, the rest with one grouped SQL
+        query and written back with a pipelined SETEX. Campaigns without events in
+        the window are omitted. The JSON array is streamed in request order.
+        """
+        campaign_ids = list(dict.fromkeys(payload["CampaignIDs"]))
+        max_ts = get_max_ts()
+        if not max_ts:
+            return stream_json_array([])
 
-        return {"CampaignID": result["CampaignID"], "CampaignName": result["CampaignName"],
-                "Impressions": result["Impressions"], "Clicks": result["Clicks"],
-                "TotalCost": float(result["TotalCost"] or 0), "CTR": result["CTR"]}
+        performance = read_through_many(campaign_ids, lambda campaign_id: cache_key(campaign_id, max_ts),
+                                        lambda missing: performance_bodies(missing, max_ts), CACHE_TTL)
+        return stream_json_array(performance[campaign_id] for campaign_id in campaign_ids
+                                 if campaign_id in performance)
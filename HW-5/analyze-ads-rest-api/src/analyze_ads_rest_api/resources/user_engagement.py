@@ -1,14 +1,12 @@
-from datetime import timedelta
-
 from flask.views import MethodView
 from flask_smorest import Blueprint
 from sqlalchemy import func
 
 from analyze_ads_rest_api.db import db
-from analyze_ads_rest_api.models.click import ClickModel
-from analyze_ads_rest_api.models.event import EventModel
-from analyze_ads_rest_api.models.user import UserModel
+from analyze_ads_rest_api.models.daily_stats import UserDailyStatsModel
+from analyze_ads_rest_api.rollup import window_dates
 from analyze_ads_rest_api.schemas import UserEngagementSchema
+from analyze_ads_rest_api.watermark import get_max_ts
 
 blp = Blueprint("UserEngagement", __name__, description="User Engagement Endpoints")
 
@@ -22,28 +20,26 @@ class UserEngagementResource(MethodView):
         Returns ads a user engaged with (clicked).
         No caching is applied to this endpoint as per the requirements.
         """
-        max_ts = db.session.query(func.max(EventModel.Timestamp)).scalar()
+        max_ts = get_max_ts()
         if not max_ts:
             return {"UserID": user_id, "TotalClicks": 0, "TotalRevenueGenerated": 0.0}
 
-        start_ts = max_ts - timedelta(days=30)
+        start_date, end_date = window_dates(max_ts)
 
         result = db.session.query(
-            UserModel.UserID,
-            func.count(ClickModel.EventID).label("TotalClicks"),
-            func.sum(ClickModel.AdRevenue).label("TotalRevenueGenerated")
-        ).join(EventModel, EventModel.UserID == UserModel.UserID) \
-            .join(ClickModel, ClickModel.EventID == EventModel.EventID) \
-            .filter(
-            UserModel.UserID == user_id,
-            EventModel.Timestamp.between(start_ts, max_ts)
-        ).group_by(UserModel.UserID) \
+            UserDailyStatsModel.UserID,
+            func.sum(UserDailyStatsModel.Clicks).label("TotalClicks"),
+            func.sum(UserDailyStatsModel.Revenue).label("TotalRevenueGenerated")
+        ).filter(
+            UserDailyStatsModel.UserID == user_id,
+            UserDailyStatsModel.StatDate.between(start_date, end_date)
+        ).group_by(UserDailyStatsModel.UserID) \
             .first()
 
         if result:
             return {
                 "UserID": result.UserID,
-                "TotalClicks": result.TotalClicks or 0,
+                "TotalClicks": int(result.TotalClicks or 0),
                 "TotalRevenueGenerated": float(result.TotalRevenueGenerated or 0.0)
             }
         else:
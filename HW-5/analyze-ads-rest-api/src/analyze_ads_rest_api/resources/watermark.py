@@ -0,0 +1,30 @@
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from analyze_ads_rest_api.schemas import WatermarkSchema
+from analyze_ads_rest_api.watermark import get_max_ts, refresh_watermark
+
+blp = Blueprint("Watermark", __name__, description="Data watermark used for the 30-day window and cache keys")
+
+
+@blp.route("/watermark")
+class WatermarkResource(MethodView):
+
+    @blp.response(200, WatermarkSchema)
+    def get(self):
+        """
+        Returns the latest event timestamp covered by the rollups that the API currently uses.
+        """
+        return {"MaxTimestamp": get_max_ts()}
+
+
+@blp.route("/watermark/refresh")
+class WatermarkRefreshResource(MethodView):
+
+    @blp.response(200, WatermarkSchema)
+    def post(self):
+        """
+        Re-reads the rolled-up watermark from the database and shares it with all workers.
+        New events become visible only after `refresh_rollups`, which publishes it itself.
+        """
+        return {"MaxTimestamp": refresh_watermark()}
@@ -0,0 +1,77 @@
+"""Response helpers shared by the resources.
+
+Cached results are stored as ready-to-send JSON bytes (``encode_body``), so a cache
+hit is returned with ``json_response`` without decoding, schema dumping or
+re-encoding. Bodies of at least ``RESPONSE_COMPRESS_MIN_BYTES`` bytes are stored
+gzip-compressed and sent as-is to clients that accept gzip.
+"""
+import gzip
+import json
+import os
+from typing import Any, Iterable, Iterator
+
+from flask import Response, request, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # orjson is optional: fall back to the standard library encoder
+    orjson = None
+
+# 0 disables compression of cached bodies
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", 0))
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def encode_body(data: Any) -> bytes:
+    """Serializes an already dumped (schema-shaped) result into the bytes to cache and send."""
+    body = dumps(data)
+    if RESPONSE_COMPRESS_MIN_BYTES and len(body) >= RESPONSE_COMPRESS_MIN_BYTES:
+        return gzip.compress(body, compresslevel=5)
+    return body
+
+
+def _is_compressed(body: bytes) -> bool:
+    return body[:2] == _GZIP_MAGIC
+
+
+def decode_body(body: bytes) -> bytes:
+    """Plain JSON bytes of an encoded body."""
+    return gzip.decompress(body) if _is_compressed(body) else body
+
+
+def json_response(body: bytes, status: int = 200) -> Response:
+    """
+    Sends an encoded body unchanged. Returning a Response from a `@blp.response`
+    view skips the schema dump while the schema still documents the endpoint.
+    """
+    response = Response(status=status, mimetype="application/json")
+    if _is_compressed(body):
+        response.vary.add("Accept-Encoding")
+        if "gzip" in request.accept_encodings:
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            body = gzip.decompress(body)
+    response.set_data(body)
+    return response
+
+
+def _json_array(items: Iterable[Any]) -> Iterator[bytes]:
+    yield b"["
+    for i, item in enumerate(items):
+        yield (b"," if i else b"") + (decode_body(item) if isinstance(item, bytes) else dumps(item))
+    yield b"]"
+
+
+def stream_json_array(items: Iterable[Any]) -> Response:
+    """
+    Streams a JSON array item by item instead of building the whole body in memory.
+    Items may be encoded bodies (written as-is) or plain data.
+    """
+    return Response(stream_with_context(_json_array(items)), mimetype="application/json")
@@ -0,0 +1,122 @@
+"""Daily rollups behind the performance endpoints.
+
+`CampaignDailyStats`, `AdvertiserDailyStats` and `UserDailyStats` hold one row
+per entity and day, so a 30-day window is a sum over at most 30 rows instead of
+a join over `Events` and `Clicks`. `refresh_rollups` recomputes the last
+``ROLLUP_LOOKBACK_DAYS`` rolled-up days (at least the 30-day window, so late or
+backfilled events for those days are picked up) and every newer day with
+`INSERT ... SELECT ... ON DUPLICATE KEY UPDATE` and, in the same transaction,
+records the latest event timestamp it covered in `RollupWatermark`. That row is
+the API watermark (see watermark.py), so the window and the cache keys only
+move once the rollups for the new data exist; `main` then publishes it.
+
+Run it after each ingest: ``poetry run refresh_rollups`` (``--full`` rebuilds
+all days), or keep it running with ``--interval SECONDS`` (the ``rollup``
+service in docker-compose.yml does this).
+"""
+import argparse
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Tuple
+
+from sqlalchemy import func, text
+
+from analyze_ads_rest_api.db import db
+from analyze_ads_rest_api.models.daily_stats import RollupWatermarkModel
+from analyze_ads_rest_api.models.event import EventModel
+from analyze_ads_rest_api.watermark import ROLLUP_WATERMARK_NAME, last_rolled_up_day, refresh_watermark
+
+WINDOW_DAYS = 30
+# Days before the last rolled-up day that are recomputed on every run; never less than the window
+ROLLUP_LOOKBACK_DAYS = max(int(os.getenv("ROLLUP_LOOKBACK_DAYS", WINDOW_DAYS)), WINDOW_DAYS)
+ROLLUP_REFRESH_INTERVAL = int(os.getenv("ROLLUP_REFRESH_INTERVAL", 0))
+
+CAMPAIGN_ROLLUP_SQL = """
+INSERT INTO CampaignDailyStats (CampaignID, StatDate, Impressions, Clicks, TotalCost)
+SELECT e.CampaignID, DATE(e.Timestamp), COUNT(*), COUNT(cl.EventID), COALESCE(SUM(e.AdCost), 0)
+FROM Events e
+LEFT JOIN Clicks cl ON cl.EventID = e.EventID
+WHERE e.Timestamp >= :since
+GROUP BY e.CampaignID, DATE(e.Timestamp)
+ON DUPLICATE KEY UPDATE
+    Impressions = VALUES(Impressions), Clicks = VALUES(Clicks), TotalCost = VALUES(TotalCost)
+"""
+
+# Built from the campaign rollup: one row per campaign and day instead of every event
+ADVERTISER_ROLLUP_SQL = """
+INSERT INTO AdvertiserDailyStats (AdvertiserID, StatDate, TotalSpend)
+SELECT c.AdvertiserID, s.StatDate, SUM(s.TotalCost)
+FROM CampaignDailyStats s
+JOIN Campaigns c ON c.CampaignID = s.CampaignID
+WHERE s.StatDate >= DATE(:since)
+GROUP BY c.AdvertiserID, s.StatDate
+ON DUPLICATE KEY UPDATE TotalSpend = VALUES(TotalSpend)
+"""
+
+USER_ROLLUP_SQL = """
+INSERT INTO UserDailyStats (UserID, StatDate, Clicks, Revenue)
+SELECT e.UserID, DATE(e.Timestamp), COUNT(*), COALESCE(SUM(cl.AdRevenue), 0)
+FROM Events e
+JOIN Clicks cl ON cl.EventID = e.EventID
+WHERE e.Timestamp >= :since
+GROUP BY e.UserID, DATE(e.Timestamp)
+ON DUPLICATE KEY UPDATE Clicks = VALUES(Clicks), Revenue = VALUES(Revenue)
+"""
+
+
+def window_dates(max_ts: datetime) -> Tuple[date, date]:
+    """The 30 calendar days ending with the watermark day."""
+    end = max_ts.date()
+    return end - timedelta(days=WINDOW_DAYS - 1), end
+
+
+def refresh_rollups(full: bool = False) -> datetime:
+    """
+    Recomputes the rollups from `ROLLUP_LOOKBACK_DAYS` before the last rolled-up
+    day (or from the start with `full`).
+    """
+    last_day = None if full else last_rolled_up_day()
+    if last_day:
+        since = datetime.combine(last_day - timedelta(days=ROLLUP_LOOKBACK_DAYS), datetime.min.time())
+    else:
+        since = datetime(1970, 1, 1)
+    # Read before aggregating: events inserted meanwhile may be rolled up too, but
+    # the watermark never claims events the rollups do not contain
+    max_ts = db.session.query(func.max(EventModel.Timestamp)).scalar()
+    for sql in (CAMPAIGN_ROLLUP_SQL, ADVERTISER_ROLLUP_SQL, USER_ROLLUP_SQL):
+        db.session.execute(text(sql), {"since": since})
+    db.session.merge(RollupWatermarkModel(Name=ROLLUP_WATERMARK_NAME, MaxTimestamp=max_ts))
+    db.session.commit()
+    return since
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the daily stats tables used by the REST API.")
+    parser.add_argument("--full", action="store_true", help="recompute all days instead of the latest ones")
+    parser.add_argument("--interval", type=int, default=ROLLUP_REFRESH_INTERVAL,
+                        help="repeat every N seconds (0 runs once); only the first run honours --full")
+    args = parser.parse_args()
+
+    from analyze_ads_rest_api.app import server
+
+    full = args.full
+    while True:
+        try:
+            with server.app_context():
+                since = refresh_rollups(full=full)
+                max_ts = refresh_watermark()
+                db.session.remove()
+            print(f"Daily stats refreshed from {since:%Y-%m-%d}; watermark: {max_ts}")
+            full = False
+        except Exception as e:
+            if args.interval <= 0:
+                raise
+            print(f"Rollup refresh failed: {e}")
+        if args.interval <= 0:
+            return
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
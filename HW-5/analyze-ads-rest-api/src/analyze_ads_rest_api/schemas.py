@@ -1,4 +1,7 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
+
+# Upper bound on IDs per batch request (size of the SQL IN list and the Redis MGET)
+BATCH_MAX_IDS = 500
 
 
 class CampaignPerformanceSchema(Schema):
@@ -19,3 +22,28 @@ class UserEngagementSchema(Schema):
     UserID = fields.Integer(required=True)
     TotalClicks = fields.Integer()
     TotalRevenueGenerated = fields.Float()
+
+
+class CampaignBatchRequestSchema(Schema):
+    CampaignIDs = fields.List(fields.Str(), required=True, validate=validate.Length(min=1, max=BATCH_MAX_IDS))
+
+
+class AdvertiserBatchRequestSchema(Schema):
+    AdvertiserIDs = fields.List(fields.Integer(), required=True, validate=validate.Length(min=1, max=BATCH_MAX_IDS))
+
+
+class WatermarkSchema(Schema):
+    MaxTimestamp = fields.DateTime(allow_none=True)
+
+
+class CacheTierStatsSchema(Schema):
+    Hits = fields.Integer()
+    Misses = fields.Integer()
+    HitRatio = fields.Float()
+
+
+class CacheStatsSchema(Schema):
+    Local = fields.Nested(CacheTierStatsSchema)
+    Redis = fields.Nested(CacheTierStatsSchema)
+    LocalItems = fields.Integer()
+    LocalMaxItems = fields.Integer()
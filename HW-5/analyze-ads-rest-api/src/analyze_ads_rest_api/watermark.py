@@ -0,0 +1,142 @@
+"""Data watermark: the latest event timestamp shared by all API workers.
+
+Handlers need the latest event timestamp to compute the 30-day window. The
+endpoints read the daily rollups, so the watermark is the latest timestamp the
+rollups cover (``RollupWatermark``, written by ``rollup.refresh_rollups``), not ``MAX(Events.Timestamp)``:
+the window and the cache keys move only after ``refresh_rollups`` has
+aggregated the new events, never onto days without rollup rows.
+
+Instead of querying it on every request, the value is read from Redis and kept
+in process for ``WATERMARK_LOCAL_TTL`` seconds. ``refresh_rollups`` publishes it;
+a background thread re-syncs Redis from the database every
+``WATERMARK_REFRESH_INTERVAL`` seconds (one worker at a time, guarded by a Redis
+lock), and ``POST /adtech/watermark/refresh`` or the ``refresh_watermark``
+script do it on demand.
+
+The watermark is also part of the cache keys (``watermark_token``), so cached
+results computed for an older window are never served after new data arrives.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Optional
+
+import redis
+from sqlalchemy import func
+
+from analyze_ads_rest_api.cache import _get_redis
+from analyze_ads_rest_api.db import db
+from analyze_ads_rest_api.models.daily_stats import CampaignDailyStatsModel, RollupWatermarkModel
+
+ROLLUP_WATERMARK_NAME = "daily_stats"
+WATERMARK_KEY = "adtech:watermark:max_ts"
+WATERMARK_LOCK_KEY = "adtech:watermark:refresh_lock"
+
+WATERMARK_REFRESH_INTERVAL = int(os.getenv("WATERMARK_REFRESH_INTERVAL", 60))
+WATERMARK_LOCAL_TTL = float(os.getenv("WATERMARK_LOCAL_TTL", 5))
+
+_lock = threading.Lock()
+_value: Optional[datetime] = None
+_expires_at = 0.0
+_refresher_pid = None
+
+
+def _set_local(value: Optional[datetime]) -> None:
+    global _value, _expires_at
+    _value = value
+    _expires_at = time.monotonic() + WATERMARK_LOCAL_TTL
+
+
+def last_rolled_up_day() -> Optional[date]:
+    return db.session.query(func.max(CampaignDailyStatsModel.StatDate)).scalar()
+
+
+def query_max_ts() -> Optional[datetime]:
+    """
+    Reads the rolled-up watermark from the database (requires an app context).
+    Falls back to the start of the last rolled-up day for rollups written before
+    `RollupWatermark` existed.
+    """
+    state = db.session.get(RollupWatermarkModel, ROLLUP_WATERMARK_NAME)
+    if state is not None:
+        return state.MaxTimestamp
+    last_day = last_rolled_up_day()
+    return datetime.combine(last_day, datetime.min.time()) if last_day else None
+
+
+def refresh_watermark() -> Optional[datetime]:
+    """Reads the rolled-up watermark from the database and publishes it to Redis."""
+    max_ts = query_max_ts()
+    try:
+        if max_ts is None:
+            _get_redis().delete(WATERMARK_KEY)
+        else:
+            _get_redis().set(WATERMARK_KEY, max_ts.isoformat())
+    except redis.exceptions.RedisError as e:
+        print(f"Could not write watermark to Redis: {e}")
+    with _lock:
+        _set_local(max_ts)
+    return max_ts
+
+
+def get_max_ts() -> Optional[datetime]:
+    """
+    Returns the current watermark: from process memory, then Redis, and only
+    if Redis has no value (first start or Redis is down) from the database.
+    """
+    with _lock:
+        if time.monotonic() < _expires_at:
+            return _value
+    try:
+        stored = _get_redis().get(WATERMARK_KEY)
+    except redis.exceptions.RedisError as e:
+        print(f"Redis connection error: {e}")
+        stored = None
+    if stored is None:
+        return refresh_watermark()
+    max_ts = datetime.fromisoformat(stored)
+    with _lock:
+        _set_local(max_ts)
+    return max_ts
+
+
+def watermark_token(max_ts: Optional[datetime]) -> str:
+    """Compact watermark representation for cache keys."""
+    return max_ts.strftime("%Y%m%d%H%M%S") if max_ts else "none"
+
+
+def _refresh_loop(app) -> None:
+    while True:
+        time.sleep(WATERMARK_REFRESH_INTERVAL)
+        try:
+            # Only one worker per interval queries the database
+            if not _get_redis().set(WATERMARK_LOCK_KEY, os.getpid(), nx=True, ex=WATERMARK_REFRESH_INTERVAL):
+                continue
+            with app.app_context():
+                refresh_watermark()
+                db.session.remove()
+        except Exception as e:
+            print(f"Watermark refresh failed: {e}")
+
+
+def start_refresher(app) -> None:
+    """Starts the background refresh thread once per process (safe after fork)."""
+    global _refresher_pid
+    if WATERMARK_REFRESH_INTERVAL <= 0 or _refresher_pid == os.getpid():
+        return
+    _refresher_pid = os.getpid()
+    threading.Thread(target=_refresh_loop, args=(app,), name="watermark-refresh", daemon=True).start()
+
+
+def main():
+    """Refreshes the shared watermark after an ingest run."""
+    from analyze_ads_rest_api.app import server
+
+    with server.app_context():
+        max_ts = refresh_watermark()
+    print(f"Watermark refreshed: {max_ts}")
+
+
+if __name__ == "__main__":
+    main()